@@ -2,13 +2,32 @@ import streamlit as st
 import json
 import pandas as pd
 import numpy as np
-import re
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 import os
-import uuid
-import copy
+
+from utils import (read_session_note, extract_session_date, raw_content_digest, note_content_hash, spool_upload,
+                   NoteTooLargeError)
+from client_identity import extract_client_id, get_identity_index
+from record_linkage import RecordLinkageIndex, LINKAGE_SECTIONS
+from note_schema import project_note, NoteSchemaError
+from note_store import get_raw_note_store
+from session_store import get_session_store, session_id_for_hash
+from ingest_log import get_ingest_log, merge_record
+from assessment_mapping import gad7_questions, phq9_questions
+from scoring_core import score_note
+from symptom_normalizer import INTENSITY_LEVELS, symptom_intensity_level, symptom_frequency_level
+from symptom_matching import match_symptoms, description_key
+from semantic_matching import MIN_SIMILARITY, get_symptom_vector_cache, get_symptom_history, vectors_version
+from rule_engine import get_assessment_engine
+from result_cache import get_result_cache
+from comparison_matrix import get_comparison_matrices
+from trajectories import caseload_trajectories, client_trajectory, trajectory_instruments
+from cohort import (period_score_frame, client_changes, severity_transitions, severity_distribution,
+                    symptom_prevalence)
+from ingest import expand_uploads, process_notes, log_sessions
+from replay import restore
 
 # Set page config
 st.set_page_config(
@@ -70,362 +89,141 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+# Uploaded sessions are persisted in SQLite and shared by every browser tab
+store = get_session_store()
+
+
+@st.cache_resource
+def restore_from_log():
+    """Catch the store up with the ingest log once per server, from its snapshot plus the log tail"""
+    return restore(get_ingest_log(), store)
+
+
+# Before the linkage index reads the store, so it sees restored sessions too
+restore_from_log()
+
+
+@st.cache_resource
+def get_linkage_index():
+    """Index the stored sessions once per server, reading only the note sections linkage looks at"""
+    index = RecordLinkageIndex()
+    note_store = get_raw_note_store()
+    for session_id, client_id, note_ref in store.iter_note_refs():
+        sections = {section: note_store.load_section(note_ref, section) for section in LINKAGE_SECTIONS}
+        index.add(session_id, client_id, sections)
+    return index
+
+
+# Shared by every user, like the session store it indexes
+linkage_index = get_linkage_index()
+
 # Initialize session state variables if they don't exist
-if 'uploaded_sessions' not in st.session_state:
-    st.session_state.uploaded_sessions = {}
 if 'selected_client' not in st.session_state:
     st.session_state.selected_client = None
-if 'session_comparisons' not in st.session_state:
-    st.session_state.session_comparisons = {}
-if 'client_list' not in st.session_state:
-    st.session_state.client_list = []
-
-# GAD-7 questions and mapping
-gad7_questions = {
-    1: "Feeling nervous, anxious, or on edge",
-    2: "Not being able to stop or control worrying",
-    3: "Worrying too much about different things",
-    4: "Trouble relaxing",
-    5: "Being so restless that it's hard to sit still",
-    6: "Becoming easily annoyed or irritable",
-    7: "Feeling afraid, as if something awful might happen"
-}
-
-# PHQ-9 questions and mapping
-phq9_questions = {
-    1: "Little interest or pleasure in doing things",
-    2: "Feeling down, depressed, or hopeless",
-    3: "Trouble falling/staying asleep, sleeping too much",
-    4: "Feeling tired or having little energy",
-    5: "Poor appetite or overeating",
-    6: "Feeling bad about yourself or that you're a failure or have let yourself or your family down",
-    7: "Trouble concentrating on things such as reading the newspaper or watching television",
-    8: "Moving or speaking so slowly that other people could have noticed. Or the opposite — being so fidgety or restless that you have been moving around a lot more than usual",
-    9: "Thoughts that you would be better off dead, or thoughts of hurting yourself in some way"
-}
+if 'link_proposals' not in st.session_state:
+    # Session ID -> proposed merge of its client into a similar existing client
+    st.session_state.link_proposals = {}
 
 
 # Helper functions
-def extract_client_id(json_data):
-    """Extract client identifier from session notes"""
-    # In a real application, you would have a proper client ID field
-    # For demo purposes, we'll extract from the file name or content
-    if isinstance(json_data, dict):
-        quotes = []
-        # Look for quotes in the chief complaint
-        if 'Presentation' in json_data and 'Quote (Chief Complaint)' in json_data['Presentation']:
-            return f"Client-{hash(json_data['Presentation']['Quote (Chief Complaint)']) % 1000}"
-        return f"Client-{hash(str(json_data)) % 1000}"
-    return f"Client-{hash(str(json_data)) % 1000}"
-
-def extract_symptoms(json_data):
-    """Extract symptoms and their attributes from session notes"""
-    symptoms = []
-    if isinstance(json_data, dict) and 'Psychological Factors' in json_data:
-        psych_factors = json_data['Psychological Factors']
-        if 'Symptoms' in psych_factors and isinstance(psych_factors['Symptoms'], dict):
-            for symptom_key, symptom_data in psych_factors['Symptoms'].items():
-                if isinstance(symptom_data, dict):
-                    symptom = {
-                        'description': symptom_data.get('Description', 'Unknown'),
-                        'intensity': symptom_data.get('Intensity', 'Unknown'),
-                        'frequency': symptom_data.get('Frequency', 'Unknown'),
-                        'duration': symptom_data.get('Duration', 'Unknown'),
-                        'quote': symptom_data.get('Quote (Symptom)', '')
-                    }
-                    symptoms.append(symptom)
-    
-    # Also check Mental Status Exam for additional symptoms
-    if isinstance(json_data, dict) and 'Mental Status Exam' in json_data:
-        mse = json_data['Mental Status Exam']
-        if 'Mood and Affect' in mse and mse['Mood and Affect']:
-            mood_match = re.search(r'(anxious|depressed|stressed)', mse['Mood and Affect'], re.IGNORECASE)
-            if mood_match:
-                symptoms.append({
-                    'description': f"Mood: {mood_match.group(0)}",
-                    'intensity': 'Observed',
-                    'frequency': 'During session',
-                    'duration': 'Unknown',
-                    'quote': mse['Mood and Affect']
-                })
-    
-    # Check Risk Assessment for additional concerns
-    if isinstance(json_data, dict) and 'Risk Assessment' in json_data:
-        risk = json_data['Risk Assessment']
-        if 'Hopelessness' in risk and risk['Hopelessness'] and risk['Hopelessness'] != 'NA':
-            symptoms.append({
-                'description': 'Hopelessness',
-                'intensity': 'Observed',
-                'frequency': 'Unknown',
-                'duration': 'Unknown',
-                'quote': risk.get('Quote (Risk)', risk['Hopelessness'])
-            })
-    
-    return symptoms
-
-
-def map_to_gad7(symptoms):
-    """Map extracted symptoms to GAD-7 assessment"""
-    gad7_scores = {q: 0 for q in range(1, 8)}
-    
-    for symptom in symptoms:
-        description = symptom['description'].lower() if isinstance(symptom['description'], str) else ''
-        intensity = symptom['intensity'].lower() if isinstance(symptom['intensity'], str) else ''
-        quote = symptom['quote'].lower() if isinstance(symptom['quote'], str) else ''
-        
-        # Question 1: Feeling nervous, anxious, or on edge
-        if any(keyword in description or keyword in quote for keyword in ['nervous', 'anxious', 'anxiety', 'on edge', 'stress']):
-            if 'high' in intensity or 'severe' in intensity:
-                gad7_scores[1] = 3
-            elif 'moderate' in intensity:
-                gad7_scores[1] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                gad7_scores[1] = 1
-            else:
-                gad7_scores[1] = 1  # Default if intensity not specified
-        
-        # Question 2: Not being able to stop or control worrying
-        if any(keyword in description or keyword in quote for keyword in ['worrying', 'worry', 'can\'t stop', 'uncontrollable']):
-            if 'high' in intensity or 'severe' in intensity:
-                gad7_scores[2] = 3
-            elif 'moderate' in intensity:
-                gad7_scores[2] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                gad7_scores[2] = 1
-            else:
-                gad7_scores[2] = 1
-        
-        # Question 3: Worrying too much about different things
-        if any(keyword in description or keyword in quote for keyword in ['worry too much', 'worrying about', 'different things']):
-            if 'high' in intensity or 'severe' in intensity:
-                gad7_scores[3] = 3
-            elif 'moderate' in intensity:
-                gad7_scores[3] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                gad7_scores[3] = 1
-            else:
-                gad7_scores[3] = 1
-        
-        # Question 4: Trouble relaxing
-        if any(keyword in description or keyword in quote for keyword in ['relax', 'relaxing', 'tense', 'tension']):
-            if 'high' in intensity or 'severe' in intensity:
-                gad7_scores[4] = 3
-            elif 'moderate' in intensity:
-                gad7_scores[4] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                gad7_scores[4] = 1
-            else:
-                gad7_scores[4] = 1
-        
-        # Question 5: Being so restless that it's hard to sit still
-        if any(keyword in description or keyword in quote for keyword in ['restless', 'sit still', 'agitated', 'fidgety']):
-            if 'high' in intensity or 'severe' in intensity:
-                gad7_scores[5] = 3
-            elif 'moderate' in intensity:
-                gad7_scores[5] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                gad7_scores[5] = 1
-            else:
-                gad7_scores[5] = 1
-        
-        # Question 6: Becoming easily annoyed or irritable
-        if any(keyword in description or keyword in quote for keyword in ['annoyed', 'irritable', 'irritability', 'frustrated']):
-            if 'high' in intensity or 'severe' in intensity:
-                gad7_scores[6] = 3
-            elif 'moderate' in intensity:
-                gad7_scores[6] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                gad7_scores[6] = 1
-            else:
-                gad7_scores[6] = 1
-        
-        # Question 7: Feeling afraid, as if something awful might happen
-        if any(keyword in description or keyword in quote for keyword in ['afraid', 'fear', 'terrible', 'awful', 'catastrophic']):
-            if 'high' in intensity or 'severe' in intensity:
-                gad7_scores[7] = 3
-            elif 'moderate' in intensity:
-                gad7_scores[7] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                gad7_scores[7] = 1
-            else:
-                gad7_scores[7] = 1
-    
-    # Calculate total score
-    total_score = sum(gad7_scores.values())
-    
-    # Determine severity category
-    if total_score <= 4:
-        severity = "Minimal anxiety"
-    elif total_score <= 9:
-        severity = "Mild anxiety"
-    elif total_score <= 14:
-        severity = "Moderate anxiety"
-    else:
-        severity = "Severe anxiety"
+def store_session(json_data, session_date, file_name, content_hash=None, features=None, note_ref=None,
+                  new_sessions=None, client_id=None):
+    """Add a parsed session to the uploaded sessions, skipping duplicates
+
+    Sessions keep only their extracted features and a reference to the raw
+    note on disk; json_data itself is used for client identification and
+    linkage, then dropped. The session is written to the ingest log before
+    it is stored. If new_sessions is given, the caller has already logged
+    the session (see log_sessions) and it is appended to new_sessions so the
+    comparison matrices are refreshed once for the whole batch. Returns
+    (client_id, added) where added is False if identical note content had
+    already been uploaded.
+    """
+    if content_hash is None:
+        content_hash = note_content_hash(json_data)
+    existing = store.find_session(content_hash=content_hash)
+    if existing:
+        return existing[0], False
     
-    return {
-        'scores': gad7_scores,
-        'total_score': total_score,
-        'severity': severity
+    if client_id is None:
+        client_id = extract_client_id(json_data, file_name)
+    if features is None:
+        features = score_note(json_data)
+    if note_ref is None:
+        note_ref = get_raw_note_store().put(content_hash, json_data)
+    if new_sessions is None:
+        log_sessions([{'client_id': client_id, 'date': session_date, 'file_name': file_name,
+                       'content_hash': content_hash, 'note_ref': note_ref}])
+    
+    # Store the uploaded session
+    client_id, session_id, added = store.add_session(client_id, session_date, file_name, content_hash, features, note_ref)
+    if not added:
+        return client_id, False  # Stored meanwhile from another tab
+    
+    new_session = {
+        'client_id': client_id,
+        'session_id': session_id,
+        'date': session_date,
+        'file_name': file_name,
+        'content_hash': content_hash,
+        'features': features,
+        'note_ref': note_ref
     }
+    if new_sessions is None:
+        get_comparison_matrices().refresh([client_id])
+    else:
+        new_sessions.append(new_session)
+    
+    # Propose a merge if the note looks like it belongs to a different existing client
+    matches = linkage_index.query(json_data, exclude_client=client_id)
+    if matches:
+        st.session_state.link_proposals[session_id] = {
+            'client_id': client_id,
+            'match_client_id': matches[0]['client_id'],
+            'score': matches[0]['score'],
+            'file_name': file_name
+        }
+    linkage_index.add(session_id, client_id, json_data)
+    return client_id, True
 
 
-def map_to_phq9(symptoms, json_data):
-    """Map extracted symptoms to PHQ-9 assessment"""
-    phq9_scores = {q: 0 for q in range(1, 10)}
-    
-    # Process symptoms
-    for symptom in symptoms:
-        description = symptom['description'].lower() if isinstance(symptom['description'], str) else ''
-        intensity = symptom['intensity'].lower() if isinstance(symptom['intensity'], str) else ''
-        quote = symptom['quote'].lower() if isinstance(symptom['quote'], str) else ''
-        
-        # Question 1: Little interest or pleasure in doing things
-        if any(keyword in description or keyword in quote for keyword in ['anhedonia', 'no interest', 'little interest', 'no pleasure', 'lost interest']):
-            if 'high' in intensity or 'severe' in intensity:
-                phq9_scores[1] = 3
-            elif 'moderate' in intensity:
-                phq9_scores[1] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                phq9_scores[1] = 1
-            else:
-                phq9_scores[1] = 1
-        
-        # Question 2: Feeling down, depressed, or hopeless
-        if any(keyword in description or keyword in quote for keyword in ['depressed', 'depression', 'feeling down', 'hopeless', 'despair']):
-            if 'high' in intensity or 'severe' in intensity:
-                phq9_scores[2] = 3
-            elif 'moderate' in intensity:
-                phq9_scores[2] = 2
-            elif 'mild' in intensity or 'low' in intensity:
-                phq9_scores[2] = 1
-            else:
-                phq9_scores[2] = 1
-    
-    # Check biological factors for sleep issues (Question 3)
-    if isinstance(json_data, dict) and 'Biological Factors' in json_data:
-        bio_factors = json_data['Biological Factors']
-        if 'Sleep' in bio_factors and bio_factors['Sleep'] and bio_factors['Sleep'] != 'NA':
-            sleep_issues = re.search(r'(difficulty|problem|issue|trouble|insomnia|too much|oversleep)', bio_factors['Sleep'], re.IGNORECASE)
-            if sleep_issues:
-                phq9_scores[3] = 2  # Default to moderate if sleep issues mentioned
-    
-    # Check for energy levels (Question 4)
-    for symptom in symptoms:
-        if any(keyword in symptom.get('description', '').lower() or keyword in symptom.get('quote', '').lower() 
-              for keyword in ['tired', 'fatigue', 'no energy', 'little energy', 'exhausted']):
-            phq9_scores[4] = 2
-    
-    # Check for appetite issues (Question 5)
-    if isinstance(json_data, dict) and 'Biological Factors' in json_data:
-        bio_factors = json_data['Biological Factors']
-        if 'Nutrition' in bio_factors and bio_factors['Nutrition'] and bio_factors['Nutrition'] != 'NA':
-            appetite_issues = re.search(r'(poor appetite|overeating|not eating|eating too much)', bio_factors['Nutrition'], re.IGNORECASE)
-            if appetite_issues:
-                phq9_scores[5] = 2
-    
-    # Question 6: Feeling bad about yourself
-    for symptom in symptoms:
-        if any(keyword in symptom.get('description', '').lower() or keyword in symptom.get('quote', '').lower() 
-              for keyword in ['worthless', 'guilt', 'failure', 'blame', 'let down', 'disappointed in self']):
-            if 'high' in symptom.get('intensity', '').lower() or 'severe' in symptom.get('intensity', '').lower():
-                phq9_scores[6] = 3
-            elif 'moderate' in symptom.get('intensity', '').lower():
-                phq9_scores[6] = 2
-            else:
-                phq9_scores[6] = 1
-    
-    # Question 7: Trouble concentrating
-    for symptom in symptoms:
-        if any(keyword in symptom.get('description', '').lower() or keyword in symptom.get('quote', '').lower() 
-              for keyword in ['concentrate', 'focus', 'attention', 'distracted']):
-            if 'high' in symptom.get('intensity', '').lower() or 'severe' in symptom.get('intensity', '').lower():
-                phq9_scores[7] = 3
-            elif 'moderate' in symptom.get('intensity', '').lower():
-                phq9_scores[7] = 2
-            else:
-                phq9_scores[7] = 1
-    
-    # Question 8: Moving or speaking slowly
-    for symptom in symptoms:
-        if any(keyword in symptom.get('description', '').lower() or keyword in symptom.get('quote', '').lower() 
-              for keyword in ['slow', 'sluggish', 'restless', 'fidgety', 'agitated', 'psychomotor']):
-            if 'high' in symptom.get('intensity', '').lower() or 'severe' in symptom.get('intensity', '').lower():
-                phq9_scores[8] = 3
-            elif 'moderate' in symptom.get('intensity', '').lower():
-                phq9_scores[8] = 2
-            else:
-                phq9_scores[8] = 1
-    
-    # Question 9: Thoughts of self-harm
-    if isinstance(json_data, dict) and 'Risk Assessment' in json_data:
-        risk = json_data['Risk Assessment']
-        if 'Suicidal Thoughts or Attempts' in risk and risk['Suicidal Thoughts or Attempts'] != 'NA' and risk['Suicidal Thoughts or Attempts'] != 'No Indication of Risk':
-            phq9_scores[9] = 3  # High risk if any suicidal thoughts are mentioned
-        elif 'Self Harm' in risk and risk['Self Harm'] != 'NA' and risk['Self Harm'] != 'No Indication of Risk':
-            phq9_scores[9] = 3  # High risk if any self-harm is mentioned
-        elif 'Hopelessness' in risk and risk['Hopelessness'] != 'NA' and risk['Hopelessness'] != 'No hopelessness expressed or observed.':
-            # Check for passive suicidal ideation in hopelessness
-            passive_si = re.search(r'(better off dead|not worth living|giving up|end it all)', risk['Hopelessness'], re.IGNORECASE)
-            if passive_si:
-                phq9_scores[9] = 2
-    
-    # Calculate total score
-    total_score = sum(phq9_scores.values())
-    
-    # Determine severity category
-    if total_score <= 4:
-        severity = "None-minimal depression"
-    elif total_score <= 9:
-        severity = "Mild depression"
-    elif total_score <= 14:
-        severity = "Moderate depression"
-    elif total_score <= 19:
-        severity = "Moderately severe depression"
-    else:
-        severity = "Severe depression"
+def merge_clients(source_client_id, target_client_id):
+    """Move all sessions of one client to another and remember the link"""
+    # Logged first, like sessions, so a replay never loses a merge the stores already hold
+    get_ingest_log().append([merge_record(source_client_id, target_client_id)])
+    store.merge_clients(source_client_id, target_client_id)
+    if st.session_state.selected_client == source_client_id:
+        st.session_state.selected_client = target_client_id
     
-    return {
-        'scores': phq9_scores,
-        'total_score': total_score,
-        'severity': severity
+    # Future notes for the source client resolve straight to the target
+    linkage_index.relabel_client(source_client_id, target_client_id)
+    get_identity_index().merge_clients(source_client_id, target_client_id)
+    get_comparison_matrices().refresh([target_client_id])
+    st.session_state.link_proposals = {
+        session_id: proposal for session_id, proposal in st.session_state.link_proposals.items()
+        if source_client_id not in (proposal['client_id'], proposal['match_client_id'])
     }
 
 
 def calculate_symptom_change(symptom1, symptom2):
     """Calculate the change in a symptom between sessions"""
-    # Map intensity levels to numeric values
-    intensity_map = {
-        'none': 0,
-        'minimal': 1,
-        'mild': 2,
-        'low': 2,
-        'moderate': 3,
-        'high': 4,
-        'severe': 5
-    }
-    
-    # Calculate intensity change
     intensity1 = symptom1['intensity'].lower() if isinstance(symptom1['intensity'], str) else 'moderate'
     intensity2 = symptom2['intensity'].lower() if isinstance(symptom2['intensity'], str) else 'moderate'
     
-    intensity1_val = next((v for k, v in intensity_map.items() if k in intensity1), 3)  # Default to moderate if not found
-    intensity2_val = next((v for k, v in intensity_map.items() if k in intensity2), 3)
+    # Compare the intensity levels normalized at extraction, defaulting to moderate if unrecognized
+    intensity1_val = symptom_intensity_level(symptom1)
+    intensity2_val = symptom_intensity_level(symptom2)
+    intensity1_val = INTENSITY_LEVELS['moderate'] if intensity1_val is None else intensity1_val
+    intensity2_val = INTENSITY_LEVELS['moderate'] if intensity2_val is None else intensity2_val
     
     intensity_change = intensity1_val - intensity2_val
     
-    # Calculate frequency change
+    # Frequency change: +1 if less frequent, -1 if more frequent, 0 if unchanged or unrecognized
+    frequency1_val = symptom_frequency_level(symptom1)
+    frequency2_val = symptom_frequency_level(symptom2)
     frequency_change = 0
-    if 'daily' in symptom1.get('frequency', '').lower() and 'occasional' in symptom2.get('frequency', '').lower():
-        frequency_change = 1
-    elif 'multiple times a day' in symptom1.get('frequency', '').lower() and 'daily' in symptom2.get('frequency', '').lower():
-        frequency_change = 1
-    elif 'occasional' in symptom1.get('frequency', '').lower() and 'rare' in symptom2.get('frequency', '').lower():
-        frequency_change = 1
-    elif 'occasional' in symptom1.get('frequency', '').lower() and 'daily' in symptom2.get('frequency', '').lower():
-        frequency_change = -1
-    elif 'daily' in symptom1.get('frequency', '').lower() and 'multiple times a day' in symptom2.get('frequency', '').lower():
-        frequency_change = -1
+    if frequency1_val is not None and frequency2_val is not None:
+        frequency_change = (frequency1_val > frequency2_val) - (frequency1_val < frequency2_val)
     
     # Calculate overall change score (-1 to +1 scale)
     change_score = (intensity_change + frequency_change) / 2
@@ -449,49 +247,77 @@ def calculate_symptom_change(symptom1, symptom2):
         'score': change_score
     }
 
-def calculate_progress(first_session_data, second_session_data):
-    """Calculate progress between two sessions"""
-    first_symptoms = extract_symptoms(first_session_data)
-    second_symptoms = extract_symptoms(second_session_data)
-    
-    # Match symptoms between sessions
-    matched_symptoms = []
-    new_symptoms = []
-    resolved_symptoms = copy.deepcopy(first_symptoms)
-    
-    for symptom2 in second_symptoms:
-        matched = False
-        for i, symptom1 in enumerate(first_symptoms):
-            if symptom1['description'].lower() == symptom2['description'].lower():
-                matched = True
-                matched_symptoms.append({
-                    'description': symptom1['description'],
-                    'first_intensity': symptom1['intensity'],
-                    'second_intensity': symptom2['intensity'],
-                    'first_frequency': symptom1['frequency'],
-                    'second_frequency': symptom2['frequency'],
-                    'change': calculate_symptom_change(symptom1, symptom2)
-                })
-                # Remove from resolved symptoms if it's still present
-                for j, resolved in enumerate(resolved_symptoms):
-                    if resolved['description'].lower() == symptom1['description'].lower():
-                        resolved_symptoms.pop(j)
-                        break
-                break
-        
-        if not matched:
-            new_symptoms.append(symptom2)
+
+# Bump when the way sessions are compared changes, so stored comparisons are computed again
+COMPARISON_CODE_VERSION = 1
+
+
+def comparison_version():
+    """Identify how comparisons are computed: the scoring rules, the symptom vectors and the comparison code"""
+    return f"{vectors_version()}-{COMPARISON_CODE_VERSION}"
+
+
+def _restore_item_scores(progress_data):
+    """Key item scores of a comparison read back from JSON by question number again"""
+    for key in ('first_gad7', 'second_gad7', 'first_phq9', 'second_phq9'):
+        progress_data[key]['scores'] = {int(item): score for item, score in progress_data[key]['scores'].items()}
+    return progress_data
+
+
+def compare_sessions(first_session, second_session):
+    """Calculate progress between two stored sessions
+
+    Comparisons are kept in memory and in the session store, keyed by both
+    sessions' content hashes and the comparison version, so a comparison
+    any user has seen costs everyone else one lookup. The store drops it
+    when either session is edited, deleted or rescored.
+    """
+    first_hash, second_hash = first_session['content_hash'], second_session['content_hash']
+    version = comparison_version()
+    
+    def load_or_compare():
+        stored = store.comparison(first_hash, second_hash, version)
+        if stored is not None:
+            return _restore_item_scores(stored)
+        progress_data = compare_session_features(first_session['features'], second_session['features'])
+        store.put_comparison(first_hash, second_hash, version, progress_data)
+        return progress_data
+    
+    return get_result_cache().get_or_compute('comparison', (first_hash, second_hash), load_or_compare)
+
+
+def compare_session_features(first_features, second_features):
+    """Calculate progress between two sessions from their extracted features"""
+    first_symptoms = first_features['symptoms']
+    second_symptoms = second_features['symptoms']
+    
+    # Match symptoms between sessions, exactly by description, else by shared words, else by similar meaning
+    matched, new_symptoms, resolved_symptoms = match_symptoms(
+        first_symptoms, second_symptoms, vectors=get_symptom_vector_cache().vectors, min_similarity=MIN_SIMILARITY
+    )
+    matched_symptoms = [
+        {
+            'description': symptom1['description'],
+            'first_intensity': symptom1['intensity'],
+            'second_intensity': symptom2['intensity'],
+            'first_frequency': symptom1['frequency'],
+            'second_frequency': symptom2['frequency'],
+            'change': calculate_symptom_change(symptom1, symptom2),
+            'second_description': symptom2['description']
+        }
+        for symptom1, symptom2 in matched
+    ]
     
     # Calculate overall progress score
     total_changes = sum(s['change']['score'] for s in matched_symptoms)
     num_symptoms = len(matched_symptoms) if matched_symptoms else 1  # Avoid division by zero
     overall_progress_score = total_changes / num_symptoms
     
-    # Map symptoms to standardized assessments
-    first_gad7 = map_to_gad7(first_symptoms)
-    second_gad7 = map_to_gad7(second_symptoms)
-    first_phq9 = map_to_phq9(first_symptoms, first_session_data)
-    second_phq9 = map_to_phq9(second_symptoms, second_session_data)
+    # Standardized assessments were scored when the sessions were uploaded
+    first_gad7 = first_features['gad7']
+    second_gad7 = second_features['gad7']
+    first_phq9 = first_features['phq9']
+    second_phq9 = second_features['phq9']
     
     return {
         'matched_symptoms': matched_symptoms,
@@ -571,8 +397,25 @@ def generate_insights(progress_data):
 st.markdown('<h1 class="main-header">Therapy Progress Tracking</h1>', unsafe_allow_html=True)
 
 # Sidebar navigation
+# A shared comparison link (?first=<session ID>&second=<session ID>) opens that comparison
+shared_ids = [st.query_params.get('first'), st.query_params.get('second')]
+shared_client = None
+if all(shared_ids):
+    shared_sessions = [store.find_session(session_id=session_id) for session_id in shared_ids]
+    if all(shared_sessions) and shared_sessions[0][0] == shared_sessions[1][0]:
+        shared_client = shared_sessions[0][0]
+
 st.sidebar.title("Navigation")
-page = st.sidebar.radio("Select a page", ["Upload Sessions", "Client Dashboard", "Session Comparison", "Help"])
+pages = ["Upload Sessions", "Client Dashboard", "Session Comparison", "Cohort", "Help"]
+if shared_client and 'page' not in st.session_state:
+    st.session_state.page = "Session Comparison"
+if shared_client and 'comparison_first' not in st.session_state:
+    st.session_state.comparison_client = shared_client
+    st.session_state.comparison_first, st.session_state.comparison_second = shared_ids
+# Keyed with no index, so the page stays selected when the shared link is cleared
+page = st.sidebar.radio("Select a page", pages, key='page')
+if page != "Session Comparison":
+    st.query_params.clear()
 
 # Upload Sessions Page
 if page == "Upload Sessions":
@@ -582,63 +425,147 @@ if page == "Upload Sessions":
     uploaded_file = st.file_uploader("Choose a JSON session file", type="txt")
     if uploaded_file is not None:
         try:
-            # Read the content
-            content = uploaded_file.read().decode()
-            # Clean the content - remove line numbers
-            clean_content = re.sub(r'^\d+\|', '', content, flags=re.MULTILINE)
-            # Parse the JSON
-            json_data = json.loads(clean_content)
-            
-            # Extract client ID and session info
-            client_id = extract_client_id(json_data)
-            session_id = str(uuid.uuid4())[:8]  # Generate a short unique ID for the session
-            
-            # Add client to list if not already there
-            if client_id not in st.session_state.client_list:
-                st.session_state.client_list.append(client_id)
+            # Copy the upload in chunks, to a temporary file once it is large, hashing it on the way
+            uploaded_file.seek(0)
+            spool, raw_digest = spool_upload(uploaded_file)
+            with spool:
+                # Streamlit reruns the script on every interaction, so skip files we have already ingested
+                existing = store.find_session(upload_digest=raw_digest)
+                if existing:
+                    client_id, _ = existing
+                    st.info(f"This session for {client_id} has already been uploaded.")
+                else:
+                    # Stream the file, removing line numbers, and parse the JSON
+                    json_data = read_session_note(spool)
+                
+                    # Validate against the note template and keep only the sections the analysis needs
+                    content_hash = note_content_hash(json_data)
+                    projected = project_note(json_data)
+                
+                    # Keep the full note on disk; it is loaded section by section when displayed
+                    note_ref = get_raw_note_store().put(content_hash, json_data)
+                
+                    # Extract the session date or use current date
+                    session_date = extract_session_date(projected)
+                    client_id, added = store_session(projected, session_date, uploaded_file.name, content_hash,
+                                                     score_note(projected), note_ref)
+                    store.record_upload_digest(raw_digest, session_id_for_hash(content_hash))
+                
+                    if added:
+                        st.success(f"Successfully uploaded session for {client_id} on {session_date}.")
+                    else:
+                        st.info(f"This session for {client_id} has already been uploaded.")
+                
+                    # Update selected client to the one just uploaded
+                    st.session_state.selected_client = client_id
             
-            # Store the uploaded session
-            if client_id not in st.session_state.uploaded_sessions:
-                st.session_state.uploaded_sessions[client_id] = {}
+        except json.JSONDecodeError:
+            st.error("The uploaded file is not valid JSON. Please check the format.")
+        except NoteSchemaError as e:
+            st.error(f"The uploaded file does not match the session note template: {str(e)}")
+        except NoteTooLargeError as e:
+            st.error(str(e))
+        except Exception as e:
+            st.error(f"An error occurred: {str(e)}")
+    
+    # Bulk upload of many notes or zip archives
+    st.markdown('<h3 class="sub-header">Bulk Upload</h3>', unsafe_allow_html=True)
+    st.write("Upload many session notes at once, or zip archives of notes. Files are parsed and scored in parallel.")
+    
+    bulk_files = st.file_uploader("Choose session files or zip archives", type=["txt", "zip"], accept_multiple_files=True)
+    max_workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1)
+    if bulk_files and st.button("Process Files"):
+        try:
+            notes = list(expand_uploads((f.name, f.getvalue()) for f in bulk_files))
+        except Exception as e:
+            st.error(f"Could not read the uploaded archives: {str(e)}")
+            notes = []
+        
+        # Skip files whose exact bytes were already ingested without parsing them again
+        digests = [raw_content_digest(raw) for _, raw in notes]
+        pending = [(note, digest) for note, digest in zip(notes, digests) if not store.find_session(upload_digest=digest)]
+        skipped = len(notes) - len(pending)
+        
+        if pending:
+            progress_bar = st.progress(0.0, text=f"Processing 0 of {len(pending)} files")
             
-            # Extract the session date or use current date
-            session_date = datetime.now().strftime("%Y-%m-%d")
-            if isinstance(json_data, dict) and 'Session Date' in json_data:
-                session_date = json_data['Session Date']
+            def update_progress(done, total):
+                progress_bar.progress(done / total, text=f"Processing {done} of {total} files")
             
-            st.session_state.uploaded_sessions[client_id][session_id] = {
-                'data': json_data,
-                'date': session_date,
-                'file_name': uploaded_file.name
-            }
+            results = process_notes([note for note, _ in pending], max_workers=max_workers, on_progress=update_progress)
             
-            st.success(f"Successfully uploaded session for {client_id} on {session_date}.")
+            # Client IDs are assigned here, not in the workers, so they stay consistent with single uploads
+            for result in results:
+                if not result['error']:
+                    result['client_id'] = extract_client_id(result['data'], result['file_name'])
+            # One log fsync for the whole batch, before any of it is stored
+            log_sessions([result for result in results
+                          if not result['error'] and not store.find_session(content_hash=result['content_hash'])])
             
-            # Update selected client to the one just uploaded
-            st.session_state.selected_client = client_id
+            errors = []
+            imported = 0
+            client_id = None
+            new_sessions = []
+            for result, (_, raw_digest) in zip(results, pending):
+                if result['error']:
+                    errors.append({'File': result['file_name'], 'Error': result['error']})
+                    continue
+                client_id, added = store_session(result['data'], result['date'], result['file_name'], result['content_hash'],
+                                                 result['features'], result['note_ref'], new_sessions,
+                                                 result['client_id'])
+                store.record_upload_digest(raw_digest, session_id_for_hash(result['content_hash']))
+                if added:
+                    imported += 1
+                else:
+                    skipped += 1
+            get_comparison_matrices().refresh(session['client_id'] for session in new_sessions)
             
-        except json.JSONDecodeError:
-            st.error("The uploaded file is not valid JSON. Please check the format.")
-        except Exception as e:
-            st.error(f"An error occurred: {str(e)}")
+            if imported:
+                st.success(f"Successfully uploaded {imported} of {len(notes)} sessions.")
+                st.session_state.selected_client = client_id
+            if errors:
+                st.error(f"{len(errors)} files could not be processed.")
+                st.dataframe(pd.DataFrame(errors), use_container_width=True)
+        
+        if skipped:
+            st.info(f"Skipped {skipped} files that were already uploaded.")
+    
+    # Possible client matches found by record linkage
+    if st.session_state.link_proposals:
+        st.markdown('<h3 class="sub-header">Possible Client Matches</h3>', unsafe_allow_html=True)
+        st.write("These sessions look similar to sessions of another client. Merge them if they belong to the same person.")
+        for session_id, proposal in list(st.session_state.link_proposals.items()):
+            col1, col2, col3 = st.columns([4, 1, 1])
+            with col1:
+                st.write(f"{proposal['file_name']} ({proposal['client_id']}) may belong to "
+                         f"{proposal['match_client_id']} - similarity {proposal['score']:.2f}")
+            with col2:
+                if st.button("Merge", key=f"merge_{session_id}"):
+                    merge_clients(proposal['client_id'], proposal['match_client_id'])
+                    st.rerun()
+            with col3:
+                if st.button("Dismiss", key=f"dismiss_{session_id}"):
+                    del st.session_state.link_proposals[session_id]
+                    st.rerun()
     
     # Display current sessions
-    if st.session_state.uploaded_sessions:
+    session_listing = store.session_listing()
+    if session_listing:
         st.markdown('<h3 class="sub-header">Uploaded Sessions</h3>', unsafe_allow_html=True)
-        for client_id, sessions in st.session_state.uploaded_sessions.items():
+        for client_id, client_sessions in session_listing.items():
             with st.expander(f"Client: {client_id}"):
-                for session_id, session_info in sessions.items():
-                    st.write(f"Session {session_id}: {session_info['date']} - {session_info['file_name']}")
+                for session_id, session_date, file_name in client_sessions:
+                    st.write(f"Session {session_id}: {session_date} - {file_name}")
 
 # Client Dashboard Page
 elif page == "Client Dashboard":
     st.markdown('<h2 class="sub-header">Client Dashboard</h2>', unsafe_allow_html=True)
     
-    if not st.session_state.uploaded_sessions:
+    client_options = store.client_ids()
+    if not client_options:
         st.info("No sessions have been uploaded yet. Please upload session notes first.")
     else:
         # Client selector
-        client_options = list(st.session_state.uploaded_sessions.keys())
         selected_client = st.selectbox(
             "Select Client", 
             options=client_options,
@@ -647,7 +574,7 @@ elif page == "Client Dashboard":
         st.session_state.selected_client = selected_client
         
         if selected_client:
-            client_sessions = st.session_state.uploaded_sessions[selected_client]
+            client_sessions = store.client_sessions(selected_client)
             
             # Display client information
             st.markdown(f"<div class='info-box'><h3>Client: {selected_client}</h3>", unsafe_allow_html=True)
@@ -655,37 +582,57 @@ elif page == "Client Dashboard":
             
             # Show most recent session assessment
             if client_sessions:
-                # Sort sessions by date
-                sorted_sessions = sorted(
-                    client_sessions.items(),
-                    key=lambda x: datetime.strptime(x[1]['date'], "%Y-%m-%d") if isinstance(x[1]['date'], str) else datetime.now(),
-                    reverse=True
-                )
+                # The store returns sessions most recent first
+                sorted_sessions = list(client_sessions.items())
                 
                 latest_session_id, latest_session = sorted_sessions[0]
-                latest_data = latest_session['data']
+                latest_features = latest_session['features']
                 
                 st.markdown(f"<h3 class='sub-header'>Latest Assessment ({latest_session['date']})</h3>", unsafe_allow_html=True)
                 
-                # Extract symptoms from latest session
-                symptoms = extract_symptoms(latest_data)
+                # Narrative sections are read from the stored note only when asked for
+                if st.checkbox("Show session summary and quotes"):
+                    note_store = get_raw_note_store()
+                    summary = note_store.load_section(latest_session['note_ref'], 'Brief Summary of Session')
+                    presentation = note_store.load_section(latest_session['note_ref'], 'Presentation') or {}
+                    progress = note_store.load_section(latest_session['note_ref'], 'Progress and Response') or {}
+                    if summary:
+                        st.write(summary)
+                    if presentation.get('Quote (Chief Complaint)'):
+                        st.markdown(f"<em>\"{presentation['Quote (Chief Complaint)']}\"</em>", unsafe_allow_html=True)
+                    for field, value in progress.items():
+                        st.write(f"{field}: {value}")
+                
+                # Symptoms extracted from latest session
+                symptoms = latest_features['symptoms']
                 
                 # Display symptoms
                 if symptoms:
+                    # Look each symptom up in the client's history, under any description with the same meaning
+                    history = get_symptom_history()
+                    history.update(selected_client, client_sessions)
+                    earlier_matches = history.earliest_matches(selected_client, symptoms, before=latest_session['date'])
+                    
                     st.markdown("<h4>Current Symptoms</h4>", unsafe_allow_html=True)
-                    for symptom in symptoms:
+                    for symptom, earlier in zip(symptoms, earlier_matches):
                         with st.container():
                             st.markdown(f"<div class='symptom-card'>", unsafe_allow_html=True)
                             st.markdown(f"<strong>{symptom['description']}</strong>", unsafe_allow_html=True)
                             st.write(f"Intensity: {symptom['intensity']}")
                             st.write(f"Frequency: {symptom['frequency']}")
+                            if earlier is None:
+                                st.write("First noted: this session")
+                            elif description_key(earlier['description']) == description_key(symptom['description']):
+                                st.write(f"First noted: {earlier['date']}")
+                            else:
+                                st.write(f"First noted: {earlier['date']} (as \"{earlier['description']}\")")
                             if symptom['quote']:
                                 st.markdown(f"<em>\"{symptom['quote']}\"</em>", unsafe_allow_html=True)
                             st.markdown("</div>", unsafe_allow_html=True)
                 
-                # Map to standardized assessments
-                gad7_results = map_to_gad7(symptoms)
-                phq9_results = map_to_phq9(symptoms, latest_data)
+                # Standardized assessments
+                gad7_results = latest_features['gad7']
+                phq9_results = latest_features['phq9']
                 
                 # Display GAD-7 scores
                 with st.container():
@@ -729,31 +676,30 @@ elif page == "Client Dashboard":
                     st.pyplot(fig)
                     st.markdown("</div>", unsafe_allow_html=True)
                 
+                # Any further instruments defined in the instruments directory
+                other_instruments = [instrument for instrument_id, instrument in get_assessment_engine().instruments.items()
+                                     if instrument_id not in ('gad7', 'phq9') and instrument_id in latest_features]
+                if other_instruments:
+                    with st.container():
+                        st.markdown("<div class='assessment-card'>", unsafe_allow_html=True)
+                        st.markdown("<h4>Other Assessments</h4>", unsafe_allow_html=True)
+                        st.table(pd.DataFrame({
+                            'Assessment': [instrument.name for instrument in other_instruments],
+                            'Total Score': [latest_features[instrument.id]['total_score'] for instrument in other_instruments],
+                            'Severity': [latest_features[instrument.id]['severity'] for instrument in other_instruments]
+                        }))
+                        st.markdown("</div>", unsafe_allow_html=True)
+                
                 # Check if we have multiple sessions to compare
                 if len(sorted_sessions) > 1:
                     st.markdown(f"<h3 class='sub-header'>Progress Tracking</h3>", unsafe_allow_html=True)
                     
-                    # Create time series data for symptom tracking
-                    session_dates = []
-                    gad7_scores = []
-                    phq9_scores = []
-                    
-                    for session_id, session in sorted_sessions:
-                        session_date = datetime.strptime(session['date'], "%Y-%m-%d") if isinstance(session['date'], str) else datetime.now()
-                        session_dates.append(session_date)
-                        
-                        # Calculate scores
-                        session_symptoms = extract_symptoms(session['data'])
-                        session_gad7 = map_to_gad7(session_symptoms)
-                        session_phq9 = map_to_phq9(session_symptoms, session['data'])
-                        
-                        gad7_scores.append(session_gad7['total_score'])
-                        phq9_scores.append(session_phq9['total_score'])
-                    
-                    # Reverse the lists to show chronological order
-                    session_dates.reverse()
-                    gad7_scores.reverse()
-                    phq9_scores.reverse()
+                    # Time series of assessment scores, kept up to date as sessions are uploaded
+                    series = store.score_series(selected_client)
+                    score_history = series.frame(['gad7', 'phq9'])
+                    session_dates = score_history['session_date']
+                    gad7_scores = score_history['gad7_total']
+                    phq9_scores = score_history['phq9_total']
                     
                     # Plot assessment scores over time
                     fig, ax = plt.subplots(figsize=(10, 5))
@@ -767,6 +713,39 @@ elif page == "Client Dashboard":
                     plt.tight_layout()
                     st.pyplot(fig)
                     
+                    # Running statistics of each instrument over all sessions
+                    stat_rows = {'GAD-7': series.stats.get('gad7'), 'PHQ-9': series.stats.get('phq9')}
+                    st.dataframe(pd.DataFrame({
+                        name: {
+                            'Sessions': stats['sessions'],
+                            'First': stats['first'],
+                            'Latest': stats['latest'],
+                            'Change': stats['change'],
+                            'Mean': round(stats['mean'], 1),
+                            'SD': round(stats['sd'], 1) if stats['sd'] is not None else None,
+                            'Min': stats['min'],
+                            'Max': stats['max']
+                        }
+                        for name, stats in stat_rows.items() if stats
+                    }).T)
+                    
+                    # Trend and change criteria over all sessions, from the baseline to the latest session
+                    trajectory = client_trajectory(series).iloc[0]
+                    if len(series) > 1:
+                        st.dataframe(pd.DataFrame({
+                            instrument.name: {
+                                'Trend (points/week)': round(trajectory[f'{instrument.id}_slope'], 2),
+                                'Reliable change index': round(trajectory[f'{instrument.id}_rci'], 2),
+                                'Reliable improvement': bool(trajectory[f'{instrument.id}_reliable_improvement']),
+                                'Reliable deterioration': bool(trajectory[f'{instrument.id}_reliable_deterioration']),
+                                'Clinically significant': bool(trajectory[f'{instrument.id}_clinically_significant']),
+                                'Response (50% drop)': bool(trajectory[f'{instrument.id}_response']),
+                                'Remission': bool(trajectory[f'{instrument.id}_remission']),
+                                'Days to response': trajectory[f'{instrument.id}_days_to_response']
+                            }
+                            for instrument in trajectory_instruments()
+                        }).T)
+                    
                     # Show score interpretation
                     col1, col2 = st.columns(2)
                     with col1:
@@ -788,19 +767,19 @@ elif page == "Client Dashboard":
 elif page == "Session Comparison":
     st.markdown('<h2 class="sub-header">Session Comparison</h2>', unsafe_allow_html=True)
     
-    if not st.session_state.uploaded_sessions:
+    client_options = store.client_ids()
+    if not client_options:
         st.info("No sessions have been uploaded yet. Please upload session notes first.")
     else:
-        # Client selector
-        client_options = list(st.session_state.uploaded_sessions.keys())
-        selected_client = st.selectbox(
-            "Select Client", 
-            options=client_options,
-            index=client_options.index(st.session_state.selected_client) if st.session_state.selected_client in client_options else 0
-        )
+        # Client selector, set to the client of a shared comparison if one is open. The selectors
+        # are keyed and given no index, which would make Streamlit reset them whenever it changed
+        if st.session_state.get('comparison_client') not in client_options:
+            default_client = st.session_state.selected_client
+            st.session_state.comparison_client = default_client if default_client in client_options else client_options[0]
+        selected_client = st.selectbox("Select Client", options=client_options, key='comparison_client')
         
         if selected_client:
-            client_sessions = st.session_state.uploaded_sessions[selected_client]
+            client_sessions = store.client_sessions(selected_client)
             
             if len(client_sessions) < 2:
                 st.warning("Need at least two sessions for comparison. Please upload more sessions.")
@@ -816,144 +795,291 @@ elif page == "Session Comparison":
                 # Sort sessions by date
                 session_options.sort(key=lambda x: client_sessions[x['id']]['date'], reverse=True)
                 
+                # Precomputed changes between the client's sessions
+                show_all_pairs = st.checkbox("Compare every pair of sessions")
+                matrix = get_comparison_matrices().get(selected_client, client_sessions, all_pairs=show_all_pairs)
+                st.markdown("<h4>Session-over-Session Changes</h4>", unsafe_allow_html=True)
+                st.dataframe(matrix.session_over_session(), use_container_width=True)
+                if show_all_pairs:
+                    measure = st.selectbox(
+                        "Change from the row session to the column session in",
+                        options=['symptoms'] + [instrument['id'] for instrument in matrix.instruments],
+                        format_func=lambda m: "Symptom progress score" if m == 'symptoms' else
+                            next(instrument['name'] for instrument in matrix.instruments if instrument['id'] == m)
+                    )
+                    pair_table = matrix.progress().round(2) if measure == 'symptoms' else matrix.total_changes(measure)
+                    st.dataframe(pair_table, use_container_width=True)
+                    if measure == 'symptoms':
+                        st.caption("Symptoms are followed through the sessions in between, so a score here can "
+                                   "differ from the detailed comparison of the same two sessions below.")
+                
                 # Session selectors
                 col1, col2 = st.columns(2)
                 with col1:
+                    first_options = [s['id'] for s in session_options]
+                    if st.session_state.get('comparison_first') not in first_options:
+                        st.session_state.comparison_first = first_options[0]
                     first_session = st.selectbox(
                         "First Session (Earlier)", 
-                        options=[s['id'] for s in session_options],
+                        options=first_options,
+                        key='comparison_first',
                         format_func=lambda s: next((opt['label'] for opt in session_options if opt['id'] == s), s)
                     )
                 
                 with col2:
                     # Filter out the selected first session
                     second_options = [s for s in session_options if s['id'] != first_session]
+                    second_ids = [s['id'] for s in second_options]
+                    if st.session_state.get('comparison_second') not in second_ids:
+                        st.session_state.comparison_second = second_ids[0]
                     second_session = st.selectbox(
                         "Second Session (Later)", 
-                        options=[s['id'] for s in second_options],
+                        options=second_ids,
+                        key='comparison_second',
                         format_func=lambda s: next((opt['label'] for opt in session_options if opt['id'] == s), s)
                     )
                 
-                # Compare button
-                if st.button("Compare Sessions"):
-                    # Check if both sessions are selected
-                    if first_session and second_session:
-                        # Get session data
-                        first_data = client_sessions[first_session]['data']
-                        second_data = client_sessions[second_session]['data']
-                        
-                        # Calculate progress
-                        progress_data = calculate_progress(first_data, second_data)
-                        
-                        # Store in session state for reference
-                        comparison_key = f"{first_session}_{second_session}"
-                        if selected_client not in st.session_state.session_comparisons:
-                            st.session_state.session_comparisons[selected_client] = {}
-                        st.session_state.session_comparisons[selected_client][comparison_key] = progress_data
-                        
-                        # Display comparison results
-                        st.markdown("<h3 class='sub-header'>Comparison Results</h3>", unsafe_allow_html=True)
+                # Comparison of the selected sessions, shown as soon as both are chosen
+                if first_session and second_session:
+                    # Calculate progress from the features extracted at upload
+                    progress_data = compare_sessions(client_sessions[first_session],
+                                                     client_sessions[second_session])
+                    
+                    # The address bar now links to this comparison
+                    st.query_params.from_dict({'first': first_session, 'second': second_session})
+                    st.caption("Share the page address to show another clinician this comparison.")
+                    
+                    # Display comparison results
+                    st.markdown("<h3 class='sub-header'>Comparison Results</h3>", unsafe_allow_html=True)
+                    
+                    # Overall progress
+                    st.markdown("<h4>Overall Progress</h4>", unsafe_allow_html=True)
+                    overall_score = progress_data['overall_progress_score']
+                    
+                    if overall_score > 0.3:
+                        st.markdown(f"<p class='progress-improved'>Significant Improvement: {overall_score:.2f}</p>", unsafe_allow_html=True)
+                    elif overall_score > 0:
+                        st.markdown(f"<p class='progress-improved'>Slight Improvement: {overall_score:.2f}</p>", unsafe_allow_html=True)
+                    elif overall_score < -0.3:
+                        st.markdown(f"<p class='progress-worsened'>Significant Worsening: {overall_score:.2f}</p>", unsafe_allow_html=True)
+                    elif overall_score < 0:
+                        st.markdown(f"<p class='progress-worsened'>Slight Worsening: {overall_score:.2f}</p>", unsafe_allow_html=True)
+                    else:
+                        st.markdown(f"<p class='progress-unchanged'>Unchanged: {overall_score:.2f}</p>", unsafe_allow_html=True)
+                    
+                    # Assessment changes
+                    col1, col2 = st.columns(2)
+                    
+                    with col1:
+                        st.markdown("<h4>GAD-7 Change</h4>", unsafe_allow_html=True)
+                        gad7_change = progress_data['gad7_change']
                         
-                        # Overall progress
-                        st.markdown("<h4>Overall Progress</h4>", unsafe_allow_html=True)
-                        overall_score = progress_data['overall_progress_score']
+                        st.write(f"First Session: {progress_data['first_gad7']['total_score']} ({progress_data['first_gad7']['severity']})")
+                        st.write(f"Second Session: {progress_data['second_gad7']['total_score']} ({progress_data['second_gad7']['severity']})")
                         
-                        if overall_score > 0.3:
-                            st.markdown(f"<p class='progress-improved'>Significant Improvement: {overall_score:.2f}</p>", unsafe_allow_html=True)
-                        elif overall_score > 0:
-                            st.markdown(f"<p class='progress-improved'>Slight Improvement: {overall_score:.2f}</p>", unsafe_allow_html=True)
-                        elif overall_score < -0.3:
-                            st.markdown(f"<p class='progress-worsened'>Significant Worsening: {overall_score:.2f}</p>", unsafe_allow_html=True)
-                        elif overall_score < 0:
-                            st.markdown(f"<p class='progress-worsened'>Slight Worsening: {overall_score:.2f}</p>", unsafe_allow_html=True)
+                        if gad7_change < 0:
+                            st.markdown(f"<p class='progress-improved'>Improved by {-gad7_change} points</p>", unsafe_allow_html=True)
+                        elif gad7_change > 0:
+                            st.markdown(f"<p class='progress-worsened'>Worsened by {gad7_change} points</p>", unsafe_allow_html=True)
                         else:
-                            st.markdown(f"<p class='progress-unchanged'>Unchanged: {overall_score:.2f}</p>", unsafe_allow_html=True)
-                        
-                        # Assessment changes
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            st.markdown("<h4>GAD-7 Change</h4>", unsafe_allow_html=True)
-                            gad7_change = progress_data['gad7_change']
-                            
-                            st.write(f"First Session: {progress_data['first_gad7']['total_score']} ({progress_data['first_gad7']['severity']})")
-                            st.write(f"Second Session: {progress_data['second_gad7']['total_score']} ({progress_data['second_gad7']['severity']})")
-                            
-                            if gad7_change < 0:
-                                st.markdown(f"<p class='progress-improved'>Improved by {-gad7_change} points</p>", unsafe_allow_html=True)
-                            elif gad7_change > 0:
-                                st.markdown(f"<p class='progress-worsened'>Worsened by {gad7_change} points</p>", unsafe_allow_html=True)
-                            else:
-                                st.markdown(f"<p class='progress-unchanged'>No change in score</p>", unsafe_allow_html=True)
-                        
-                        with col2:
-                            st.markdown("<h4>PHQ-9 Change</h4>", unsafe_allow_html=True)
-                            phq9_change = progress_data['phq9_change']
-                            
-                            st.write(f"First Session: {progress_data['first_phq9']['total_score']} ({progress_data['first_phq9']['severity']})")
-                            st.write(f"Second Session: {progress_data['second_phq9']['total_score']} ({progress_data['second_phq9']['severity']})")
-                            
-                            if phq9_change < 0:
-                                st.markdown(f"<p class='progress-improved'>Improved by {-phq9_change} points</p>", unsafe_allow_html=True)
-                            elif phq9_change > 0:
-                                st.markdown(f"<p class='progress-worsened'>Worsened by {phq9_change} points</p>", unsafe_allow_html=True)
-                            else:
-                                st.markdown(f"<p class='progress-unchanged'>No change in score</p>", unsafe_allow_html=True)
+                            st.markdown(f"<p class='progress-unchanged'>No change in score</p>", unsafe_allow_html=True)
+                    
+                    with col2:
+                        st.markdown("<h4>PHQ-9 Change</h4>", unsafe_allow_html=True)
+                        phq9_change = progress_data['phq9_change']
                         
-                        # Symptom changes
-                        st.markdown("<h4>Symptom Changes</h4>", unsafe_allow_html=True)
+                        st.write(f"First Session: {progress_data['first_phq9']['total_score']} ({progress_data['first_phq9']['severity']})")
+                        st.write(f"Second Session: {progress_data['second_phq9']['total_score']} ({progress_data['second_phq9']['severity']})")
                         
-                        if progress_data['matched_symptoms']:
-                            for symptom in progress_data['matched_symptoms']:
-                                with st.container():
-                                    st.markdown(f"<div class='symptom-card'>", unsafe_allow_html=True)
-                                    st.markdown(f"<strong>{symptom['description']}</strong>", unsafe_allow_html=True)
-                                    
-                                    # Display the change direction with appropriate styling
-                                    if symptom['change']['direction'] == 'improved':
-                                        st.markdown(f"<p class='progress-improved'>{symptom['change']['description']}</p>", unsafe_allow_html=True)
-                                    elif symptom['change']['direction'] == 'worsened':
-                                        st.markdown(f"<p class='progress-worsened'>{symptom['change']['description']}</p>", unsafe_allow_html=True)
-                                    else:
-                                        st.markdown(f"<p class='progress-unchanged'>{symptom['change']['description']}</p>", unsafe_allow_html=True)
-                                    
-                                    # Show more details
-                                    st.write(f"First Session: {symptom['first_intensity']} ({symptom['first_frequency']})")
-                                    st.write(f"Second Session: {symptom['second_intensity']} ({symptom['second_frequency']})")
-                                    st.markdown("</div>", unsafe_allow_html=True)
+                        if phq9_change < 0:
+                            st.markdown(f"<p class='progress-improved'>Improved by {-phq9_change} points</p>", unsafe_allow_html=True)
+                        elif phq9_change > 0:
+                            st.markdown(f"<p class='progress-worsened'>Worsened by {phq9_change} points</p>", unsafe_allow_html=True)
                         else:
-                            st.write("No matched symptoms between sessions.")
-                        
-                        # New symptoms
-                        if progress_data['new_symptoms']:
-                            st.markdown("<h4>New Symptoms</h4>", unsafe_allow_html=True)
-                            for symptom in progress_data['new_symptoms']:
-                                with st.container():
-                                    st.markdown(f"<div class='symptom-card'>", unsafe_allow_html=True)
-                                    st.markdown(f"<strong>{symptom['description']}</strong>", unsafe_allow_html=True)
-                                    st.write(f"Intensity: {symptom['intensity']}")
-                                    st.write(f"Frequency: {symptom['frequency']}")
-                                    if symptom['quote']:
-                                        st.markdown(f"<em>\"{symptom['quote']}\"</em>", unsafe_allow_html=True)
-                                    st.markdown("</div>", unsafe_allow_html=True)
-                        
-                        # Resolved symptoms
-                        if progress_data['resolved_symptoms']:
-                            st.markdown("<h4>Resolved Symptoms</h4>", unsafe_allow_html=True)
-                            for symptom in progress_data['resolved_symptoms']:
-                                with st.container():
-                                    st.markdown(f"<div class='symptom-card'>", unsafe_allow_html=True)
-                                    st.markdown(f"<strong>{symptom['description']}</strong> (Resolved)", unsafe_allow_html=True)
-                                    st.write(f"Previous Intensity: {symptom['intensity']}")
-                                    st.write(f"Previous Frequency: {symptom['frequency']}")
-                                    st.markdown("</div>", unsafe_allow_html=True)
-                        
-                        # Clinical insights
-                        st.markdown("<h4>Clinical Insights</h4>", unsafe_allow_html=True)
-                        insights = generate_insights(progress_data)
-                        
-                        for insight in insights:
-                            st.markdown(f"<div class='info-box'>• {insight}</div>", unsafe_allow_html=True)
+                            st.markdown(f"<p class='progress-unchanged'>No change in score</p>", unsafe_allow_html=True)
+                    
+                    # Symptom changes
+                    st.markdown("<h4>Symptom Changes</h4>", unsafe_allow_html=True)
+                    
+                    if progress_data['matched_symptoms']:
+                        for symptom in progress_data['matched_symptoms']:
+                            with st.container():
+                                st.markdown(f"<div class='symptom-card'>", unsafe_allow_html=True)
+                                st.markdown(f"<strong>{symptom['description']}</strong>", unsafe_allow_html=True)
+                                if description_key(symptom['second_description']) != description_key(symptom['description']):
+                                    st.write(f"Described as \"{symptom['second_description']}\" in the second session")
+
+                                # Display the change direction with appropriate styling
+                                if symptom['change']['direction'] == 'improved':
+                                    st.markdown(f"<p class='progress-improved'>{symptom['change']['description']}</p>", unsafe_allow_html=True)
+                                elif symptom['change']['direction'] == 'worsened':
+                                    st.markdown(f"<p class='progress-worsened'>{symptom['change']['description']}</p>", unsafe_allow_html=True)
+                                else:
+                                    st.markdown(f"<p class='progress-unchanged'>{symptom['change']['description']}</p>", unsafe_allow_html=True)
+                                
+                                # Show more details
+                                st.write(f"First Session: {symptom['first_intensity']} ({symptom['first_frequency']})")
+                                st.write(f"Second Session: {symptom['second_intensity']} ({symptom['second_frequency']})")
+                                st.markdown("</div>", unsafe_allow_html=True)
+                    else:
+                        st.write("No matched symptoms between sessions.")
+                    
+                    # New symptoms
+                    if progress_data['new_symptoms']:
+                        st.markdown("<h4>New Symptoms</h4>", unsafe_allow_html=True)
+                        for symptom in progress_data['new_symptoms']:
+                            with st.container():
+                                st.markdown(f"<div class='symptom-card'>", unsafe_allow_html=True)
+                                st.markdown(f"<strong>{symptom['description']}</strong>", unsafe_allow_html=True)
+                                st.write(f"Intensity: {symptom['intensity']}")
+                                st.write(f"Frequency: {symptom['frequency']}")
+                                if symptom['quote']:
+                                    st.markdown(f"<em>\"{symptom['quote']}\"</em>", unsafe_allow_html=True)
+                                st.markdown("</div>", unsafe_allow_html=True)
+                    
+                    # Resolved symptoms
+                    if progress_data['resolved_symptoms']:
+                        st.markdown("<h4>Resolved Symptoms</h4>", unsafe_allow_html=True)
+                        for symptom in progress_data['resolved_symptoms']:
+                            with st.container():
+                                st.markdown(f"<div class='symptom-card'>", unsafe_allow_html=True)
+                                st.markdown(f"<strong>{symptom['description']}</strong> (Resolved)", unsafe_allow_html=True)
+                                st.write(f"Previous Intensity: {symptom['intensity']}")
+                                st.write(f"Previous Frequency: {symptom['frequency']}")
+                                st.markdown("</div>", unsafe_allow_html=True)
+                    
+                    # Clinical insights
+                    st.markdown("<h4>Clinical Insights</h4>", unsafe_allow_html=True)
+                    insights = generate_insights(progress_data)
+                    
+                    for insight in insights:
+                        st.markdown(f"<div class='info-box'>• {insight}</div>", unsafe_allow_html=True)
+
+# Cohort Page
+elif page == "Cohort":
+    st.markdown('<h2 class="sub-header">Cohort Overview</h2>', unsafe_allow_html=True)
+    st.write("See how the whole caseload is doing over a range of weeks or months.")
+    
+    period = st.radio("Group sessions by", ["month", "week"], format_func=str.capitalize,
+                      horizontal=True)
+    period_starts = store.rollup_periods(period)
+    if not period_starts:
+        st.info("No sessions have been uploaded yet. Please upload session notes first.")
+    else:
+        def period_label(period_start):
+            if period == "month":
+                return datetime.strptime(period_start, "%Y-%m-%d").strftime("%b %Y")
+            return f"Week of {period_start}"
+        
+        # Default to roughly the last quarter
+        default_first = period_starts[max(len(period_starts) - (3 if period == "month" else 13), 0)]
+        if len(period_starts) > 1:
+            first_start, last_start = st.select_slider("Periods", options=period_starts,
+                                                       value=(default_first, period_starts[-1]),
+                                                       format_func=period_label)
+        else:
+            first_start = last_start = period_starts[0]
+            st.write(f"Period: {period_label(first_start)}")
+        
+        instruments = list(get_assessment_engine().instruments.values())
+        instrument = st.selectbox("Assessment", instruments, format_func=lambda i: i.name)
+        
+        period_scores = period_score_frame(store, period, first_start, last_start, instrument)
+        changes = client_changes(period_scores, instrument)
+        tracked = changes[changes['sessions'] > 1]
+        
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Active clients", len(changes))
+        col2.metric("Sessions", int(changes['sessions'].sum()))
+        col3.metric("Clients seen more than once", len(tracked))
+        if instrument.change and len(tracked):
+            col4.metric("Reliably improved", f"{tracked['reliable_improvement'].mean():.0%}",
+                        help=f"A drop of at least {instrument.change['reliable_change']:g} points "
+                             "between the first and latest session in the periods")
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Reliably deteriorated", f"{tracked['reliable_deterioration'].mean():.0%}")
+            col2.metric("Clinically significant improvement", f"{tracked['clinically_significant'].mean():.0%}",
+                        help=f"Reliably improved from {instrument.change['clinical_cutoff']:g} or more "
+                             "to below it")
+        
+        if len(tracked):
+            # Distribution of the change from each client's first to latest session in the periods
+            st.markdown(f"<h3 class='sub-header'>{instrument.name} Score Changes</h3>", unsafe_allow_html=True)
+            fig, ax = plt.subplots(figsize=(10, 4))
+            bins = np.arange(tracked['change'].min(), tracked['change'].max() + 2) - 0.5
+            ax.hist(tracked['change'], bins=bins, color='#4b6584')
+            if instrument.change:
+                for bound in (-instrument.change['reliable_change'], instrument.change['reliable_change']):
+                    ax.axvline(bound, color='#778ca3', linestyle='--')
+            ax.set_xlabel('Change in total score (negative is improvement)')
+            ax.set_ylabel('Clients')
+            ax.grid(True, linestyle='--', alpha=0.7)
+            plt.tight_layout()
+            st.pyplot(fig)
+            
+            st.markdown("<h3 class='sub-header'>Severity Transitions</h3>", unsafe_allow_html=True)
+            st.caption("Clients seen more than once, by severity at their first (rows) and latest (columns) session")
+            st.dataframe(severity_transitions(tracked))
+        
+        st.markdown("<h3 class='sub-header'>Severity by Period</h3>", unsafe_allow_html=True)
+        distribution = severity_distribution(period_scores, instrument)
+        distribution.index = [period_label(period_start) for period_start in distribution.index]
+        fig, ax = plt.subplots(figsize=(10, 4))
+        distribution.plot(kind='bar', stacked=True, ax=ax, colormap='RdYlGn_r')
+        ax.set_xlabel('')
+        ax.set_ylabel('Clients (latest severity in the period)')
+        ax.legend(title=None, fontsize='small')
+        plt.tight_layout()
+        st.pyplot(fig)
+        
+        st.markdown("<h3 class='sub-header'>Symptom Prevalence</h3>", unsafe_allow_html=True)
+        prevalence = symptom_prevalence(store.symptom_rollups(period, first_start, last_start), period_scores)
+        if prevalence.empty:
+            st.write("No symptoms were recorded in these periods.")
+        else:
+            top_symptoms = prevalence.head(15)
+            st.dataframe(pd.DataFrame({
+                'Symptom': top_symptoms.index.str.capitalize(),
+                'Sessions': top_symptoms['sessions'],
+                'Share of sessions': top_symptoms['session_share'].map('{:.0%}'.format),
+                f'Share of clients per {period}': top_symptoms['client_share'].map('{:.0%}'.format)
+            }).reset_index(drop=True))
+        
+        if instrument.change:
+            # Whole-history trajectories, independent of the periods selected above
+            st.markdown(f"<h3 class='sub-header'>{instrument.name} Trajectories Across All Sessions</h3>",
+                        unsafe_allow_html=True)
+            trajectories = caseload_trajectories(store)
+            prefix = f'{instrument.id}_'
+            measures = trajectories[[column for column in trajectories.columns if column.startswith(prefix)]]
+            measures = measures.rename(columns=lambda column: column[len(prefix):])
+            measures = measures[measures['sessions'] > 1]
+            if measures.empty:
+                st.write("No client has more than one session with this assessment yet.")
+            else:
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Clients tracked", len(measures))
+                col2.metric("Responded", f"{measures['response'].mean():.0%}",
+                            help="Latest total at most half the first")
+                col3.metric("In remission", f"{measures['remission'].mean():.0%}",
+                            help=f"Latest total of {instrument.change['remission_max']:g} or less")
+                # Sessions all on one day give no trend
+                slope = measures['slope'].median()
+                col4.metric("Median trend", f"{slope:+.2f} pts/week" if pd.notna(slope) else "n/a")
+                if measures['days_to_response'].notna().any():
+                    st.write(f"Clients who responded did so after a median of "
+                             f"{measures['days_to_response'].median():.0f} days.")
+                deteriorating = measures[measures['reliable_deterioration']].sort_values('change', ascending=False)
+                if not deteriorating.empty:
+                    st.caption("Clients whose latest total is reliably worse than their first, largest rise first")
+                    st.dataframe(pd.DataFrame({
+                        'Client': deteriorating.index,
+                        'Sessions': deteriorating['sessions'],
+                        'First': deteriorating['baseline'].astype(int),
+                        'Latest': deteriorating['latest'].astype(int),
+                        'Change': deteriorating['change'].astype(int),
+                        'Trend (pts/week)': deteriorating['slope'].round(2)
+                    }).head(20).reset_index(drop=True))
 
 # Help Page
 elif page == "Help":
@@ -967,11 +1093,13 @@ This application helps therapists track client progress across therapy sessions
 
 1. **Upload Session Notes**: Upload JSON-formatted session notes to build client profiles.
    
-2. **Client Dashboard**: View client details, symptom assessments, and progress metrics.
+2. **Client Dashboard**: View client details, symptom assessments, and progress metrics: score trends, reliable and clinically significant change, response and remission.
    
-3. **Session Comparison**: Compare any two sessions to track changes in symptoms and assessments.
+3. **Session Comparison**: See the changes from each session to the next, and compare any two sessions to track changes in symptoms and assessments.
    
-4. **Standardized Assessments**: Automatic mapping of symptoms to GAD-7 (anxiety) and PHQ-9 (depression) assessments.
+4. **Cohort**: See score changes, severity transitions and symptom prevalence across all clients over a range of weeks or months.
+   
+5. **Standardized Assessments**: Automatic mapping of symptoms to GAD-7 (anxiety) and PHQ-9 (depression) assessments.
 
 ### How To Use
 
@@ -1007,3 +1135,12 @@ The application expects session notes in a specific JSON format with the followi
 - 15-19: Moderately severe depression
 - 20-27: Severe depression
 """)
+    
+    with st.expander("Cache statistics"):
+        cache_stats = get_result_cache().stats()
+        cache_usage = cache_stats.pop('cache')
+        st.write(f"Rule version: {get_result_cache().version}")
+        st.write(f"Cached entries: {cache_usage['entries']} "
+                 f"({cache_usage['bytes'] / 2**20:.1f} of {cache_usage['memory_limit'] / 2**20:.0f} MB)")
+        if cache_stats:
+            st.table(pd.DataFrame.from_dict(cache_stats, orient='index'))
@@ -0,0 +1,96 @@
+"""Mapping of extracted session symptoms to standardized assessments (GAD-7, PHQ-9, ...)
+
+The instruments themselves are defined by the data files read by rule_engine.
+"""
+import re
+
+from rule_engine import get_assessment_engine
+from symptom_normalizer import normalize_symptom
+
+# Questions and severity labels (least to most severe) of the GAD-7 and PHQ-9
+gad7_questions = get_assessment_engine().instruments['gad7'].questions
+phq9_questions = get_assessment_engine().instruments['phq9'].questions
+gad7_severity_labels = get_assessment_engine().instruments['gad7'].severity_labels
+phq9_severity_labels = get_assessment_engine().instruments['phq9'].severity_labels
+
+
+def extract_symptoms(json_data):
+    """Extract symptoms and their attributes from session notes
+
+    Each symptom's intensity, frequency and duration are normalized into
+    codes here, once, for the scorers and change calculators.
+    """
+    symptoms = []
+    if isinstance(json_data, dict) and 'Psychological Factors' in json_data:
+        psych_factors = json_data['Psychological Factors']
+        if 'Symptoms' in psych_factors and isinstance(psych_factors['Symptoms'], dict):
+            for symptom_key, symptom_data in psych_factors['Symptoms'].items():
+                if isinstance(symptom_data, dict):
+                    symptom = {
+                        'description': symptom_data.get('Description', 'Unknown'),
+                        'intensity': symptom_data.get('Intensity', 'Unknown'),
+                        'frequency': symptom_data.get('Frequency', 'Unknown'),
+                        'duration': symptom_data.get('Duration', 'Unknown'),
+                        'quote': symptom_data.get('Quote (Symptom)', '')
+                    }
+                    symptoms.append(symptom)
+    
+    # Also check Mental Status Exam for additional symptoms
+    if isinstance(json_data, dict) and 'Mental Status Exam' in json_data:
+        mse = json_data['Mental Status Exam']
+        if 'Mood and Affect' in mse and mse['Mood and Affect']:
+            mood_match = re.search(r'(anxious|depressed|stressed)', mse['Mood and Affect'], re.IGNORECASE)
+            if mood_match:
+                symptoms.append({
+                    'description': f"Mood: {mood_match.group(0)}",
+                    'intensity': 'Observed',
+                    'frequency': 'During session',
+                    'duration': 'Unknown',
+                    'quote': mse['Mood and Affect']
+                })
+    
+    # Check Risk Assessment for additional concerns
+    if isinstance(json_data, dict) and 'Risk Assessment' in json_data:
+        risk = json_data['Risk Assessment']
+        if 'Hopelessness' in risk and risk['Hopelessness'] and risk['Hopelessness'] != 'NA':
+            symptoms.append({
+                'description': 'Hopelessness',
+                'intensity': 'Observed',
+                'frequency': 'Unknown',
+                'duration': 'Unknown',
+                'quote': risk.get('Quote (Risk)', risk['Hopelessness'])
+            })
+    
+    return [normalize_symptom(symptom) for symptom in symptoms]
+
+
+def map_to_gad7(symptoms, json_data=None):
+    """Map extracted symptoms to GAD-7 assessment"""
+    return get_assessment_engine().score(symptoms, json_data, ['gad7'])['gad7']
+
+
+def map_to_phq9(symptoms, json_data):
+    """Map extracted symptoms to PHQ-9 assessment"""
+    return get_assessment_engine().score(symptoms, json_data, ['phq9'])['phq9']
+
+
+def extract_session_features(json_data):
+    """Extract the symptoms and the results of every defined assessment instrument of a session
+
+    Returns {'symptoms': [...], <instrument id>: {'scores', 'total_score', 'severity'}, ...}.
+    """
+    symptoms = extract_symptoms(json_data)
+    features = {'symptoms': symptoms}
+    features.update(get_assessment_engine().score(symptoms, json_data))
+    return features
+
+
+def extract_session_features_batch(notes):
+    """Extract the features of many sessions, scoring them together with array operations
+
+    Returns the same list as calling extract_session_features() on each note.
+    """
+    engine = get_assessment_engine()
+    symptom_lists = [extract_symptoms(json_data) for json_data in notes]
+    return [dict(results, symptoms=symptoms)
+            for symptoms, results in zip(symptom_lists, engine.unbatch(engine.score_batch(symptom_lists, notes)))]
@@ -0,0 +1,151 @@
+"""Stable client identities for session notes, backed by a persistent index"""
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+
+from utils import STORAGE_DIR, note_content_hash
+
+# Top-level note fields that carry an explicit client identifier
+CLIENT_ID_FIELDS = ('Client ID', 'Client Id', 'client_id', 'Client')
+
+# File names such as "client1_session2.txt" or "client-12-session-3.json"; other names, such as
+# "intake_session.txt", say nothing about the client and fall back to the note's content
+CLIENT_FILE_PATTERN = re.compile(r'^client[-_ ]?(?P<client>\d+)[-_ ]session', re.IGNORECASE)
+
+
+def client_identity_key(json_data, file_name=None, secret=b''):
+    """Return the identity key a note should be indexed under
+
+    An explicit client field wins, then the file name convention, then a
+    keyed digest of the chief complaint quote (or of the whole note).
+    """
+    if isinstance(json_data, dict):
+        for field in CLIENT_ID_FIELDS:
+            value = json_data.get(field)
+            if isinstance(value, (str, int)) and str(value).strip():
+                return f"field:{str(value).strip()}"
+
+    if file_name:
+        match = CLIENT_FILE_PATTERN.match(os.path.basename(file_name))
+        if match:
+            return f"file:{match.group('client').lower()}"
+
+    presentation = json_data.get('Presentation') if isinstance(json_data, dict) else None
+    if isinstance(presentation, dict) and presentation.get('Quote (Chief Complaint)'):
+        content = str(presentation['Quote (Chief Complaint)']).strip().lower().encode('utf-8')
+    else:
+        content = note_content_hash(json_data).encode('utf-8')
+    return f"digest:{hmac.new(secret, content, hashlib.sha256).hexdigest()}"
+
+
+def client_id_for_key(identity_key):
+    """Derive the display client ID for a new identity key"""
+    kind, value = identity_key.split(':', 1)
+    if kind == 'field':
+        return value if value.lower().startswith('client') else f"Client-{value}"
+    if kind == 'file':
+        return f"Client-{value}"
+    return f"Client-{value[:10]}"
+
+
+class ClientIdentityIndex:
+    """Persistent identity key -> client ID index with O(1) lookups
+
+    New entries are appended to a JSON Lines file, so recording a client
+    costs one small write no matter how large the caseload grows. The
+    digest secret lives next to the index so IDs survive restarts.
+    """
+
+    def __init__(self, path=None, secret=None):
+        self.path = path or os.path.join(STORAGE_DIR, 'client_index.jsonl')
+        self._lock = threading.Lock()
+        self._ids = {}
+        self.secret = secret if secret is not None else self._load_secret()
+        self._load()
+
+    def _load_secret(self):
+        """Read the digest secret from the environment or the key file, creating it if needed"""
+        if os.environ.get('THERAPY_TRACKER_ID_KEY'):
+            return os.environ['THERAPY_TRACKER_ID_KEY'].encode('utf-8')
+        key_path = os.path.splitext(self.path)[0] + '.key'
+        if not os.path.exists(key_path):
+            os.makedirs(os.path.dirname(key_path) or '.', exist_ok=True)
+            with open(key_path, 'w') as key_file:
+                key_file.write(secrets.token_hex(32))
+        with open(key_path) as key_file:
+            return key_file.read().strip().encode('utf-8')
+
+    def _load(self):
+        """Load existing index entries from disk"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as index_file:
+            for line in index_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partial last line from an interrupted write
+                self._ids[entry['key']] = entry['client_id']
+
+    def _append(self, identity_key, client_id):
+        """Record a new entry in memory and on disk (caller holds the lock)"""
+        self._ids[identity_key] = client_id
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as index_file:
+            index_file.write(json.dumps({'key': identity_key, 'client_id': client_id}) + '\n')
+
+    def resolve(self, json_data, file_name=None):
+        """Return the client ID for a note, recording it if the client is new"""
+        identity_key = client_identity_key(json_data, file_name, self.secret)
+        client_id = self._ids.get(identity_key)
+        if client_id is not None:
+            return client_id
+        with self._lock:
+            client_id = self._ids.get(identity_key)
+            if client_id is None:
+                client_id = client_id_for_key(identity_key)
+                self._append(identity_key, client_id)
+        return client_id
+
+    def add_alias(self, identity_key, client_id):
+        """Point an identity key at an existing client ID (e.g. after merging clients)"""
+        with self._lock:
+            if self._ids.get(identity_key) != client_id:
+                self._append(identity_key, client_id)
+
+    def merge_clients(self, source_client_id, target_client_id):
+        """Point every identity key of one client at another client ID"""
+        with self._lock:
+            for identity_key, client_id in list(self._ids.items()):
+                if client_id == source_client_id:
+                    self._append(identity_key, target_client_id)
+
+    def client_ids(self):
+        """Return the set of known client IDs"""
+        return set(self._ids.values())
+
+    def __len__(self):
+        return len(self._ids)
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_identity_index():
+    """Return the process-wide client identity index"""
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = ClientIdentityIndex()
+    return _default_index
+
+
+def extract_client_id(json_data, file_name=None):
+    """Extract a stable client identifier for a session note"""
+    return get_identity_index().resolve(json_data, file_name)
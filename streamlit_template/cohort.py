@@ -0,0 +1,90 @@
+"""Caseload-level analytics over the weekly and monthly rollups of the session store
+
+The session store keeps, per period, each client's first and latest total
+of every instrument and the number of sessions and clients mentioning each
+symptom, updating them in the transaction that stores a session. Everything
+here groups those rollup rows, never the sessions themselves, so the cost
+depends on the number of clients active in the selected periods rather than
+on the caseload's history.
+"""
+import numpy as np
+import pandas as pd
+
+from trajectories import change_flags
+
+PERIOD_SCORE_COLUMNS = ['period_start', 'client_id', 'instrument', 'sessions', 'first_date', 'first_total',
+                        'last_date', 'last_total']
+
+
+def severity_labels(totals, instrument):
+    """Return the severity label of every total in an array, as a Categorical in severity order"""
+    bounds = np.array([max_score for max_score, _ in instrument.severity_bands[:-1]])
+    codes = np.digitize(totals, bounds, right=True)
+    return pd.Categorical.from_codes(codes, categories=list(instrument.severity_labels), ordered=True)
+
+
+def period_score_frame(store, period, first_start, last_start, instrument):
+    """Read one instrument's client period rollups for periods starting in a range"""
+    return pd.DataFrame([tuple(row) for row in store.period_scores(period, first_start, last_start, [instrument.id])],
+                        columns=PERIOD_SCORE_COLUMNS)
+
+
+def client_changes(period_scores, instrument):
+    """Return each client's change over the periods of period_scores, one row per client
+
+    A client's baseline is their first total in the first period they were
+    seen and their latest total the last one of their last period. Columns:
+    sessions, periods, baseline, latest, change, baseline_severity,
+    latest_severity and, for instruments with change criteria,
+    reliable_improvement, reliable_deterioration and clinically_significant.
+    """
+    # Periods do not overlap, so ordering a client's periods orders their sessions
+    ordered = period_scores.sort_values(['client_id', 'period_start'])
+    changes = ordered.groupby('client_id', sort=False).agg(
+        sessions=('sessions', 'sum'),
+        periods=('period_start', 'size'),
+        baseline=('first_total', 'first'),
+        latest=('last_total', 'last')
+    )
+    changes['change'] = changes['latest'] - changes['baseline']
+    changes['baseline_severity'] = severity_labels(changes['baseline'].to_numpy(), instrument)
+    changes['latest_severity'] = severity_labels(changes['latest'].to_numpy(), instrument)
+    if instrument.change:
+        flags = change_flags(changes['sessions'] > 1, changes['baseline'], changes['latest'], instrument.change)
+        for flag, values in flags.items():
+            changes[flag] = values
+    return changes
+
+
+def severity_transitions(changes):
+    """Count clients by baseline severity (rows) and latest severity (columns)"""
+    return pd.crosstab(changes['baseline_severity'], changes['latest_severity'], dropna=False)
+
+
+def severity_distribution(period_scores, instrument):
+    """Count clients by their latest severity in each period (rows: period starts, columns: severities)"""
+    latest = severity_labels(period_scores['last_total'].to_numpy(), instrument)
+    return pd.crosstab(period_scores['period_start'].to_numpy(), latest, dropna=False).rename_axis(
+        index='period_start', columns='severity')
+
+
+def symptom_prevalence(symptom_rows, period_scores):
+    """Return the symptoms mentioned in the periods of the rollups, most prevalent first
+
+    Columns: sessions mentioning the symptom and their share of all sessions
+    in the periods, and the mean share of each period's active clients who
+    mentioned it (clients cannot be summed across periods without counting
+    some twice).
+    """
+    symptoms = pd.DataFrame([tuple(row) for row in symptom_rows],
+                            columns=['period_start', 'symptom', 'sessions', 'clients'])
+    active = period_scores.groupby('period_start').agg(sessions=('sessions', 'sum'), clients=('client_id', 'size'))
+    if symptoms.empty or active.empty:
+        return pd.DataFrame(columns=['sessions', 'session_share', 'client_share'])
+    symptoms = symptoms.join(active, on='period_start', rsuffix='_active')
+    symptoms['client_share'] = symptoms['clients'] / symptoms['clients_active']
+    prevalence = symptoms.groupby('symptom').agg(sessions=('sessions', 'sum'), client_share=('client_share', 'sum'))
+    prevalence['session_share'] = prevalence['sessions'] / active['sessions'].sum()
+    # Periods without a mention count as zero in the mean
+    prevalence['client_share'] /= len(active)
+    return prevalence[['sessions', 'session_share', 'client_share']].sort_values('sessions', ascending=False)
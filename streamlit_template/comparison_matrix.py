@@ -0,0 +1,342 @@
+"""Precomputed session-over-session and all-pairs comparisons of a client's sessions
+
+A client's sessions are reduced once to per-session vectors: the total of
+every instrument, and the intensity and frequency level of each symptom the
+client has had. Symptoms are tracked from session to session with the same
+matcher the comparison page uses, so a symptom keeps one column however
+its description changes. Comparing two sessions is then arithmetic on two
+rows, and comparing every pair is one broadcast over the rows.
+
+Because columns follow a symptom through the sessions in between, a cell
+for two sessions that are not consecutive can link symptoms that
+compare_sessions, matching only those two sessions, would count as new and
+resolved. The comparison page notes this under the all-pairs table.
+
+Matrices are persisted per client, next to the session store, and rebuilt
+in a background thread when a client's sessions, the scoring rules or the
+symptom vectors change.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils import STORAGE_DIR
+from session_store import get_session_store
+from rule_engine import get_assessment_engine
+from symptom_normalizer import INTENSITY_LEVELS, symptom_intensity_level, symptom_frequency_level
+from symptom_matching import match_symptoms
+from semantic_matching import MIN_SIMILARITY, get_symptom_vector_cache, vectors_version
+
+
+def _track_symptoms(ordered_sessions):
+    """Assign every symptom of the sessions (oldest first) to a client-level symptom column
+
+    Returns (columns, descriptions): columns[k] lists the column of each of
+    session k's symptoms, or None for a repeat of a column already present
+    in that session, and descriptions names each column by the description
+    it was first recorded under.
+    """
+    vectors = get_symptom_vector_cache().vectors
+    columns, descriptions = [], []
+    # Latest symptom recorded for each column, and the columns of the previous session
+    latest = {}
+    previous = []
+    for session in ordered_sessions:
+        symptoms = session['features']['symptoms']
+        column_of = {}
+        previous_symptoms = [latest[column] for column in previous]
+        matched, unmatched, _ = match_symptoms(previous_symptoms, symptoms, vectors=vectors,
+                                               min_similarity=MIN_SIMILARITY)
+        previous_column = {id(latest[column]): column for column in previous}
+        for earlier, symptom in matched:
+            column_of.setdefault(id(symptom), previous_column[id(earlier)])
+
+        # Symptoms returning after a gap rejoin the column they had, else start a new one
+        dormant = [column for column in latest if column not in previous]
+        if unmatched and dormant:
+            dormant_column = {id(latest[column]): column for column in dormant}
+            returned, unmatched, _ = match_symptoms([latest[column] for column in dormant], unmatched,
+                                                    vectors=vectors, min_similarity=MIN_SIMILARITY)
+            for earlier, symptom in returned:
+                column_of[id(symptom)] = dormant_column[id(earlier)]
+        for symptom in unmatched:
+            column_of[id(symptom)] = len(descriptions)
+            descriptions.append(symptom['description'])
+
+        session_columns, seen = [], set()
+        for symptom in symptoms:
+            column = column_of[id(symptom)]
+            session_columns.append(None if column in seen else column)
+            if column not in seen:
+                seen.add(column)
+                latest[column] = symptom
+        columns.append(session_columns)
+        previous = sorted(seen)
+    return columns, descriptions
+
+
+def _pair_changes(intensity, frequency, present, first, second):
+    """Compare rows first[k] with rows second[k] of the symptom matrices, for every k at once
+
+    Mirrors the per-symptom change of the comparison page: the intensity
+    drop plus the sign of the frequency drop, halved and averaged over the
+    symptoms present in both sessions. Returns (overall progress score,
+    matched, new, resolved counts), one entry per pair.
+    """
+    both = present[first] & present[second]
+    frequency_drop = np.nan_to_num(np.sign(frequency[first] - frequency[second]))
+    change = np.where(both, (intensity[first] - intensity[second] + frequency_drop) / 2, 0.0)
+    matched = both.sum(axis=-1)
+    return (
+        change.sum(axis=-1) / np.maximum(matched, 1),
+        matched,
+        (present[second] & ~present[first]).sum(axis=-1),
+        (present[first] & ~present[second]).sum(axis=-1)
+    )
+
+
+class ComparisonMatrix:
+    """Comparisons between a client's sessions, oldest session first
+
+    Holds each session's instrument totals and symptom levels, the
+    comparison of every consecutive pair and, if built with all_pairs, of
+    every ordered pair (first row, second column).
+    """
+
+    ARRAYS = ('totals', 'intensity', 'frequency', 'present', 'consecutive_progress', 'consecutive_counts',
+              'pair_progress', 'pair_counts')
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.session_ids = meta['session_ids']
+        self.dates = meta['dates']
+        self.labels = meta['labels']
+        self.instruments = meta['instruments']
+        self.symptoms = meta['symptoms']
+        self.signature = meta['signature']
+        for name in self.ARRAYS:
+            setattr(self, name, arrays.get(name))
+
+    @property
+    def all_pairs(self):
+        return self.pair_progress is not None
+
+    def session_over_session(self):
+        """Return a DataFrame with one row per consecutive pair of sessions"""
+        rows = []
+        for k in range(len(self.session_ids) - 1):
+            row = {'From': self.dates[k], 'To': self.dates[k + 1]}
+            for i, instrument in enumerate(self.instruments):
+                row[f"{instrument['name']} change"] = int(self.totals[k + 1, i] - self.totals[k, i])
+            matched, new, resolved = self.consecutive_counts[k]
+            row.update({'Symptom progress': round(float(self.consecutive_progress[k]), 2),
+                        'Matched': int(matched), 'New': int(new), 'Resolved': int(resolved)})
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def total_changes(self, instrument_id):
+        """Return an all-pairs DataFrame of an instrument's total change from the row to the column session"""
+        i = [instrument['id'] for instrument in self.instruments].index(instrument_id)
+        totals = self.totals[:, i]
+        return pd.DataFrame(totals[None, :] - totals[:, None], index=self.labels, columns=self.labels)
+
+    def progress(self):
+        """Return an all-pairs DataFrame of the symptom progress score from the row to the column session
+
+        Symptoms are linked through the intervening sessions, so a cell may
+        differ from compare_sessions() on the same two sessions.
+        """
+        return pd.DataFrame(self.pair_progress, index=self.labels, columns=self.labels)
+
+
+def matrix_signature(sessions):
+    """Identify the inputs of a client's matrix: its sessions' contents, the rules and the symptom vectors"""
+    digest = hashlib.sha256(vectors_version().encode('utf-8'))
+    for session_id in sorted(sessions):
+        digest.update(f"{session_id}:{sessions[session_id]['content_hash']}:{sessions[session_id]['date']};"
+                      .encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def _session_labels(session_ids, sessions):
+    """Label sessions by date and file name, adding the session ID where that is ambiguous"""
+    labels = [f"{session['date']} - {session['file_name']}" for session in sessions]
+    repeated = {label for label in labels if labels.count(label) > 1}
+    return [f"{label} ({session_id})" if label in repeated else label
+            for label, session_id in zip(labels, session_ids)]
+
+
+def build_comparison_matrix(sessions, all_pairs=False):
+    """Build the comparison matrix of a client's sessions ({session_id: session} as the session store returns)"""
+    order = sorted(sessions, key=lambda session_id: (sessions[session_id]['date'], session_id))
+    ordered = [sessions[session_id] for session_id in order]
+    instruments = list(get_assessment_engine().instruments.values())
+    columns, descriptions = _track_symptoms(ordered)
+
+    count = len(ordered)
+    totals = np.array([[session['features'][instrument.id]['total_score'] for instrument in instruments]
+                       for session in ordered], dtype=np.int64).reshape(count, len(instruments))
+    intensity = np.zeros((count, len(descriptions)))
+    frequency = np.full((count, len(descriptions)), np.nan)
+    present = np.zeros((count, len(descriptions)), dtype=bool)
+    for k, session in enumerate(ordered):
+        for symptom, column in zip(session['features']['symptoms'], columns[k]):
+            if column is None:
+                continue
+            level = symptom_intensity_level(symptom)
+            intensity[k, column] = INTENSITY_LEVELS['moderate'] if level is None else level
+            level = symptom_frequency_level(symptom)
+            frequency[k, column] = np.nan if level is None else level
+            present[k, column] = True
+
+    steps = np.arange(count - 1)
+    progress, *counts = _pair_changes(intensity, frequency, present, steps, steps + 1)
+    arrays = {
+        'totals': totals, 'intensity': intensity, 'frequency': frequency, 'present': present,
+        'consecutive_progress': progress, 'consecutive_counts': np.stack(counts, axis=-1).reshape(-1, 3)
+    }
+    if all_pairs:
+        rows, cols = np.meshgrid(np.arange(count), np.arange(count), indexing='ij')
+        progress, *counts = _pair_changes(intensity, frequency, present, rows, cols)
+        arrays['pair_progress'] = progress
+        arrays['pair_counts'] = np.stack(counts, axis=-1)
+
+    meta = {
+        'session_ids': order,
+        'dates': [session['date'] for session in ordered],
+        'labels': _session_labels(order, ordered),
+        'instruments': [{'id': instrument.id, 'name': instrument.name} for instrument in instruments],
+        'symptoms': descriptions,
+        'signature': matrix_signature(sessions)
+    }
+    return ComparisonMatrix(meta, arrays)
+
+
+class ComparisonMatrixStore:
+    """Per-client comparison matrices, persisted and rebuilt in the background
+
+    Each matrix is saved as an .npz file holding its arrays and metadata.
+    A stored matrix is used while its signature matches the client's
+    current sessions; otherwise it is rebuilt, on the caller's thread if
+    it is needed now or on the background worker after an upload.
+    """
+
+    def __init__(self, directory=None, session_store=None):
+        self.directory = directory or os.path.join(STORAGE_DIR, 'comparison_matrices')
+        self._session_store = session_store
+        self._lock = threading.Lock()
+        self._matrices = {}
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='comparison-matrix')
+
+    @property
+    def session_store(self):
+        if self._session_store is None:
+            self._session_store = get_session_store()
+        return self._session_store
+
+    def path_for(self, client_id):
+        """Return the file path of a client's stored matrix"""
+        name = hashlib.sha256(client_id.encode('utf-8')).hexdigest()[:24]
+        return os.path.join(self.directory, f"{name}.npz")
+
+    def _load(self, client_id):
+        """Read a client's stored matrix, or None"""
+        path = self.path_for(client_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                meta = json.loads(str(stored['meta']))
+                arrays = {name: stored[name] for name in ComparisonMatrix.ARRAYS if name in stored.files}
+        except (OSError, ValueError, KeyError):
+            return None  # Unreadable or from an older layout; it is rebuilt
+        return ComparisonMatrix(meta, arrays)
+
+    def _save(self, client_id, matrix):
+        """Write a client's matrix, replacing the stored one atomically"""
+        os.makedirs(self.directory, exist_ok=True)
+        arrays = {name: getattr(matrix, name) for name in ComparisonMatrix.ARRAYS
+                  if getattr(matrix, name) is not None}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as matrix_file:
+            np.savez(matrix_file, meta=np.array(json.dumps(matrix.meta)), **arrays)
+        os.replace(tmp_path, self.path_for(client_id))
+
+    def _cached(self, client_id, signature, all_pairs):
+        """Return the in-memory or stored matrix if it is current and covers what is asked"""
+        matrix = self._matrices.get(client_id)
+        if matrix is None or matrix.signature != signature:
+            matrix = self._load(client_id)
+            if matrix is not None:
+                self._matrices[client_id] = matrix
+        if matrix is not None and matrix.signature == signature and (matrix.all_pairs or not all_pairs):
+            return matrix
+        return None
+
+    def _build(self, client_id, sessions, all_pairs):
+        matrix = build_comparison_matrix(sessions, all_pairs)
+        self._save(client_id, matrix)
+        with self._lock:
+            self._matrices[client_id] = matrix
+        return matrix
+
+    def get(self, client_id, sessions=None, all_pairs=False):
+        """Return a client's current matrix, building it now if no current one is stored or being built"""
+        if sessions is None:
+            sessions = self.session_store.client_sessions(client_id)
+        signature = matrix_signature(sessions)
+        with self._lock:
+            matrix = self._cached(client_id, signature, all_pairs)
+            pending = self._pending.get(client_id)
+        if matrix is not None:
+            return matrix
+        if pending is not None:
+            try:
+                matrix = pending.result()
+            except Exception:  # A failed background build is retried below
+                matrix = None
+            if matrix is not None and matrix.signature == signature and (matrix.all_pairs or not all_pairs):
+                return matrix
+        return self._build(client_id, sessions, all_pairs)
+
+    def refresh(self, client_ids):
+        """Rebuild the matrices of the given clients on the background worker (after an upload)"""
+        for client_id in set(client_ids):
+            with self._lock:
+                stored = self._matrices.get(client_id)
+                all_pairs = stored.all_pairs if stored is not None else False
+                future = self._executor.submit(self._refresh, client_id, all_pairs)
+                self._pending[client_id] = future
+            future.add_done_callback(lambda done, client_id=client_id: self._forget(client_id, done))
+
+    def _refresh(self, client_id, all_pairs):
+        sessions = self.session_store.client_sessions(client_id)
+        with self._lock:
+            matrix = self._cached(client_id, matrix_signature(sessions), all_pairs)
+        return matrix if matrix is not None else self._build(client_id, sessions, all_pairs)
+
+    def _forget(self, client_id, future):
+        with self._lock:
+            if self._pending.get(client_id) is future:
+                del self._pending[client_id]
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_comparison_matrices():
+    """Return the process-wide comparison matrix store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = ComparisonMatrixStore()
+    return _default_store
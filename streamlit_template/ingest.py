@@ -0,0 +1,299 @@
+"""Bulk ingestion of therapy session notes across a process pool
+
+Can also be run headless to backfill a directory of notes:
+
+    python ingest.py ../uploads --output ingested_sessions.jsonl --workers 4
+
+Each processed file is appended to the output file as one JSON line, which
+doubles as the checkpoint: re-running the same command skips files that are
+already recorded there, so an interrupted backfill resumes where it stopped.
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import parse_session_note, read_note_file, extract_session_date, note_content_hash
+from client_identity import extract_client_id
+from note_schema import project_note, NoteSchemaError
+from note_store import get_raw_note_store
+from session_store import get_session_store, session_id_for_hash
+from ingest_log import get_ingest_log, session_record
+from scoring_core import score_note
+
+# File types accepted as session notes, on their own or inside a zip archive
+NOTE_EXTENSIONS = ('.txt', '.json')
+
+# Documentation shipped alongside notes, such as the note template explanation, is not ingested
+NON_NOTE_FILE_PATTERN = re.compile(r'template|readme', re.IGNORECASE)
+
+# Notes logged, stored and checkpointed per batch during headless ingestion
+RECORD_BATCH_SIZE = 256
+
+
+def is_note_file(file_name):
+    """Return whether a file name looks like a session note rather than a folder's metadata or docs"""
+    base_name = os.path.basename(file_name)
+    return (base_name.lower().endswith(NOTE_EXTENSIONS) and not base_name.startswith('.')
+            and not NON_NOTE_FILE_PATTERN.search(base_name))
+
+
+def expand_uploads(files):
+    """Yield (file_name, raw_bytes) for each note, unpacking any zip archives"""
+    for file_name, raw in files:
+        if not file_name.lower().endswith('.zip'):
+            yield file_name, raw
+            continue
+
+        with zipfile.ZipFile(io.BytesIO(raw)) as archive:
+            for info in archive.infolist():
+                base_name = os.path.basename(info.filename)
+                # Skip folders, OS metadata such as __MACOSX/._note.txt and bundled docs
+                if info.is_dir() or info.filename.startswith('__MACOSX'):
+                    continue
+                if is_note_file(base_name):
+                    yield f"{file_name}/{info.filename}", archive.read(info)
+
+
+def _parse_and_score(file_name, load_note):
+    """Load a note with load_note() then extract and score it, capturing errors"""
+    try:
+        json_data = load_note()
+        content_hash = note_content_hash(json_data)
+        # Validate and keep only the sections the analysis needs
+        note = project_note(json_data)
+        features = score_note(note)
+        # The full note goes to disk; only its reference travels back to the caller
+        note_ref = get_raw_note_store().put(content_hash, json_data)
+        return {
+            'file_name': file_name,
+            'data': note,
+            'content_hash': content_hash,
+            'note_ref': note_ref,
+            'date': extract_session_date(note),
+            'features': features,
+            'error': None
+        }
+    except json.JSONDecodeError as e:
+        return {'file_name': file_name, 'error': f"Invalid JSON: {e}"}
+    except NoteSchemaError as e:
+        return {'file_name': file_name, 'error': f"Invalid session note: {e}"}
+    except Exception as e:
+        return {'file_name': file_name, 'error': str(e)}
+
+
+def process_note(file_name, raw):
+    """Parse and score a single session note (runs inside a worker process)"""
+    return _parse_and_score(file_name, lambda: parse_session_note(raw))
+
+
+def process_note_file(file_name, path):
+    """Read, parse and score a session note from disk (runs inside a worker process)"""
+    return _parse_and_score(file_name, lambda: read_note_file(path))
+
+
+def map_notes(func, args, max_workers=None):
+    """Yield func(*arg) for each argument tuple, in input order, across a process pool"""
+    args = list(args)
+    total = len(args)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, total))
+
+    if max_workers == 1:
+        # Not worth paying process start-up for a single worker
+        for arg in args:
+            yield func(*arg)
+        return
+
+    # Batch notes per task so thousands of small files don't pay one IPC round trip each
+    chunksize = max(1, total // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(func, *zip(*args), chunksize=chunksize)
+
+
+def process_notes(notes, max_workers=None, on_progress=None):
+    """Parse and score many notes in parallel, returning results in input order
+
+    on_progress, if given, is called as on_progress(done, total) from the
+    calling thread after each note finishes.
+    """
+    notes = list(notes)
+    results = []
+    for result in map_notes(process_note, notes, max_workers):
+        results.append(result)
+        if on_progress:
+            on_progress(len(results), len(notes))
+    return results
+
+
+def log_sessions(sessions):
+    """Durably record sessions in the ingest log before they are stored
+
+    Each session is a dict with client_id, date, file_name, content_hash
+    and note_ref; session IDs follow from the content hash. Logging comes
+    first so the log replay.py rebuilds from always holds every stored
+    session; replay ignores a session logged twice. A whole batch costs
+    one fsync.
+    """
+    if not sessions:
+        return
+    get_ingest_log().append([
+        session_record(s['client_id'], session_id_for_hash(s['content_hash']), s['date'], s['file_name'],
+                       s['content_hash'], s['note_ref'])
+        for s in sessions
+    ])
+
+
+def find_note_files(root):
+    """Yield the paths of all session notes under root, recursively and in a stable order
+
+    Files that are not notes by name, such as note_template_explanation.txt,
+    are left out.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if is_note_file(name):
+                yield os.path.join(dirpath, name)
+
+
+def checkpoint_key(path, root):
+    """Identify a note file by relative path, size and modification time"""
+    stat = os.stat(path)
+    return f"{os.path.relpath(path, root)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_checkpoint(output_path, retry_failed=False):
+    """Return the checkpoint keys of files already recorded in the output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as output:
+        for line in output:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Partial last line from an interrupted run
+            if retry_failed and record.get('error'):
+                continue
+            done.add(record['checkpoint'])
+    return done
+
+
+def ingest_directory(root, output_path, max_workers=None, retry_failed=False, on_progress=None):
+    """Parse and score every note under root, appending results to output_path
+
+    Ingested sessions are also added to the session store the app reads,
+    and to the ingest log.
+    Files already recorded in output_path are skipped. Returns a summary dict
+    with the number of files ingested, failed and skipped.
+    """
+    done = load_checkpoint(output_path, retry_failed)
+    pending = []
+    skipped = 0
+    for path in find_note_files(root):
+        key = checkpoint_key(path, root)
+        if key in done:
+            skipped += 1
+        else:
+            pending.append((key, path))
+
+    summary = {'ingested': 0, 'failed': 0, 'skipped': skipped}
+    if not pending:
+        return summary
+
+    # Make sure a partial line left by an interrupted run doesn't swallow the next record
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'rb') as output:
+            output.seek(-1, os.SEEK_END)
+            needs_newline = output.read(1) != b'\n'
+    else:
+        needs_newline = False
+
+    args = [(os.path.relpath(path, root), path) for _, path in pending]
+    store = get_session_store()
+
+    def store_batch(batch):
+        """Log, store and checkpoint a batch of (checkpoint key, result) pairs"""
+        accepted = []
+        for _, result in batch:
+            if not result['error']:
+                # Client IDs are assigned here, not in the workers, as in the upload page
+                result['client_id'] = extract_client_id(result['data'], result['file_name'])
+                if not store.find_session(content_hash=result['content_hash']):
+                    accepted.append(result)
+        log_sessions(accepted)
+        records = []
+        for key, result in batch:
+            record = {'checkpoint': key, 'file_name': result['file_name'], 'error': result['error']}
+            if not result['error']:
+                client_id, _, _ = store.add_session(
+                    result['client_id'], result['date'], result['file_name'],
+                    result['content_hash'], result['features'], result['note_ref']
+                )
+                record.update({
+                    'client_id': client_id,
+                    'content_hash': result['content_hash'],
+                    'date': result['date'],
+                    'note_ref': result['note_ref'],
+                    'symptoms': result['features']['symptoms'],
+                    'gad7': result['features']['gad7'],
+                    'phq9': result['features']['phq9']
+                })
+            records.append(json.dumps(record, ensure_ascii=False) + '\n')
+        # Checkpoint the batch only once it is stored, so an interruption retries it
+        output.writelines(records)
+        output.flush()
+
+    with open(output_path, 'a', encoding='utf-8') as output:
+        if needs_newline:
+            output.write('\n')
+        results = map_notes(process_note_file, args, max_workers)
+        batch = []
+        try:
+            for count, ((key, _), result) in enumerate(zip(pending, results), 1):
+                summary['failed' if result['error'] else 'ingested'] += 1
+                batch.append((key, result))
+                if len(batch) >= RECORD_BATCH_SIZE:
+                    store_batch(batch)
+                    batch = []
+                if on_progress:
+                    on_progress(count, len(pending))
+            store_batch(batch)
+        finally:
+            os.fsync(output.fileno())
+    return summary
+
+
+def main(argv=None):
+    """Command-line entry point for headless batch ingestion"""
+    parser = argparse.ArgumentParser(description="Parse and score a directory of therapy session notes.")
+    parser.add_argument('directory', help="Directory to scan recursively for session notes")
+    parser.add_argument('--output', default='ingested_sessions.jsonl',
+                        help="JSON Lines file to append results to; also used as the resume checkpoint")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Process files that failed in a previous run again")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+
+    def report_progress(done, total):
+        if done % 100 == 0 or done == total:
+            print(f"Processed {done} of {total} files", file=sys.stderr)
+
+    summary = ingest_directory(args.directory, args.output, args.workers, args.retry_failed, report_progress)
+    print(f"Ingested {summary['ingested']} notes, {summary['failed']} failed, "
+          f"{summary['skipped']} already done. Results in {args.output}")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
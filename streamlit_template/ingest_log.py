@@ -0,0 +1,215 @@
+"""Append-only, checksummed log of accepted sessions with compacted snapshots
+
+The log is the durable record of what was ingested; replay.py rebuilds the
+session store from it after a rule or schema change.
+"""
+import json
+import os
+import tempfile
+import threading
+import zlib
+
+from utils import STORAGE_DIR
+
+# Compact the log into a snapshot once it holds this many records
+SNAPSHOT_EVERY = 1000
+
+
+class IngestLogError(ValueError):
+    """Raised when a snapshot fails its checksum"""
+
+
+def encode_record(record):
+    """Frame a record as one line: CRC-32 of the JSON payload, a space, the payload"""
+    payload = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+
+def decode_record(line):
+    """Return the record framed in a line, or None if it is torn or corrupt"""
+    if not line.endswith(b'\n') or len(line) < 10 or line[8:9] != b' ':
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def session_record(client_id, session_id, session_date, file_name, content_hash, note_ref):
+    """Build the log record of an accepted session"""
+    return {
+        'op': 'session',
+        'client_id': client_id,
+        'session_id': session_id,
+        'date': session_date,
+        'file_name': file_name,
+        'content_hash': content_hash,
+        'note_ref': note_ref
+    }
+
+
+def merge_record(source_client_id, target_client_id):
+    """Build the log record of a client merge"""
+    return {'op': 'merge', 'source': source_client_id, 'target': target_client_id}
+
+
+def apply_record(sessions, record):
+    """Apply one log record to the session_id -> session record state"""
+    if record['op'] == 'session':
+        sessions.setdefault(record['session_id'], record)
+    elif record['op'] == 'merge':
+        for session in sessions.values():
+            if session['client_id'] == record['source']:
+                session['client_id'] = record['target']
+
+
+class IngestLog:
+    """Crash-safe append-only log with group-commit fsync
+
+    Every record carries a sequence number and a CRC-32, so a torn write at
+    the end of the log is detected and cut off when the log is reopened.
+    Concurrent appends share fsyncs: whoever syncs first covers every record
+    written before it, so a burst of uploads costs far fewer fsyncs than
+    records. Every SNAPSHOT_EVERY records the current state is written to a
+    snapshot and the log is emptied, keeping cold start to one snapshot load
+    plus a short tail. The snapshot's first line is a header holding its
+    sequence number, so opening the log reads that line and the tail only.
+    Only one process should append to a log at a time.
+    """
+
+    def __init__(self, path=None, snapshot_every=SNAPSHOT_EVERY):
+        self.path = path or os.path.join(STORAGE_DIR, 'ingest.log')
+        self.snapshot_path = os.path.splitext(self.path)[0] + '.snapshot'
+        self.snapshot_every = snapshot_every
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        self._seq = self._read_snapshot_header()['seq']
+        self._tail_records = 0
+        valid_bytes = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as log_file:
+                for line in log_file:
+                    record = decode_record(line)
+                    if record is None:
+                        break
+                    valid_bytes += len(line)
+                    self._seq = max(self._seq, record['seq'])
+                    self._tail_records += 1
+        self._file = open(self.path, 'ab')
+        # Cut off a torn record from an interrupted write
+        self._file.truncate(valid_bytes)
+        self._written_seq = self._synced_seq = self._seq
+
+    def _read_header(self, snapshot_file):
+        header = decode_record(snapshot_file.readline())
+        if header is None:
+            raise IngestLogError(f"{self.snapshot_path}: corrupt snapshot header")
+        return header
+
+    def _read_snapshot_header(self):
+        """Return the snapshot's {'seq', 'count'} header line alone, or a zero header if there is none"""
+        if not os.path.exists(self.snapshot_path):
+            return {'seq': 0, 'count': 0}
+        with open(self.snapshot_path, 'rb') as snapshot_file:
+            return self._read_header(snapshot_file)
+
+    def _read_snapshot(self):
+        """Return (seq, sessions) from the snapshot file, or (0, {}) if there is none"""
+        if not os.path.exists(self.snapshot_path):
+            return 0, {}
+        with open(self.snapshot_path, 'rb') as snapshot_file:
+            header = self._read_header(snapshot_file)
+            sessions = {}
+            for line in snapshot_file:
+                record = decode_record(line)
+                if record is None:
+                    raise IngestLogError(f"{self.snapshot_path}: corrupt snapshot record")
+                sessions[record['session_id']] = record
+        if len(sessions) != header['count']:
+            raise IngestLogError(f"{self.snapshot_path}: expected {header['count']} records, found {len(sessions)}")
+        return header['seq'], sessions
+
+    def append(self, records):
+        """Durably append records, returning once they are fsynced"""
+        if not records:
+            return
+        with self._lock:
+            lines = []
+            for record in records:
+                self._seq += 1
+                lines.append(encode_record(dict(record, seq=self._seq)))
+            self._file.write(b''.join(lines))
+            self._tail_records += len(records)
+            self._written_seq = target = self._seq
+        self._sync(target)
+        if self._tail_records >= self.snapshot_every:
+            self.compact()
+
+    def _sync(self, target):
+        """Fsync the log up to at least record target, sharing the fsync with concurrent appenders"""
+        with self._sync_lock:
+            if self._synced_seq >= target:
+                return  # Another appender's fsync already covered these records
+            with self._lock:
+                self._file.flush()
+                covered = self._written_seq
+            os.fsync(self._file.fileno())
+            self._synced_seq = covered
+
+    def _load_state(self):
+        """Fold the snapshot and the log tail into the current state (caller holds the lock)"""
+        self._file.flush()
+        seq, sessions = self._read_snapshot()
+        with open(self.path, 'rb') as log_file:
+            for line in log_file:
+                record = decode_record(line)
+                if record is None:
+                    break
+                if record['seq'] > seq:  # Records already folded into the snapshot are skipped
+                    apply_record(sessions, record)
+                    seq = record['seq']
+        return seq, sessions
+
+    def load_state(self):
+        """Return (seq, sessions): the last applied sequence number and session_id -> session record"""
+        with self._lock:
+            return self._load_state()
+
+    def compact(self):
+        """Write the current state to a snapshot and empty the log"""
+        with self._sync_lock, self._lock:
+            seq, sessions = self._load_state()
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.snapshot_path) or '.', suffix='.tmp')
+            with os.fdopen(fd, 'wb') as snapshot_file:
+                snapshot_file.write(encode_record({'seq': seq, 'count': len(sessions)}))
+                snapshot_file.writelines(encode_record(session) for session in sessions.values())
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            # A crash before this truncate is harmless: records up to seq are skipped on load
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            self._synced_seq = self._written_seq = self._seq
+            self._tail_records = 0
+
+    def close(self):
+        self._file.close()
+
+
+_default_log = None
+_default_log_lock = threading.Lock()
+
+
+def get_ingest_log():
+    """Return the process-wide ingest log"""
+    global _default_log
+    if _default_log is None:
+        with _default_log_lock:
+            if _default_log is None:
+                _default_log = IngestLog()
+    return _default_log
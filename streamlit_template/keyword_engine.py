@@ -0,0 +1,64 @@
+"""Aho-Corasick multi-keyword matching for mapping symptoms to assessment questions"""
+from collections import deque
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over a fixed set of keywords
+
+    Each keyword carries one or more labels. search() walks a text once and
+    returns the labels of every keyword occurring in it as a substring, so
+    the cost is linear in the text length however many keywords there are.
+    """
+
+    def __init__(self, keyword_labels):
+        # State 0 is the root; each state has goto edges, a failure link and output labels
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for keyword, labels in keyword_labels.items():
+            state = 0
+            for char in keyword:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].update(labels)
+
+        # Breadth-first pass setting failure links, merging outputs along them and
+        # completing every state's transitions so matching never follows a failure link
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in list(self._goto[state].items()):
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+            if state:
+                for char, fail_state in self._goto[self._fail[state]].items():
+                    self._goto[state].setdefault(char, fail_state)
+        self._output = [frozenset(labels) if labels else None for labels in self._output]
+
+    def search(self, text):
+        """Return the set of labels of all keywords found in text"""
+        found = set()
+        goto, output = self._goto, self._output
+        state = 0
+        for char in text:
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                found |= output[state]
+        return found
+
+
+def compile_keywords(question_keywords):
+    """Compile {label: [keywords]} into an automaton emitting the labels each text mentions"""
+    keyword_labels = {}
+    for label, keywords in question_keywords.items():
+        for keyword in keywords:
+            keyword_labels.setdefault(keyword, set()).add(label)
+    return KeywordAutomaton(keyword_labels)
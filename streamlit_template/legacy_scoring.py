@@ -0,0 +1,433 @@
+"""Frozen copies of the GAD-7/PHQ-9 scorers replaced by the scoring core
+
+Kept only so scoring_harness.py can measure them against scoring_core;
+delete this module once they are retired. The app scorer is the original
+if/elif implementation from app.py, the notebook scorer the
+map_to_standardized_assessments() of code.ipynb. Do not fix or tune
+either: they are the reference the core is compared with.
+"""
+import re
+
+
+# ----- app.py scorer -----
+
+def app_extract_symptoms(json_data):
+    """Extract symptoms and their attributes from session notes"""
+    symptoms = []
+    if isinstance(json_data, dict) and 'Psychological Factors' in json_data:
+        psych_factors = json_data['Psychological Factors']
+        if 'Symptoms' in psych_factors and isinstance(psych_factors['Symptoms'], dict):
+            for symptom_key, symptom_data in psych_factors['Symptoms'].items():
+                if isinstance(symptom_data, dict):
+                    symptom = {
+                        'description': symptom_data.get('Description', 'Unknown'),
+                        'intensity': symptom_data.get('Intensity', 'Unknown'),
+                        'frequency': symptom_data.get('Frequency', 'Unknown'),
+                        'duration': symptom_data.get('Duration', 'Unknown'),
+                        'quote': symptom_data.get('Quote (Symptom)', '')
+                    }
+                    symptoms.append(symptom)
+    
+    # Also check Mental Status Exam for additional symptoms
+    if isinstance(json_data, dict) and 'Mental Status Exam' in json_data:
+        mse = json_data['Mental Status Exam']
+        if 'Mood and Affect' in mse and mse['Mood and Affect']:
+            mood_match = re.search(r'(anxious|depressed|stressed)', mse['Mood and Affect'], re.IGNORECASE)
+            if mood_match:
+                symptoms.append({
+                    'description': f"Mood: {mood_match.group(0)}",
+                    'intensity': 'Observed',
+                    'frequency': 'During session',
+                    'duration': 'Unknown',
+                    'quote': mse['Mood and Affect']
+                })
+    
+    # Check Risk Assessment for additional concerns
+    if isinstance(json_data, dict) and 'Risk Assessment' in json_data:
+        risk = json_data['Risk Assessment']
+        if 'Hopelessness' in risk and risk['Hopelessness'] and risk['Hopelessness'] != 'NA':
+            symptoms.append({
+                'description': 'Hopelessness',
+                'intensity': 'Observed',
+                'frequency': 'Unknown',
+                'duration': 'Unknown',
+                'quote': risk.get('Quote (Risk)', risk['Hopelessness'])
+            })
+    
+    return symptoms
+
+
+def app_map_to_gad7(symptoms):
+    """Map extracted symptoms to GAD-7 assessment"""
+    gad7_scores = {q: 0 for q in range(1, 8)}
+    
+    for symptom in symptoms:
+        description = symptom['description'].lower() if isinstance(symptom['description'], str) else ''
+        intensity = symptom['intensity'].lower() if isinstance(symptom['intensity'], str) else ''
+        quote = symptom['quote'].lower() if isinstance(symptom['quote'], str) else ''
+        
+        # Question 1: Feeling nervous, anxious, or on edge
+        if any(keyword in description or keyword in quote for keyword in ['nervous', 'anxious', 'anxiety', 'on edge', 'stress']):
+            if 'high' in intensity or 'severe' in intensity:
+                gad7_scores[1] = 3
+            elif 'moderate' in intensity:
+                gad7_scores[1] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                gad7_scores[1] = 1
+            else:
+                gad7_scores[1] = 1  # Default if intensity not specified
+        
+        # Question 2: Not being able to stop or control worrying
+        if any(keyword in description or keyword in quote for keyword in ['worrying', 'worry', 'can\'t stop', 'uncontrollable']):
+            if 'high' in intensity or 'severe' in intensity:
+                gad7_scores[2] = 3
+            elif 'moderate' in intensity:
+                gad7_scores[2] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                gad7_scores[2] = 1
+            else:
+                gad7_scores[2] = 1
+        
+        # Question 3: Worrying too much about different things
+        if any(keyword in description or keyword in quote for keyword in ['worry too much', 'worrying about', 'different things']):
+            if 'high' in intensity or 'severe' in intensity:
+                gad7_scores[3] = 3
+            elif 'moderate' in intensity:
+                gad7_scores[3] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                gad7_scores[3] = 1
+            else:
+                gad7_scores[3] = 1
+        
+        # Question 4: Trouble relaxing
+        if any(keyword in description or keyword in quote for keyword in ['relax', 'relaxing', 'tense', 'tension']):
+            if 'high' in intensity or 'severe' in intensity:
+                gad7_scores[4] = 3
+            elif 'moderate' in intensity:
+                gad7_scores[4] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                gad7_scores[4] = 1
+            else:
+                gad7_scores[4] = 1
+        
+        # Question 5: Being so restless that it's hard to sit still
+        if any(keyword in description or keyword in quote for keyword in ['restless', 'sit still', 'agitated', 'fidgety']):
+            if 'high' in intensity or 'severe' in intensity:
+                gad7_scores[5] = 3
+            elif 'moderate' in intensity:
+                gad7_scores[5] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                gad7_scores[5] = 1
+            else:
+                gad7_scores[5] = 1
+        
+        # Question 6: Becoming easily annoyed or irritable
+        if any(keyword in description or keyword in quote for keyword in ['annoyed', 'irritable', 'irritability', 'frustrated']):
+            if 'high' in intensity or 'severe' in intensity:
+                gad7_scores[6] = 3
+            elif 'moderate' in intensity:
+                gad7_scores[6] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                gad7_scores[6] = 1
+            else:
+                gad7_scores[6] = 1
+        
+        # Question 7: Feeling afraid, as if something awful might happen
+        if any(keyword in description or keyword in quote for keyword in ['afraid', 'fear', 'terrible', 'awful', 'catastrophic']):
+            if 'high' in intensity or 'severe' in intensity:
+                gad7_scores[7] = 3
+            elif 'moderate' in intensity:
+                gad7_scores[7] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                gad7_scores[7] = 1
+            else:
+                gad7_scores[7] = 1
+    
+    # Calculate total score
+    total_score = sum(gad7_scores.values())
+    
+    # Determine severity category
+    if total_score <= 4:
+        severity = "Minimal anxiety"
+    elif total_score <= 9:
+        severity = "Mild anxiety"
+    elif total_score <= 14:
+        severity = "Moderate anxiety"
+    else:
+        severity = "Severe anxiety"
+    
+    return {
+        'scores': gad7_scores,
+        'total_score': total_score,
+        'severity': severity
+    }
+
+
+def app_map_to_phq9(symptoms, json_data):
+    """Map extracted symptoms to PHQ-9 assessment"""
+    phq9_scores = {q: 0 for q in range(1, 10)}
+    
+    # Process symptoms
+    for symptom in symptoms:
+        description = symptom['description'].lower() if isinstance(symptom['description'], str) else ''
+        intensity = symptom['intensity'].lower() if isinstance(symptom['intensity'], str) else ''
+        quote = symptom['quote'].lower() if isinstance(symptom['quote'], str) else ''
+        
+        # Question 1: Little interest or pleasure in doing things
+        if any(keyword in description or keyword in quote for keyword in ['anhedonia', 'no interest', 'little interest', 'no pleasure', 'lost interest']):
+            if 'high' in intensity or 'severe' in intensity:
+                phq9_scores[1] = 3
+            elif 'moderate' in intensity:
+                phq9_scores[1] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                phq9_scores[1] = 1
+            else:
+                phq9_scores[1] = 1
+        
+        # Question 2: Feeling down, depressed, or hopeless
+        if any(keyword in description or keyword in quote for keyword in ['depressed', 'depression', 'feeling down', 'hopeless', 'despair']):
+            if 'high' in intensity or 'severe' in intensity:
+                phq9_scores[2] = 3
+            elif 'moderate' in intensity:
+                phq9_scores[2] = 2
+            elif 'mild' in intensity or 'low' in intensity:
+                phq9_scores[2] = 1
+            else:
+                phq9_scores[2] = 1
+    
+    # Check biological factors for sleep issues (Question 3)
+    if isinstance(json_data, dict) and 'Biological Factors' in json_data:
+        bio_factors = json_data['Biological Factors']
+        if 'Sleep' in bio_factors and bio_factors['Sleep'] and bio_factors['Sleep'] != 'NA':
+            sleep_issues = re.search(r'(difficulty|problem|issue|trouble|insomnia|too much|oversleep)', bio_factors['Sleep'], re.IGNORECASE)
+            if sleep_issues:
+                phq9_scores[3] = 2  # Default to moderate if sleep issues mentioned
+    
+    # Check for energy levels (Question 4)
+    for symptom in symptoms:
+        if any(keyword in symptom.get('description', '').lower() or keyword in symptom.get('quote', '').lower() 
+              for keyword in ['tired', 'fatigue', 'no energy', 'little energy', 'exhausted']):
+            phq9_scores[4] = 2
+    
+    # Check for appetite issues (Question 5)
+    if isinstance(json_data, dict) and 'Biological Factors' in json_data:
+        bio_factors = json_data['Biological Factors']
+        if 'Nutrition' in bio_factors and bio_factors['Nutrition'] and bio_factors['Nutrition'] != 'NA':
+            appetite_issues = re.search(r'(poor appetite|overeating|not eating|eating too much)', bio_factors['Nutrition'], re.IGNORECASE)
+            if appetite_issues:
+                phq9_scores[5] = 2
+    
+    # Question 6: Feeling bad about yourself
+    for symptom in symptoms:
+        if any(keyword in symptom.get('description', '').lower() or keyword in symptom.get('quote', '').lower() 
+              for keyword in ['worthless', 'guilt', 'failure', 'blame', 'let down', 'disappointed in self']):
+            if 'high' in symptom.get('intensity', '').lower() or 'severe' in symptom.get('intensity', '').lower():
+                phq9_scores[6] = 3
+            elif 'moderate' in symptom.get('intensity', '').lower():
+                phq9_scores[6] = 2
+            else:
+                phq9_scores[6] = 1
+    
+    # Question 7: Trouble concentrating
+    for symptom in symptoms:
+        if any(keyword in symptom.get('description', '').lower() or keyword in symptom.get('quote', '').lower() 
+              for keyword in ['concentrate', 'focus', 'attention', 'distracted']):
+            if 'high' in symptom.get('intensity', '').lower() or 'severe' in symptom.get('intensity', '').lower():
+                phq9_scores[7] = 3
+            elif 'moderate' in symptom.get('intensity', '').lower():
+                phq9_scores[7] = 2
+            else:
+                phq9_scores[7] = 1
+    
+    # Question 8: Moving or speaking slowly
+    for symptom in symptoms:
+        if any(keyword in symptom.get('description', '').lower() or keyword in symptom.get('quote', '').lower() 
+              for keyword in ['slow', 'sluggish', 'restless', 'fidgety', 'agitated', 'psychomotor']):
+            if 'high' in symptom.get('intensity', '').lower() or 'severe' in symptom.get('intensity', '').lower():
+                phq9_scores[8] = 3
+            elif 'moderate' in symptom.get('intensity', '').lower():
+                phq9_scores[8] = 2
+            else:
+                phq9_scores[8] = 1
+    
+    # Question 9: Thoughts of self-harm
+    if isinstance(json_data, dict) and 'Risk Assessment' in json_data:
+        risk = json_data['Risk Assessment']
+        if 'Suicidal Thoughts or Attempts' in risk and risk['Suicidal Thoughts or Attempts'] != 'NA' and risk['Suicidal Thoughts or Attempts'] != 'No Indication of Risk':
+            phq9_scores[9] = 3  # High risk if any suicidal thoughts are mentioned
+        elif 'Self Harm' in risk and risk['Self Harm'] != 'NA' and risk['Self Harm'] != 'No Indication of Risk':
+            phq9_scores[9] = 3  # High risk if any self-harm is mentioned
+        elif 'Hopelessness' in risk and risk['Hopelessness'] != 'NA' and risk['Hopelessness'] != 'No hopelessness expressed or observed.':
+            # Check for passive suicidal ideation in hopelessness
+            passive_si = re.search(r'(better off dead|not worth living|giving up|end it all)', risk['Hopelessness'], re.IGNORECASE)
+            if passive_si:
+                phq9_scores[9] = 2
+    
+    # Calculate total score
+    total_score = sum(phq9_scores.values())
+    
+    # Determine severity category
+    if total_score <= 4:
+        severity = "None-minimal depression"
+    elif total_score <= 9:
+        severity = "Mild depression"
+    elif total_score <= 14:
+        severity = "Moderate depression"
+    elif total_score <= 19:
+        severity = "Moderately severe depression"
+    else:
+        severity = "Severe depression"
+    
+    return {
+        'scores': phq9_scores,
+        'total_score': total_score,
+        'severity': severity
+    }
+
+
+def app_scores(json_data):
+    """Score a note with the original app scorer"""
+    symptoms = app_extract_symptoms(json_data)
+    return {'gad7': app_map_to_gad7(symptoms), 'phq9': app_map_to_phq9(symptoms, json_data)}
+
+
+# ----- code.ipynb scorer -----
+
+# Define GAD-7 (Generalized Anxiety Disorder) assessment questions and scoring
+notebook_gad7_questions = [
+    "Feeling nervous, anxious, or on edge",
+    "Not being able to stop or control worrying",
+    "Worrying too much about different things",
+    "Trouble relaxing",
+    "Being so restless that it's hard to sit still",
+    "Becoming easily annoyed or irritable",
+    "Feeling afraid, as if something awful might happen"
+]
+
+# Define PHQ-9 (Patient Health Questionnaire for Depression) assessment questions and scoring
+notebook_phq9_questions = [
+    "Little interest or pleasure in doing things",
+    "Feeling down, depressed, or hopeless",
+    "Trouble falling or staying asleep, or sleeping too much",
+    "Feeling tired or having little energy",
+    "Poor appetite or overeating",
+    "Feeling bad about yourself or that you are a failure",
+    "Trouble concentrating on things",
+    "Moving or speaking so slowly that other people could have noticed",
+    "Thoughts that you would be better off dead or of hurting yourself"
+]
+
+
+def notebook_map_to_standardized_assessments(notes_data):
+    """
+    Map symptoms and indicators to standardized assessments (GAD-7 and PHQ-9)
+    Uses the notes content to approximate scores on these assessments
+    """
+    features = {}
+    
+    # Extract all relevant text for analysis
+    symptoms_text = ""
+    mental_status_text = ""
+    progress_text = ""
+    
+    # Get symptoms descriptions
+    symptoms = notes_data.get("Psychological Factors", {}).get("Symptoms", {})
+    for symptom_key, symptom_data in symptoms.items():
+        symptoms_text += symptom_data.get("Description", "") + " "
+        symptoms_text += symptom_data.get("Quote (Symptom)", "") + " "
+    
+    # Get mental status descriptions
+    mental_status = notes_data.get("Mental Status Exam", {})
+    for key, value in mental_status.items():
+        mental_status_text += value + " "
+    
+    # Get progress descriptions
+    progress = notes_data.get("Progress and Response", {})
+    for key, value in progress.items():
+        progress_text += value + " "
+    
+    # Combine texts
+    all_text = (symptoms_text + " " + mental_status_text + " " + progress_text).lower()
+    
+    # Score GAD-7 questions based on text evidence
+    gad7_scores = []
+    for question in notebook_gad7_questions:
+        keywords = [word.lower() for word in question.split() if len(word) > 3]
+        evidence_count = sum(1 for keyword in keywords if keyword in all_text)
+        
+        # Convert evidence to GAD-7 scale (0-3)
+        if evidence_count == 0:
+            score = 0  # Not at all
+        elif evidence_count == 1:
+            score = 1  # Several days
+        elif evidence_count == 2:
+            score = 2  # More than half the days
+        else:
+            score = 3  # Nearly every day
+        
+        gad7_scores.append(score)
+        features[f"gad7_{keywords[0]}"] = score  # Use first keyword as feature name
+    
+    # Calculate GAD-7 total score
+    features["gad7_total_score"] = sum(gad7_scores)
+    
+    # Interpret GAD-7 score
+    if features["gad7_total_score"] < 5:
+        features["gad7_severity"] = "Minimal anxiety"
+    elif features["gad7_total_score"] < 10:
+        features["gad7_severity"] = "Mild anxiety"
+    elif features["gad7_total_score"] < 15:
+        features["gad7_severity"] = "Moderate anxiety"
+    else:
+        features["gad7_severity"] = "Severe anxiety"
+    
+    # Score PHQ-9 questions based on text evidence
+    phq9_scores = []
+    for question in notebook_phq9_questions:
+        keywords = [word.lower() for word in question.split() if len(word) > 3]
+        evidence_count = sum(1 for keyword in keywords if keyword in all_text)
+        
+        # Convert evidence to PHQ-9 scale (0-3)
+        if evidence_count == 0:
+            score = 0  # Not at all
+        elif evidence_count == 1:
+            score = 1  # Several days
+        elif evidence_count == 2:
+            score = 2  # More than half the days
+        else:
+            score = 3  # Nearly every day
+        
+        phq9_scores.append(score)
+        features[f"phq9_{keywords[0]}"] = score  # Use first keyword as feature name
+    
+    # Calculate PHQ-9 total score
+    features["phq9_total_score"] = sum(phq9_scores)
+    
+    # Interpret PHQ-9 score
+    if features["phq9_total_score"] < 5:
+        features["phq9_severity"] = "Minimal depression"
+    elif features["phq9_total_score"] < 10:
+        features["phq9_severity"] = "Mild depression"
+    elif features["phq9_total_score"] < 15:
+        features["phq9_severity"] = "Moderate depression"
+    elif features["phq9_total_score"] < 20:
+        features["phq9_severity"] = "Moderately severe depression"
+    else:
+        features["phq9_severity"] = "Severe depression"
+    
+    return features
+
+
+def notebook_scores(json_data):
+    """Score a note with the notebook scorer, in the app's result layout
+
+    The notebook names item features after each question's first long word,
+    and several questions share one ("feeling", "trouble", ...), so its item
+    scores overwrite each other; only totals and severities are comparable.
+    """
+    features = notebook_map_to_standardized_assessments(json_data)
+    return {
+        instrument: {'scores': None, 'total_score': features[f'{instrument}_total_score'],
+                     'severity': features[f'{instrument}_severity']}
+        for instrument in ('gad7', 'phq9')
+    }
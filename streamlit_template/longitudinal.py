@@ -0,0 +1,82 @@
+"""Per-client assessment score time series, maintained as sessions are stored
+
+The session store keeps, for every client and instrument, running
+statistics of the session totals (count, sum, sum of squares, minimum,
+maximum, first and latest score) updated in the same transaction that
+stores a session, plus a revision number bumped on every change. A
+ScoreSeries holds a client's date-sorted totals in memory. It is never
+changed once built: the store replaces it with a copy holding the new
+session when it adds one, so readers need no lock, and reloads it only
+when the revision shows that another process changed the client.
+"""
+import bisect
+import math
+
+import pandas as pd
+
+
+class ScoreSeries:
+    """A client's assessment totals in date order, with running statistics per instrument
+
+    stats maps each instrument ID to {'sessions', 'mean', 'sd', 'min', 'max',
+    'first', 'latest', 'change'}, as kept by the session store.
+    """
+
+    def __init__(self, client_id, revision, points, stats):
+        self.client_id = client_id
+        self.revision = revision
+        self.session_ids = []
+        self.dates = []
+        self.totals = {}
+        for session_id, session_date, totals in points:
+            self._insert(session_id, session_date, totals)
+        self.stats = stats
+
+    def with_session(self, session_id, session_date, totals, revision, stats):
+        """Return a copy of the series with a session's totals inserted at its date"""
+        series = ScoreSeries(self.client_id, revision, [], stats)
+        series.session_ids = list(self.session_ids)
+        series.dates = list(self.dates)
+        series.totals = {instrument: list(values) for instrument, values in self.totals.items()}
+        series._insert(session_id, session_date, totals)
+        return series
+
+    def _insert(self, session_id, session_date, totals):
+        """Insert a session's totals at its date, while the series is being built"""
+        # Sessions on the same date keep their upload order
+        position = bisect.bisect_right(self.dates, session_date)
+        self.session_ids.insert(position, session_id)
+        self.dates.insert(position, session_date)
+        for instrument, total in totals.items():
+            self.totals.setdefault(instrument, [None] * (len(self.dates) - 1)).insert(position, total)
+        for instrument, series in self.totals.items():
+            if instrument not in totals:
+                series.insert(position, None)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def frame(self, instruments=None):
+        """Return the series as a DataFrame with a session_date column and one <id>_total column per instrument"""
+        columns = {'session_date': pd.to_datetime(self.dates)}
+        for instrument in instruments or self.totals:
+            columns[f'{instrument}_total'] = self.totals.get(instrument, [None] * len(self.dates))
+        return pd.DataFrame(columns, index=self.session_ids)
+
+
+def series_stats(row):
+    """Turn a client_series row of the session store into the statistics of one instrument"""
+    sessions = row['sessions']
+    mean = row['total_sum'] / sessions
+    variance = max(row['total_sum_sq'] / sessions - mean * mean, 0.0)
+    return {
+        'sessions': sessions,
+        'mean': mean,
+        # Sample standard deviation, undefined for a single session
+        'sd': math.sqrt(variance * sessions / (sessions - 1)) if sessions > 1 else None,
+        'min': row['min_total'],
+        'max': row['max_total'],
+        'first': row['first_total'],
+        'latest': row['last_total'],
+        'change': row['last_total'] - row['first_total']
+    }
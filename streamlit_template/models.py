@@ -29,6 +29,7 @@ class MatchedSymptom:
     first_frequency: str
     second_frequency: str
     change: SymptomChange
+    second_description: str = ""  # Differs from description when matched by shared words
 
 @dataclass
 class AssessmentResult:
@@ -0,0 +1,222 @@
+"""Session note schema compiled from the note template, with one-pass validation and projection"""
+import os
+import re
+import threading
+from datetime import datetime
+
+# The template documenting the note structure; values are descriptions, not JSON
+NOTE_TEMPLATE_PATH = os.environ.get(
+    'THERAPY_TRACKER_NOTE_TEMPLATE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'uploads', 'note_template_explanation.txt')
+)
+
+# Top-level fields that are not in the template but are used when present
+EXTRA_TOP_LEVEL_FIELDS = ('Session Date', 'Client ID', 'Client Id', 'client_id', 'Client')
+
+# Sections and fields the analysis reads; True keeps every field of a section
+ANALYSIS_PROJECTION = {
+    'Presentation': {'Chief Complaint', 'Quote (Chief Complaint)', 'Family Dynamics'},
+    'Psychological Factors': {'Symptoms', 'Previous Mental Health Treatments', 'Family Mental Health History'},
+    'Biological Factors': {'Sleep', 'Nutrition', 'Substances', 'Medical Conditions'},
+    'Social Factors': {'Work or School', 'Relationships', 'Family Social History', 'Cultural Considerations'},
+    'Mental Status Exam': True,
+    'Risk Assessment': True,
+    'Progress and Response': True
+}
+
+# Values notes use for a section or entry list left empty, compared case-insensitively
+EMPTY_MARKERS = frozenset({'', 'na', 'n/a', 'none', 'null'})
+
+# Joins the items of a text field written as a list
+LIST_TEXT_SEPARATOR = '; '
+
+# Accepted ways of writing the Session Date, tried in order; dates are stored as YYYY-MM-DD
+SESSION_DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%B %d, %Y', '%b %d, %Y', '%d %B %Y', '%d %b %Y')
+
+_TEMPLATE_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:|"(?:[^"\\]|\\.)*"|[{}]')
+_NUMBERED_ENTRY = re.compile(r'^(.*\S)\s+\d+$')
+_LEAF_TYPES = (str, int, float, bool, type(None))
+
+
+class NoteSchemaError(ValueError):
+    """Raised when a session note does not match the note template"""
+
+    def __init__(self, path, message):
+        self.path = path
+        super().__init__(f"{path}: {message}")
+
+
+class Collection:
+    """A template object holding numbered entries such as "Symptom 1", "Symptom 2"..."""
+
+    def __init__(self, item_fields):
+        self.item_fields = item_fields
+
+
+def parse_template(text):
+    """Parse the note template into nested dicts of field name -> None (text) or sub-structure"""
+    root = {}
+    stack = []
+    pending = None
+    for match in _TEMPLATE_TOKEN.finditer(text):
+        key, token = match.group(1), match.group(0)
+        if key is not None:
+            if pending is not None:
+                stack[-1][pending] = None
+            pending = key
+        elif token == '{':
+            if not stack:
+                stack.append(root)
+                continue
+            if pending is None:
+                raise ValueError(f"Unexpected '{{' at offset {match.start()} of the note template")
+            child = {}
+            stack[-1][pending] = child
+            stack.append(child)
+            pending = None
+        elif token == '}':
+            if pending is not None:
+                stack[-1][pending] = None
+                pending = None
+            stack.pop()
+        # Quoted description values are ignored
+    return root
+
+
+def _compile_fields(tree):
+    """Turn parsed template objects into field specs, detecting numbered collections"""
+    fields = {}
+    for name, child in tree.items():
+        if child is None:
+            fields[name] = None
+        elif len(child) == 1 and _NUMBERED_ENTRY.match(next(iter(child))):
+            item = next(iter(child.values())) or {}
+            fields[name] = Collection(_compile_fields(item))
+        else:
+            fields[name] = _compile_fields(child)
+    return fields
+
+
+def _is_empty(value):
+    """Whether a value marks an object or list field as left empty ("NA", "", null, [] or {})"""
+    if isinstance(value, str):
+        return value.strip().lower() in EMPTY_MARKERS
+    return value is None or value == [] or value == {}
+
+
+def _check_leaf(value, path):
+    # Text fields may also hold a list of texts, which is joined so readers only ever see text
+    if isinstance(value, list) and all(isinstance(item, _LEAF_TYPES) for item in value):
+        return LIST_TEXT_SEPARATOR.join(str(item) for item in value if item is not None)
+    if not isinstance(value, _LEAF_TYPES):
+        raise NoteSchemaError(path, f"expected text, got {type(value).__name__}")
+    return value
+
+
+def normalize_session_date(value, path='Session Date'):
+    """Return a Session Date as YYYY-MM-DD, raising NoteSchemaError if it is not a date"""
+    if isinstance(value, str):
+        for date_format in SESSION_DATE_FORMATS:
+            try:
+                return datetime.strptime(value.strip(), date_format).strftime('%Y-%m-%d')
+            except ValueError:
+                continue
+    raise NoteSchemaError(path, f"expected a date such as 2023-10-15, got {value!r}")
+
+
+def _project_object(value, spec, keep, path):
+    """Validate an object against its spec and copy the kept fields; an empty marker reads as no fields"""
+    if _is_empty(value):
+        return {}
+    if not isinstance(value, dict):
+        raise NoteSchemaError(path, f"expected an object, got {type(value).__name__}")
+    projected = {}
+    for name, field_value in value.items():
+        field_spec = spec.get(name, False)
+        if field_spec is False:
+            continue  # Fields outside the template are tolerated but not kept
+        field_path = f"{path}.{name}"
+        if isinstance(field_spec, Collection):
+            items = _project_collection(field_value, field_spec, field_path)
+        elif isinstance(field_spec, dict):
+            items = _project_object(field_value, field_spec, True, field_path)
+        else:
+            items = _check_leaf(field_value, field_path)
+        if keep is True or name in keep:
+            projected[name] = items
+    return projected
+
+
+def _project_collection(value, spec, path):
+    if _is_empty(value):
+        return {}
+    if not isinstance(value, dict):
+        raise NoteSchemaError(path, f"expected an object of entries, got {type(value).__name__}")
+    return {
+        name: _project_object(item, spec.item_fields, True, f"{path}.{name}")
+        for name, item in value.items()
+    }
+
+
+class NoteSchema:
+    """Compiled note template that validates a note and keeps only projected sections"""
+
+    def __init__(self, template_tree, projection=None):
+        self.sections = _compile_fields(template_tree)
+        self.projection = projection if projection is not None else ANALYSIS_PROJECTION
+
+    def project(self, note):
+        """Validate a note in one pass and return a copy holding only the projected fields
+
+        Sections, objects and entry lists left empty ("NA", "", null, [] or
+        {}) are accepted and read as having no fields. Raises NoteSchemaError
+        naming the offending path if a known section or field has the wrong
+        type, if the Session Date is not a date, or if the note has none of
+        the template sections. The Session Date is returned as YYYY-MM-DD.
+        """
+        if not isinstance(note, dict):
+            raise NoteSchemaError('note', f"expected an object, got {type(note).__name__}")
+
+        projected = {}
+        known_sections = 0
+        for name, value in note.items():
+            spec = self.sections.get(name, False)
+            if spec is False:
+                if name == 'Session Date':
+                    # Checked here so a bad date rejects the note before anything is stored
+                    projected[name] = normalize_session_date(value)
+                elif name in EXTRA_TOP_LEVEL_FIELDS:
+                    projected[name] = _check_leaf(value, name)
+                continue
+            known_sections += 1
+            keep = self.projection.get(name)
+            if spec is None:
+                value = _check_leaf(value, name)
+            else:
+                value = _project_object(value, spec, keep or (), name)
+            if keep:
+                projected[name] = value
+
+        if not known_sections:
+            raise NoteSchemaError('note', "none of the note template sections were found")
+        return projected
+
+
+_default_schema = None
+_default_schema_lock = threading.Lock()
+
+
+def get_note_schema():
+    """Return the schema compiled from the note template, compiling it on first use"""
+    global _default_schema
+    if _default_schema is None:
+        with _default_schema_lock:
+            if _default_schema is None:
+                with open(NOTE_TEMPLATE_PATH, encoding='utf-8') as template:
+                    _default_schema = NoteSchema(parse_template(template.read()))
+    return _default_schema
+
+
+def project_note(note):
+    """Validate a session note and keep only the sections the analysis needs"""
+    return get_note_schema().project(note)
@@ -0,0 +1,101 @@
+"""On-disk storage of raw session notes with lazy, memory-mapped section loading"""
+import json
+import mmap
+import os
+import tempfile
+import threading
+
+from utils import STORAGE_DIR
+from shared_cache import SharedCache
+
+# Upper bound on raw note sections held in memory across all users
+RAW_NOTE_MEMORY_BUDGET = 32 * 1024 * 1024
+
+
+def encode_note(json_data):
+    """Serialize a note as JSON, returning the bytes and each section's (offset, length)"""
+    parts = [b'{']
+    sections = {}
+    offset = 1
+    for i, (name, value) in enumerate(json_data.items()):
+        prefix = (b',' if i else b'') + json.dumps(name, ensure_ascii=False).encode('utf-8') + b':'
+        encoded = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        offset += len(prefix)
+        sections[name] = [offset, len(encoded)]
+        parts.extend((prefix, encoded))
+        offset += len(encoded)
+    parts.append(b'}')
+    return b''.join(parts), sections
+
+
+class RawNoteStore:
+    """Content-addressed store of raw notes with an LRU cache of loaded sections
+
+    Notes are written once as plain JSON files named by content hash. A note
+    reference records where each top-level section starts in the file, so a
+    page that shows one section reads just that slice through mmap instead
+    of parsing the whole note. Loaded sections stay cached until the memory
+    budget is exceeded, then the least recently used ones are dropped.
+    """
+
+    def __init__(self, directory=None, memory_budget=RAW_NOTE_MEMORY_BUDGET):
+        self.directory = directory or os.path.join(STORAGE_DIR, 'notes')
+        self.memory_budget = memory_budget
+        self._cache = SharedCache(memory_budget)
+
+    def path_for(self, content_hash):
+        """Return the file path of a stored note"""
+        return os.path.join(self.directory, content_hash[:2], f"{content_hash}.json")
+
+    def put(self, content_hash, json_data):
+        """Store a note if it isn't stored yet and return its reference"""
+        encoded, sections = encode_note(json_data)
+        path = self.path_for(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so concurrent writers of the same note never leave a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as note_file:
+                note_file.write(encoded)
+            os.replace(tmp_path, path)
+        return {'content_hash': content_hash, 'sections': sections}
+
+    def _read(self, ref, section):
+        """Read one section from disk"""
+        start, length = ref['sections'][section]
+        with open(self.path_for(ref['content_hash']), 'rb') as note_file:
+            with mmap.mmap(note_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return json.loads(mapped[start:start + length]), length
+
+    def load_section(self, ref, section):
+        """Return one top-level section of a stored note, or None if it has none"""
+        if section not in ref['sections']:
+            return None
+        key = (ref['content_hash'], section)
+        value = self._cache.get(key)
+        if value is None:
+            value, size = self._read(ref, section)
+            self._cache.put(key, value, size)
+        return value
+
+    def load_note(self, ref):
+        """Return a full stored note"""
+        return {section: self.load_section(ref, section) for section in ref['sections']}
+
+    def memory_used(self):
+        """Return the approximate number of bytes of cached sections"""
+        return self._cache.memory_used()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_raw_note_store():
+    """Return the process-wide raw note store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = RawNoteStore()
+    return _default_store
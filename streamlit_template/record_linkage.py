@@ -0,0 +1,157 @@
+"""Probabilistic linkage of session notes to clients using MinHash and LSH blocking"""
+import re
+import threading
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+# Note fields that stay fairly stable for a client from session to session
+LINKAGE_FIELDS = [
+    ('Presentation', 'Family Dynamics'),
+    ('Psychological Factors', 'Previous Mental Health Treatments'),
+    ('Psychological Factors', 'Family Mental Health History'),
+    ('Social Factors', 'Work or School'),
+    ('Social Factors', 'Relationships'),
+    ('Social Factors', 'Family Social History'),
+    ('Social Factors', 'Cultural Considerations'),
+    ('Biological Factors', 'Medical Conditions')
+]
+
+# Top-level note sections holding the linkage fields
+LINKAGE_SECTIONS = tuple(dict.fromkeys(section for section, _ in LINKAGE_FIELDS))
+
+# LSH banding for the 0.1 similarity threshold. Two notes with Jaccard similarity J share a bucket
+# with probability 1 - (1 - J**rows)**bands: with 240 bands of 2 rows that is 91% at J = 0.1 and
+# over 99% from 0.15, where sessions of the same client sit, against 9% at J = 0.02, the similarity
+# of unrelated notes. The curve crosses 50% near J = 0.055; candidates below the threshold are
+# dropped when their signatures are compared. Three rows per band would need ten times the bands
+# for the same recall at 0.1.
+LSH_BANDS = 240
+LSH_ROWS = 2
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def linkage_text(json_data):
+    """Concatenate the stable fields of a note into one lowercase string"""
+    parts = []
+    if isinstance(json_data, dict):
+        for section, field in LINKAGE_FIELDS:
+            container = json_data.get(section, {}) if section else json_data
+            value = container.get(field) if isinstance(container, dict) else None
+            if isinstance(value, str) and value != 'NA':
+                parts.append(value)
+    return ' '.join(parts).lower()
+
+
+def shingles(text, size=2):
+    """Return the set of word n-grams in text"""
+    words = re.findall(r"[a-z0-9']+", text)
+    if len(words) < size:
+        return set(words)
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class RecordLinkageIndex:
+    """MinHash/LSH index of session fingerprints for proposing client merges
+
+    Each session is reduced to a MinHash signature over word bigrams of its
+    stable fields. Signatures are split into bands and bucketed, so linking a
+    new note only scores sessions that share at least one band instead of
+    every session in the caseload. The index is safe to share between
+    threads.
+    """
+
+    def __init__(self, num_perm=LSH_BANDS * LSH_ROWS, bands=LSH_BANDS, threshold=0.1, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        rng = np.random.RandomState(seed)
+        # Keep coefficients below 2**32 so a * hash + b cannot overflow uint64
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._signatures = {}
+        self._clients = {}
+        self._buckets = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def signature(self, json_data):
+        """Compute the MinHash signature of a note, or None if it has no linkage text"""
+        shingle_set = shingles(linkage_text(json_data))
+        if not shingle_set:
+            return None
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingle_set),
+                             dtype=np.uint64, count=len(shingle_set))
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature):
+        """Yield one bucket key per LSH band of a signature"""
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, record_id, client_id, json_data):
+        """Index a session under the given client"""
+        signature = self.signature(json_data)
+        if signature is None:
+            return
+        with self._lock:
+            self.remove(record_id)
+            self._signatures[record_id] = signature
+            self._clients[record_id] = client_id
+            for key in self._band_keys(signature):
+                self._buckets[key].add(record_id)
+
+    def remove(self, record_id):
+        """Drop a session from the index"""
+        with self._lock:
+            signature = self._signatures.pop(record_id, None)
+            if signature is None:
+                return
+            self._clients.pop(record_id, None)
+            for key in self._band_keys(signature):
+                self._buckets[key].discard(record_id)
+                if not self._buckets[key]:
+                    del self._buckets[key]
+
+    def relabel_client(self, old_client_id, new_client_id):
+        """Move every indexed session of one client to another (after a merge)"""
+        with self._lock:
+            for record_id, client_id in self._clients.items():
+                if client_id == old_client_id:
+                    self._clients[record_id] = new_client_id
+
+    def query(self, json_data, exclude_client=None):
+        """Return candidate matching clients for a note, best first
+
+        Each match is a dict with the client_id, the most similar record_id
+        and its estimated Jaccard similarity; only matches at or above the
+        threshold are returned.
+        """
+        signature = self.signature(json_data)
+        if signature is None:
+            return []
+
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+            candidate_records = [(record_id, self._clients[record_id], self._signatures[record_id])
+                                 for record_id in candidates]
+
+        best = {}
+        for record_id, client_id, candidate_signature in candidate_records:
+            if client_id == exclude_client:
+                continue
+            score = float(np.mean(candidate_signature == signature))
+            if score >= self.threshold and score > best.get(client_id, {}).get('score', -1):
+                best[client_id] = {'client_id': client_id, 'record_id': record_id, 'score': score}
+        return sorted(best.values(), key=lambda match: match['score'], reverse=True)
+
+    def __len__(self):
+        return len(self._signatures)
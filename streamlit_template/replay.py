@@ -0,0 +1,115 @@
+"""Rebuild the session store from the ingest log
+
+Stored notes are rescored with the current rules across a process pool, into
+a new store that replaces the live one when complete. Stop the app first:
+
+    python replay.py --workers 4
+
+The app itself calls restore() on start, which brings the live store up to
+date with the log without rebuilding it.
+"""
+import argparse
+import os
+import sys
+
+from utils import STORAGE_DIR
+from note_store import get_raw_note_store
+from note_schema import project_note
+from scoring_core import score_notes
+from session_store import SessionStore
+from ingest_log import get_ingest_log
+from client_identity import get_identity_index
+from ingest import map_notes
+
+
+# Notes rescored together by each worker task
+RESCORE_BATCH_SIZE = 512
+
+
+def rescore_notes(note_refs):
+    """Re-extract stored notes' features with the current rules (runs inside a worker process)
+
+    The notes of a task are scored together as one batch of array operations.
+    """
+    store = get_raw_note_store()
+    return score_notes([project_note(store.load_note(ref)) for ref in note_refs])
+
+
+def _remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def replay(log, max_workers=None, on_progress=None):
+    """Rebuild the session store from the log, returning the number of sessions"""
+    # Fold the log into a snapshot first so the next cold start reads one file
+    log.compact()
+    _, sessions = log.load_state()
+    sessions = list(sessions.values())
+
+    db_path = os.path.join(STORAGE_DIR, 'sessions.db')
+    new_db_path = f"{db_path}.replay"
+    _remove_database(new_db_path)
+
+    session_store = SessionStore(new_db_path, pool_size=1)
+    refs = [session['note_ref'] for session in sessions]
+    args = [(refs[start:start + RESCORE_BATCH_SIZE],) for start in range(0, len(refs), RESCORE_BATCH_SIZE)]
+    rescored = (features for batch in map_notes(rescore_notes, args, max_workers) for features in batch)
+    for count, (session, features) in enumerate(zip(sessions, rescored), 1):
+        session_store.add_session(session['client_id'], session['date'], session['file_name'],
+                                  session['content_hash'], features, session['note_ref'])
+        if on_progress:
+            on_progress(count, len(sessions))
+    session_store.close()
+
+    _remove_database(db_path)
+    os.replace(new_db_path, db_path)
+    return len(sessions)
+
+
+def restore(log, store):
+    """Apply logged sessions and merges the live store is missing, returning the number of sessions added
+
+    Sessions are logged before they are stored, so a crash in between
+    leaves the store behind the log. The log state is read from the
+    snapshot first, with the log tail applied on top; sessions the store
+    lacks are rescored and added, and sessions filed under another client
+    than the log says have that client merged into the logged one, in the
+    store and the identity index.
+    """
+    _, sessions = log.load_state()
+    stored = {session_id: client_id for session_id, client_id, _ in store.iter_note_refs()}
+    merges = {(stored[session_id], session['client_id']) for session_id, session in sessions.items()
+              if session_id in stored and stored[session_id] != session['client_id']}
+    for source_client_id, target_client_id in sorted(merges):
+        store.merge_clients(source_client_id, target_client_id)
+        get_identity_index().merge_clients(source_client_id, target_client_id)
+
+    missing = [session for session_id, session in sessions.items() if session_id not in stored]
+    for start in range(0, len(missing), RESCORE_BATCH_SIZE):
+        batch = missing[start:start + RESCORE_BATCH_SIZE]
+        for session, features in zip(batch, rescore_notes([session['note_ref'] for session in batch])):
+            store.add_session(session['client_id'], session['date'], session['file_name'],
+                              session['content_hash'], features, session['note_ref'])
+    return len(missing)
+
+
+def main(argv=None):
+    """Command-line entry point for rebuilding the session store"""
+    parser = argparse.ArgumentParser(description="Rebuild the session store from the ingest log.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: number of CPUs)")
+    args = parser.parse_args(argv)
+
+    def report_progress(done, total):
+        if done % 100 == 0 or done == total:
+            print(f"Replayed {done} of {total} sessions", file=sys.stderr)
+
+    count = replay(get_ingest_log(), args.workers, report_progress)
+    print(f"Rebuilt the session store from {count} logged sessions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Memoized extraction, assessment and comparison results
+
+Results are keyed by the content hashes of the notes they derive from plus
+the rule engine version, so they are computed once per note content however
+many pages, users and reruns ask for them. Changing an instrument definition
+changes the version: entries computed with the old rules are never hit again
+and age out of the shared LRU cache.
+"""
+import threading
+from collections import Counter
+
+from shared_cache import get_shared_cache
+from rule_engine import get_assessment_engine
+
+_MISSING = object()
+
+
+class ResultCache:
+    """Rule-versioned memoization on top of the process-wide shared cache
+
+    Keeps hit and miss counts per kind of result (features, comparison, ...).
+    Cached results are shared between users and must not be modified.
+    """
+
+    def __init__(self, cache=None, version=None):
+        self._cache = cache if cache is not None else get_shared_cache()
+        self.version = version or get_assessment_engine().version
+        self._counts_lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def key(self, kind, *content_hashes):
+        """Cache key of a result derived from the notes with these content hashes"""
+        return (kind, self.version) + content_hashes
+
+    def get(self, kind, *content_hashes):
+        """Return a cached result, or None"""
+        value = self._cache.get(self.key(kind, *content_hashes), _MISSING)
+        with self._counts_lock:
+            (self.misses if value is _MISSING else self.hits)[kind] += 1
+        return None if value is _MISSING else value
+
+    def put(self, kind, content_hashes, value):
+        self._cache.put(self.key(kind, *content_hashes), value)
+
+    def get_or_compute(self, kind, content_hashes, compute):
+        """Return the cached result for these notes, computing and caching it on a miss"""
+        value = self.get(kind, *content_hashes)
+        if value is None:
+            value = compute()
+            self.put(kind, content_hashes, value)
+        return value
+
+    def stats(self):
+        """Return {kind: {'hits', 'misses', 'hit_rate'}} with the shared cache's size under 'cache'"""
+        with self._counts_lock:
+            kinds = sorted(set(self.hits) | set(self.misses))
+            stats = {
+                kind: {
+                    'hits': self.hits[kind],
+                    'misses': self.misses[kind],
+                    'hit_rate': self.hits[kind] / (self.hits[kind] + self.misses[kind])
+                }
+                for kind in kinds
+            }
+        stats['cache'] = {'entries': len(self._cache), 'bytes': self._cache.memory_used(),
+                          'memory_limit': self._cache.memory_limit}
+        return stats
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide result cache for the current rules"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ResultCache()
+    return _default_cache
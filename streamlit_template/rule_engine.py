@@ -0,0 +1,330 @@
+"""Data-driven scoring of standardized assessment instruments
+
+Each instrument (GAD-7, PHQ-9, ...) is defined by a JSON file in the
+instruments directory: its questions, the rules scoring each question,
+how symptom intensity maps to a score and its severity bands. The
+definitions are compiled into one evaluator that scores every instrument in
+a single pass over a note's symptoms, so adding an instrument is a matter
+of adding a file. Rescore stored sessions with replay.py after changing the
+definitions.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from keyword_engine import compile_keywords
+from symptom_normalizer import INTENSITY_LEVELS, highest_intensity_level
+
+# Directory holding one <instrument>.json definition per instrument
+INSTRUMENTS_DIR = os.environ.get('THERAPY_TRACKER_INSTRUMENTS_DIR',
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instruments'))
+
+RULE_TYPES = ('symptom_keywords', 'note_field')
+
+# Thresholds an instrument's optional "change" section gives for judging change over sessions
+CHANGE_CRITERIA = ('reliable_change', 'clinical_cutoff', 'remission_max')
+
+# Bump when a code change alters extracted features or scores for the same definitions
+SCORING_CODE_VERSION = 3
+
+
+class InstrumentDefinitionError(ValueError):
+    """Raised when an instrument definition file is malformed"""
+
+
+class Instrument:
+    """One assessment instrument compiled from its definition
+
+    An optional change section gives the smallest reliable change in total
+    score, the clinical cutoff (totals at or above it are in the clinical
+    range) and the highest total counting as remission; see trajectories.py.
+
+    Questions are keyed by their int number. Each question has an ordered
+    list of rules and takes the score of the first rule that fires:
+    - symptom_keywords fires when a symptom's description or quote mentions
+      one of its keywords, scoring the symptom's intensity (or a fixed
+      score); if several symptoms match, the last one counts
+    - note_field fires when a field of a note section holds a value that is
+      not one of skip_values (nor empty, with skip_empty) and, if a pattern
+      is given, matches it case-insensitively
+    """
+
+    def __init__(self, definition, source='<definition>'):
+        self.definition = definition
+        try:
+            self.id = definition['id']
+            self.name = definition.get('name', self.id)
+            self.description = definition.get('description', '')
+            self.order = definition.get('order', 0)
+            self.questions = {int(q): question['text'] for q, question in definition['questions'].items()}
+            self.rules = {int(q): [self._compile_rule(rule, source) for rule in question.get('rules', [])]
+                          for q, question in definition['questions'].items()}
+            self.intensity_scores = [(rule['min_level'], rule['score'])
+                                     for rule in definition.get('intensity_scores', [])]
+            self.default_intensity_score = definition.get('default_intensity_score', 1)
+            bands = definition['severity']
+            self.severity_bands = [(band.get('max_score'), band['label']) for band in bands]
+            change = definition.get('change')
+            self.change = {key: float(change[key]) for key in CHANGE_CRITERIA} if change is not None else None
+        except (KeyError, TypeError, ValueError) as e:
+            raise InstrumentDefinitionError(f"{source}: invalid instrument definition ({e})") from e
+        if not self.severity_bands or self.severity_bands[-1][0] is not None:
+            raise InstrumentDefinitionError(f"{source}: the last severity band must have no max_score")
+        if self.change is not None and self.change['reliable_change'] <= 0:
+            raise InstrumentDefinitionError(f"{source}: reliable_change must be positive")
+        self.severity_labels = tuple(label for _, label in self.severity_bands)
+
+    @staticmethod
+    def _compile_rule(rule, source):
+        if rule.get('type') not in RULE_TYPES:
+            raise InstrumentDefinitionError(f"{source}: unknown rule type {rule.get('type')!r}")
+        rule = dict(rule)
+        if rule['type'] == 'note_field':
+            rule['skip_values'] = tuple(rule.get('skip_values', ()))
+            if rule.get('pattern'):
+                rule['pattern'] = re.compile(rule['pattern'], re.IGNORECASE)
+        return rule
+
+    def intensity_score(self, level):
+        """Score a question from the intensity level (or None) of the symptom that matched it"""
+        if level is not None:
+            for min_level, score in self.intensity_scores:
+                if level >= min_level:
+                    return score
+        return self.default_intensity_score
+
+    def severity(self, total_score):
+        """Return the severity label of a total score"""
+        for max_score, label in self.severity_bands:
+            if max_score is None or total_score <= max_score:
+                return label
+
+
+def _field_rule_fires(rule, json_data):
+    """Whether a note_field rule's section field holds a qualifying value"""
+    section = json_data.get(rule['section']) if isinstance(json_data, dict) else None
+    if not isinstance(section, dict) or rule['field'] not in section:
+        return False
+    value = section[rule['field']]
+    if (rule.get('skip_empty') and not value) or value in rule['skip_values']:
+        return False
+    if rule.get('pattern'):
+        return isinstance(value, str) and rule['pattern'].search(value) is not None
+    return True
+
+
+class AssessmentEngine:
+    """Scores every loaded instrument from a note's symptoms and sections
+
+    The keywords of all instruments' symptom rules go into one automaton
+    labelled (instrument id, question, rule index), so each symptom's text
+    is scanned once however many instruments are defined. score() scores
+    one session; score_batch() scores many as array operations.
+    """
+
+    def __init__(self, instruments):
+        self.instruments = {instrument.id: instrument
+                            for instrument in sorted(instruments, key=lambda i: (i.order, i.id))}
+        keywords = {}
+        for instrument in self.instruments.values():
+            for q, rules in instrument.rules.items():
+                for index, rule in enumerate(rules):
+                    if rule['type'] == 'symptom_keywords':
+                        keywords[(instrument.id, q, index)] = rule['keywords']
+        self._automaton = compile_keywords(keywords)
+        self._compile_batch_tables()
+        # Identifies the rules results were computed with; changes whenever a definition does,
+        # except for the change criteria, which no stored score depends on
+        self.version = hashlib.sha256(json.dumps(
+            [SCORING_CODE_VERSION, [{key: value for key, value in instrument.definition.items() if key != 'change'}
+                                    for instrument in self.instruments.values()]],
+            sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+    def _compile_batch_tables(self):
+        """Lay every rule out as a column and every question as an item for score_batch()"""
+        instrument_index = {instrument_id: i for i, instrument_id in enumerate(self.instruments)}
+        self._rule_columns = {}
+        self._field_columns = []
+        rule_instrument, rule_score, rule_group_start, rule_item = [], [], [], []
+        self._item_slices = {}
+        item = 0
+        for instrument in self.instruments.values():
+            first_item = item
+            for q, rules in instrument.rules.items():
+                group_start = len(rule_instrument)
+                for index, rule in enumerate(rules):
+                    column = len(rule_instrument)
+                    self._rule_columns[(instrument.id, q, index)] = column
+                    if rule['type'] == 'note_field':
+                        self._field_columns.append((column, rule))
+                    rule_instrument.append(instrument_index[instrument.id])
+                    rule_score.append(rule.get('score', -1))  # -1: scored by intensity
+                    rule_group_start.append(group_start)
+                    rule_item.append(item)
+                item += 1
+            self._item_slices[instrument.id] = slice(first_item, item)
+
+        self._rule_instrument = np.array(rule_instrument, dtype=np.intp)
+        self._rule_score = np.array(rule_score, dtype=np.int64)
+        self._rule_group_start = np.array(rule_group_start, dtype=np.intp)
+        # Rule -> item incidence; at most one rule per item is selected, so the product picks its score
+        self._rule_items = np.zeros((len(rule_item), item), dtype=np.int64)
+        self._rule_items[np.arange(len(rule_item)), rule_item] = 1
+        self._severity_bounds = {instrument.id: np.array([bound for bound, _ in instrument.severity_bands[:-1]])
+                                 for instrument in self.instruments.values()}
+        # Each instrument's score for every intensity level, the last column for an unrecognized intensity
+        levels = list(range(max(INTENSITY_LEVELS.values()) + 1)) + [None]
+        self._intensity_table = np.array([[instrument.intensity_score(level) for level in levels]
+                                          for instrument in self.instruments.values()], dtype=np.int64)
+
+    def match_symptom(self, symptom):
+        """Return the (instrument, question, rule index) labels whose keywords a symptom mentions"""
+        hits = set()
+        for field in ('description', 'quote'):
+            if isinstance(symptom.get(field), str):
+                hits |= self._automaton.search(symptom[field].lower())
+        return hits
+
+    def score(self, symptoms, json_data, instrument_ids=None):
+        """Return {instrument id: {'scores', 'total_score', 'severity'}} for the given or all instruments"""
+        # Score of the last symptom matching each symptom rule
+        rule_scores = {}
+        for symptom in symptoms:
+            hits = self.match_symptom(symptom)
+            if not hits:
+                continue
+            level = highest_intensity_level(symptom.get('intensity'))
+            for instrument_id, q, index in hits:
+                instrument = self.instruments[instrument_id]
+                rule = instrument.rules[q][index]
+                rule_scores[(instrument_id, q, index)] = (rule['score'] if 'score' in rule
+                                                          else instrument.intensity_score(level))
+
+        results = {}
+        for instrument_id in instrument_ids or self.instruments:
+            instrument = self.instruments[instrument_id]
+            scores = {}
+            for q, rules in instrument.rules.items():
+                scores[q] = 0
+                for index, rule in enumerate(rules):
+                    if rule['type'] == 'symptom_keywords':
+                        score = rule_scores.get((instrument_id, q, index))
+                    else:
+                        score = rule['score'] if _field_rule_fires(rule, json_data) else None
+                    if score is not None:
+                        scores[q] = score
+                        break
+            total_score = sum(scores.values())
+            results[instrument_id] = {
+                'scores': scores,
+                'total_score': total_score,
+                'severity': instrument.severity(total_score)
+            }
+        return results
+
+    def score_batch(self, symptom_lists, notes):
+        """Score many sessions at once
+
+        symptom_lists[i] holds the extracted symptoms of notes[i]. Returns
+        {instrument id: {'questions', 'scores', 'total_score', 'severity'}}
+        where scores is an N x questions array of item scores, total_score
+        an array of N totals and severity an array of N indices into the
+        instrument's severity_labels. Results equal score() for each note.
+        """
+        n_sessions = len(notes)
+        n_rules = len(self._rule_score)
+
+        # Sparse term-presence matrix in coordinate form: (session, rule column, symptom) per keyword hit
+        hit_sessions, hit_columns, hit_symptoms, symptom_levels = [], [], [], []
+        for i, symptoms in enumerate(symptom_lists):
+            for symptom in symptoms:
+                hits = self.match_symptom(symptom)
+                if hits:
+                    k = len(symptom_levels)
+                    level = highest_intensity_level(symptom.get('intensity'))
+                    symptom_levels.append(-1 if level is None else level)
+                    for label in hits:
+                        hit_sessions.append(i)
+                        hit_columns.append(self._rule_columns[label])
+                        hit_symptoms.append(k)
+
+        # The last matching symptom of a session decides each symptom rule's score
+        last_symptom = np.full((n_sessions, n_rules), -1, dtype=np.intp)
+        if hit_sessions:
+            np.maximum.at(last_symptom, (np.array(hit_sessions), np.array(hit_columns)), np.array(hit_symptoms))
+        fired = last_symptom >= 0
+        values = np.broadcast_to(self._rule_score, (n_sessions, n_rules)).copy()
+        if symptom_levels:
+            levels = np.array(symptom_levels, dtype=np.intp)[np.maximum(last_symptom, 0)]
+            values = np.where(values < 0, self._intensity_table[self._rule_instrument, levels], values)
+
+        for column, rule in self._field_columns:
+            fired[:, column] = [_field_rule_fires(rule, note) for note in notes]
+
+        # Each item takes the first of its rules that fired
+        fired_before = np.cumsum(fired, axis=1) - fired
+        selected = fired & (fired_before == fired_before[:, self._rule_group_start])
+        items = np.where(selected, values, 0) @ self._rule_items
+
+        results = {}
+        for instrument_id, instrument in self.instruments.items():
+            scores = items[:, self._item_slices[instrument_id]]
+            total_score = scores.sum(axis=1)
+            results[instrument_id] = {
+                'questions': tuple(instrument.questions),
+                'scores': scores,
+                'total_score': total_score,
+                'severity': np.digitize(total_score, self._severity_bounds[instrument_id], right=True)
+            }
+        return results
+
+    def unbatch(self, batch):
+        """Split score_batch() results into one score()-style dict per session"""
+        sessions = []
+        for instrument_id, result in batch.items():
+            labels = self.instruments[instrument_id].severity_labels
+            for i, (scores, total_score, severity) in enumerate(
+                    zip(result['scores'].tolist(), result['total_score'].tolist(), result['severity'].tolist())):
+                if i == len(sessions):
+                    sessions.append({})
+                sessions[i][instrument_id] = {
+                    'scores': dict(zip(result['questions'], scores)),
+                    'total_score': total_score,
+                    'severity': labels[severity]
+                }
+        return sessions
+
+
+def load_instruments(directory=None):
+    """Load every instrument definition file of a directory"""
+    directory = directory or INSTRUMENTS_DIR
+    instruments = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('.json'):
+            continue
+        path = os.path.join(directory, file_name)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                definition = json.load(f)
+        except json.JSONDecodeError as e:
+            raise InstrumentDefinitionError(f"{path}: {e}") from e
+        instruments.append(Instrument(definition, path))
+    return instruments
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+def get_assessment_engine():
+    """Return the process-wide engine compiled from the instruments directory"""
+    global _default_engine
+    if _default_engine is None:
+        with _default_engine_lock:
+            if _default_engine is None:
+                _default_engine = AssessmentEngine(load_instruments())
+    return _default_engine
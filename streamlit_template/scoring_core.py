@@ -0,0 +1,40 @@
+"""Scoring core shared by the app, the ingest and replay tools and the analysis notebook
+
+Every path that turns a session note into symptoms and assessment results
+goes through score_note() or score_notes(), so the scores the dashboard
+shows and the features the progress model is trained on come from the same
+instrument definitions. scoring_harness.py checks it against the scorers it
+replaced.
+"""
+from assessment_mapping import extract_session_features, extract_session_features_batch
+from rule_engine import get_assessment_engine
+
+
+def score_note(json_data):
+    """Return a note's symptoms and the results of every defined instrument
+
+    The result is {'symptoms': [...], <instrument id>: {'scores',
+    'total_score', 'severity'}, ...}.
+    """
+    return extract_session_features(json_data)
+
+
+def score_notes(notes):
+    """Score many notes together with array operations; equal to score_note() on each"""
+    return extract_session_features_batch(notes)
+
+
+def assessment_columns(features):
+    """Flatten a note's instrument results into flat, model- and table-ready columns
+
+    Each instrument contributes <id>_total, <id>_severity and one <id>_q<n>
+    column per question.
+    """
+    columns = {}
+    for instrument in get_assessment_engine().instruments.values():
+        result = features[instrument.id]
+        columns[f'{instrument.id}_total'] = result['total_score']
+        columns[f'{instrument.id}_severity'] = result['severity']
+        for item in instrument.questions:
+            columns[f'{instrument.id}_q{item}'] = result['scores'].get(item, 0)
+    return columns
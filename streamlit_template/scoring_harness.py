@@ -0,0 +1,145 @@
+"""Equivalence and throughput harness for the scoring core
+
+Scores a corpus of session notes with the scoring core (note by note and
+batched) and with the legacy app and notebook scorers, then reports where
+each disagrees with the core and how many notes per second each scores:
+
+    python scoring_harness.py ../uploads --replicate 1000
+
+The core must agree with the legacy app scorer on every note; the notebook
+scorer used different rules and is expected to disagree. Exits with 1 if
+the batched core or the legacy app scorer disagrees with the core.
+"""
+import argparse
+import sys
+import time
+
+from utils import read_note_file
+from scoring_core import score_note, score_notes
+from legacy_scoring import app_scores, notebook_scores
+from ingest import find_note_files
+
+INSTRUMENTS = ('gad7', 'phq9')
+
+
+def _score_each(scorer):
+    def score_all(notes):
+        results = []
+        for json_data in notes:
+            try:
+                results.append(scorer(json_data))
+            except Exception as e:  # Legacy scorers crash on some malformed notes; count, don't abort
+                results.append(e)
+        return results
+    return score_all
+
+
+# Scoring paths compared with the core; the first is the reference
+SCORERS = {
+    'core': _score_each(score_note),
+    'core-batch': score_notes,
+    'legacy-app': _score_each(app_scores),
+    'legacy-notebook': _score_each(notebook_scores)
+}
+
+# Paths that must agree with the core on every note
+MUST_AGREE = ('core-batch', 'legacy-app')
+
+
+def load_corpus(directory):
+    """Return [(path, json_data)] for every parseable note under directory, and the number that failed"""
+    corpus, failed = [], 0
+    for path in find_note_files(directory):
+        try:
+            corpus.append((path, read_note_file(path)))
+        except ValueError:
+            failed += 1
+    return corpus, failed
+
+
+def time_scorer(score_all, notes, repeat):
+    """Return (results, notes per second) of the fastest of repeat runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = score_all(notes)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return results, len(notes) / best if best else float('inf')
+
+
+def disagreements(reference, results):
+    """Return [(index, instrument, reference result, result)] where results differ from the reference
+
+    Item scores are only compared when the scorer reports them.
+    """
+    found = []
+    for index, (expected, actual) in enumerate(zip(reference, results)):
+        if isinstance(actual, Exception):
+            found.append((index, None, None, actual))
+            continue
+        for instrument in INSTRUMENTS:
+            want, got = expected[instrument], actual[instrument]
+            if (want['total_score'] != got['total_score'] or want['severity'] != got['severity']
+                    or (got['scores'] is not None and dict(want['scores']) != dict(got['scores']))):
+                found.append((index, instrument, want, got))
+    return found
+
+
+def run(corpus, repeat=3, show=5, out=sys.stdout):
+    """Score the corpus with every path, print the report and return whether the required paths agree"""
+    paths = [path for path, _ in corpus]
+    notes = [json_data for _, json_data in corpus]
+    reference = None
+    all_agree = True
+    print(f"{'path':<16} {'notes/s':>10} {'speedup':>8} {'disagree':>9} {'errors':>7} {'mean |total diff|':>18}",
+          file=out)
+    baseline_rate = None
+    examples = {}
+    for name, score_all in SCORERS.items():
+        results, rate = time_scorer(score_all, notes, repeat)
+        if reference is None:
+            reference, baseline_rate = results, rate
+        found = disagreements(reference, results)
+        errors = sum(isinstance(result, Exception) for result in results)
+        notes_disagreeing = len({index for index, *_ in found})
+        total_diffs = [abs(want['total_score'] - got['total_score']) for _, instrument, want, got in found
+                       if instrument is not None]
+        mean_diff = sum(total_diffs) / (len(notes) * len(INSTRUMENTS)) if notes else 0.0
+        print(f"{name:<16} {rate:>10.0f} {rate / baseline_rate:>7.2f}x {notes_disagreeing:>9} {errors:>7} "
+              f"{mean_diff:>18.2f}", file=out)
+        if found:
+            examples[name] = found[:show]
+        if name in MUST_AGREE and found:
+            all_agree = False
+
+    for name, found in examples.items():
+        print(f"\nFirst disagreements of {name} with the core:", file=out)
+        for index, instrument, want, got in found:
+            if instrument is None:
+                print(f"  {paths[index]}: {type(got).__name__}: {got}", file=out)
+            else:
+                print(f"  {paths[index]} {instrument}: core {want['total_score']} ({want['severity']}), "
+                      f"{name} {got['total_score']} ({got['severity']})", file=out)
+    return all_agree
+
+
+def main(argv=None):
+    """Command-line entry point for the scoring harness"""
+    parser = argparse.ArgumentParser(description="Compare the scoring core with the legacy scorers.")
+    parser.add_argument('directory', help="Directory to scan recursively for session notes")
+    parser.add_argument('--replicate', type=int, default=1,
+                        help="Score the corpus this many times over, for steadier throughput figures")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per path; the fastest is reported")
+    parser.add_argument('--show', type=int, default=5, help="Disagreements to list per path")
+    args = parser.parse_args(argv)
+
+    corpus, failed = load_corpus(args.directory)
+    if not corpus:
+        parser.error(f"no parseable session notes under {args.directory}")
+    print(f"Scoring {len(corpus)} notes x {args.replicate} ({failed} unparseable files skipped)\n")
+    return 0 if run(corpus * args.replicate, args.repeat, args.show) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""Offline semantic matching of symptom descriptions
+
+Descriptions are embedded without any model download, network or GPU:
+each word contributes hashed character 3-5-grams, so "concentration" and
+"concentrating" land close together, and each assessment question whose
+keywords a description mentions contributes a concept feature, so
+"Fatigue" and "Tiredness" do too. Generic qualifiers ("difficulty",
+"increased") weigh less than the words naming the symptom.
+
+Vectors are cached on disk in a memory-mapped file, one row per distinct
+description, and a client's historical symptoms are kept in a random
+hyperplane LSH index, so matching a session against years of history
+scores only the few descriptions sharing a bucket with each symptom.
+"""
+import json
+import os
+import re
+import threading
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+from utils import STORAGE_DIR
+from rule_engine import get_assessment_engine
+from symptom_matching import STOP_WORDS, description_key
+
+# Length of description vectors
+VECTOR_DIM = 256
+
+# Character n-gram lengths taken from each word
+NGRAM_SIZES = (3, 4, 5)
+
+# Words qualifying a symptom rather than naming it, and their weight relative to other words
+GENERIC_WORDS = frozenset({
+    'difficulty', 'difficulties', 'trouble', 'problems', 'problem', 'issues', 'poor', 'increased', 'decreased',
+    'persistent', 'excessive', 'feeling', 'feelings', 'symptoms', 'related', 'recent', 'ongoing', 'general',
+    'some', 'mild', 'moderate', 'severe', 'frequent', 'occasional', 'chronic'
+})
+GENERIC_WORD_WEIGHT = 0.25
+
+# Weight of an assessment question a description mentions, relative to one word
+CONCEPT_WEIGHT = 1.0
+
+# Smallest cosine similarity at which two descriptions are taken to name the same symptom
+MIN_SIMILARITY = 0.45
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def _add_feature(vector, feature, weight):
+    # The top hash bit signs the feature so collisions cancel rather than accumulate
+    digest = zlib.crc32(feature.encode('utf-8'))
+    vector[digest % VECTOR_DIM] += weight if digest & 0x80000000 else -weight
+
+
+@lru_cache(maxsize=4096)
+def _embed(key):
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for word in _WORD_PATTERN.findall(key):
+        if word in STOP_WORDS:
+            continue
+        weight = GENERIC_WORD_WEIGHT if word in GENERIC_WORDS else 1.0
+        padded = f' {word} '
+        grams = [padded[i:i + size] for size in NGRAM_SIZES for i in range(max(1, len(padded) - size + 1))]
+        for gram in grams:
+            _add_feature(vector, gram, weight / len(grams))
+
+    engine = get_assessment_engine()
+    concepts = {engine.instruments[instrument].questions[question]
+                for instrument, question, _ in engine.match_symptom({'description': key})}
+    for concept in concepts:
+        _add_feature(vector, f'concept:{concept.lower()}', CONCEPT_WEIGHT)
+
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    vector.flags.writeable = False
+    return vector
+
+
+def embed(description):
+    """Return the unit vector of a description (all zeros if it has no words)"""
+    return _embed(description_key(description))
+
+
+def vectors_version():
+    """Identify the embedding: vectors change with the instrument keywords behind the concept features"""
+    return f"d{VECTOR_DIM}-{get_assessment_engine().version}"
+
+
+class SymptomVectorCache:
+    """Persistent, memory-mapped cache of description vectors
+
+    Vectors are appended as float32 rows to one file, which is memory-mapped
+    for reads, and a JSON Lines file records the row of each normalized
+    description. Both live in a directory named by vectors_version(), so a
+    change to the instrument keywords starts a fresh cache instead of mixing
+    vectors of two embeddings.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(STORAGE_DIR, 'symptom_vectors', vectors_version())
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.keys_path = os.path.join(self.directory, 'keys.jsonl')
+        self._row_bytes = VECTOR_DIM * np.dtype(np.float32).itemsize
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._mapped = None
+        self._load()
+
+    def _load(self):
+        """Load the row index from disk"""
+        if not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, encoding='utf-8') as keys_file:
+            for line in keys_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partial last line from an interrupted write
+                self._rows[entry['key']] = entry['row']
+
+    def _append(self, key, vector):
+        """Write a vector and its key to disk and return its row (caller holds the lock)"""
+        os.makedirs(self.directory, exist_ok=True)
+        # One O_APPEND write per row keeps rows whole when several processes share the cache
+        fd = os.open(self.vectors_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, vector.astype(np.float32).tobytes())
+            row = os.lseek(fd, 0, os.SEEK_CUR) // self._row_bytes - 1
+        finally:
+            os.close(fd)
+        with open(self.keys_path, 'a', encoding='utf-8') as keys_file:
+            keys_file.write(json.dumps({'key': key, 'row': row}) + '\n')
+        self._rows[key] = row
+        return row
+
+    def _map(self, rows):
+        """Return a memory map covering at least the given number of rows (caller holds the lock)"""
+        if self._mapped is None or self._mapped.shape[0] < rows:
+            size = os.path.getsize(self.vectors_path) // self._row_bytes
+            self._mapped = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(size, VECTOR_DIM))
+        return self._mapped
+
+    def vectors(self, descriptions):
+        """Return an (n, VECTOR_DIM) array with the vectors of the descriptions, caching new ones"""
+        keys = [description_key(description) for description in descriptions]
+        result = np.zeros((len(keys), VECTOR_DIM), dtype=np.float32)
+        with self._lock:
+            rows = []
+            for i, key in enumerate(keys):
+                if not key:
+                    continue
+                row = self._rows.get(key)
+                if row is None:
+                    row = self._append(key, _embed(key))
+                rows.append((i, row))
+            if rows:
+                positions, row_numbers = zip(*rows)
+                result[list(positions)] = self._map(max(row_numbers) + 1)[list(row_numbers)]
+        return result
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class SymptomIndex:
+    """Random hyperplane LSH index of description vectors
+
+    Each table hashes a vector to the signs of its projections on a few
+    random hyperplanes, so vectors at a small angle tend to share a bucket
+    in at least one table. A query scores only the vectors sharing a bucket
+    with it, exactly, and keeps those above the similarity threshold.
+    """
+
+    def __init__(self, tables=32, bits=8, seed=1):
+        rng = np.random.RandomState(seed)
+        self._planes = rng.standard_normal((tables * bits, VECTOR_DIM)).astype(np.float32)
+        self._weights = (1 << np.arange(bits)).astype(np.int64)
+        self.tables = tables
+        self.bits = bits
+        self._buckets = [{} for _ in range(tables)]
+        self._vectors = []
+        self._items = []
+
+    def _bucket_keys(self, vectors):
+        """Return an (n, tables) array of bucket keys"""
+        signs = (vectors @ self._planes.T > 0).reshape(len(vectors), self.tables, self.bits)
+        return signs @ self._weights
+
+    def add(self, items, vectors):
+        """Index items under their vectors"""
+        start = len(self._items)
+        self._items.extend(items)
+        self._vectors.extend(vectors)
+        for offset, keys in enumerate(self._bucket_keys(np.asarray(vectors, dtype=np.float32))):
+            for table, key in enumerate(keys):
+                self._buckets[table].setdefault(int(key), []).append(start + offset)
+
+    def query(self, vectors, min_similarity=MIN_SIMILARITY):
+        """Return, for each query vector, every (item, similarity) at or above the threshold, most similar first"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        results = []
+        for vector, keys in zip(vectors, self._bucket_keys(vectors)):
+            candidates = {position for table, key in enumerate(keys)
+                          for position in self._buckets[table].get(int(key), ())}
+            found = []
+            if candidates and vector.any():
+                positions = sorted(candidates)
+                similarities = np.stack([self._vectors[position] for position in positions]) @ vector
+                for index in np.argsort(-similarities, kind='stable'):
+                    if similarities[index] < min_similarity:
+                        break
+                    found.append((self._items[positions[index]], float(similarities[index])))
+            results.append(found)
+        return results
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SymptomHistory:
+    """Per-client LSH indexes over every symptom description a client has had
+
+    Each distinct description is indexed once, with the sessions it was
+    recorded in, and sessions are added as they are first seen, so keeping
+    a client's history current costs only the new sessions' symptoms.
+    """
+
+    def __init__(self, vector_cache=None):
+        self._vector_cache = vector_cache
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    @property
+    def vector_cache(self):
+        if self._vector_cache is None:
+            self._vector_cache = get_symptom_vector_cache()
+        return self._vector_cache
+
+    def update(self, client_id, sessions):
+        """Index the symptoms of any of a client's sessions ({session_id: session}) not indexed yet"""
+        with self._lock:
+            history = self._clients.setdefault(client_id, {'index': SymptomIndex(), 'occurrences': {},
+                                                           'sessions': set()})
+            new_keys, new_descriptions = [], []
+            for session_id, session in sessions.items():
+                if session_id in history['sessions']:
+                    continue
+                history['sessions'].add(session_id)
+                for symptom in session['features']['symptoms']:
+                    key = description_key(symptom['description'])
+                    if not key:
+                        continue
+                    if key not in history['occurrences']:
+                        history['occurrences'][key] = []
+                        new_keys.append(key)
+                        new_descriptions.append(symptom['description'])
+                    history['occurrences'][key].append(
+                        {'session_id': session_id, 'date': session['date'], 'description': symptom['description']}
+                    )
+            if new_keys:
+                history['index'].add(new_keys, self.vector_cache.vectors(new_descriptions))
+
+    def earliest_matches(self, client_id, symptoms, before=None):
+        """Return, for each symptom, the earliest recorded occurrence of any similar historical description
+
+        Each match is a dict with the session_id, date and description of
+        that occurrence plus the similarity of its description, or None if
+        nothing in the client's history is similar enough. Only occurrences
+        dated before the given date are considered when one is given, so a
+        symptom's own description, indexed from the session being shown,
+        does not hide earlier paraphrases of it.
+        """
+        history = self._clients.get(client_id)
+        if history is None or not symptoms:
+            return [None] * len(symptoms)
+        vectors = self.vector_cache.vectors([symptom['description'] for symptom in symptoms])
+        with self._lock:
+            matches = []
+            for found in history['index'].query(vectors):
+                # Earliest first, the more similar description on the same date
+                occurrences = [
+                    (occurrence['date'], -similarity, occurrence)
+                    for key, similarity in found for occurrence in history['occurrences'][key]
+                    if before is None or occurrence['date'] < before
+                ]
+                if occurrences:
+                    _, negative_similarity, earliest = min(occurrences, key=lambda entry: entry[:2])
+                    matches.append(dict(earliest, similarity=-negative_similarity))
+                else:
+                    matches.append(None)
+        return matches
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_symptom_vector_cache():
+    """Return the process-wide description vector cache"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = SymptomVectorCache()
+    return _default_cache
+
+
+_default_history = None
+_default_history_lock = threading.Lock()
+
+
+def get_symptom_history():
+    """Return the process-wide per-client symptom history"""
+    global _default_history
+    if _default_history is None:
+        with _default_history_lock:
+            if _default_history is None:
+                _default_history = SymptomHistory()
+    return _default_history
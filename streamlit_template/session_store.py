@@ -0,0 +1,741 @@
+"""Persistent SQLite store of clients, sessions, extracted symptoms, assessment scores, comparisons and rollups"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from utils import STORAGE_DIR
+from result_cache import ResultCache, get_result_cache
+from note_store import get_raw_note_store
+from note_schema import project_note
+from scoring_core import score_note
+from longitudinal import ScoreSeries, series_stats
+from symptom_matching import description_key
+
+# Number of pooled read connections; WAL lets them read while a write is in progress
+SESSION_DB_POOL_SIZE = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    client_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    client_id TEXT NOT NULL REFERENCES clients(client_id),
+    session_date TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    note_ref TEXT NOT NULL,
+    rules_version TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_client_date ON sessions(client_id, session_date);
+CREATE TABLE IF NOT EXISTS symptoms (
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    description TEXT,
+    intensity TEXT,
+    frequency TEXT,
+    duration TEXT,
+    quote TEXT,
+    intensity_level INTEGER,
+    frequency_level INTEGER,
+    duration_days REAL,
+    PRIMARY KEY (session_id, position)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    instrument TEXT NOT NULL,
+    total_score INTEGER NOT NULL,
+    severity TEXT NOT NULL,
+    item_scores TEXT NOT NULL,
+    PRIMARY KEY (session_id, instrument)
+);
+CREATE TABLE IF NOT EXISTS upload_digests (
+    digest TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS client_series (
+    client_id TEXT NOT NULL REFERENCES clients(client_id) ON DELETE CASCADE,
+    instrument TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    total_sum REAL NOT NULL,
+    total_sum_sq REAL NOT NULL,
+    min_total INTEGER NOT NULL,
+    max_total INTEGER NOT NULL,
+    first_date TEXT NOT NULL,
+    first_total INTEGER NOT NULL,
+    last_date TEXT NOT NULL,
+    last_total INTEGER NOT NULL,
+    PRIMARY KEY (client_id, instrument)
+);
+-- Weekly and monthly rollups for the cohort page, kept up to date as sessions are stored:
+-- each client's first and latest total per instrument and period
+CREATE TABLE IF NOT EXISTS client_period_scores (
+    period TEXT NOT NULL,
+    period_start TEXT NOT NULL,
+    client_id TEXT NOT NULL REFERENCES clients(client_id) ON DELETE CASCADE,
+    instrument TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    first_date TEXT NOT NULL,
+    first_total INTEGER NOT NULL,
+    last_date TEXT NOT NULL,
+    last_total INTEGER NOT NULL,
+    PRIMARY KEY (period, period_start, client_id, instrument)
+);
+CREATE INDEX IF NOT EXISTS client_period_scores_client ON client_period_scores(client_id);
+-- and the sessions and clients mentioning each symptom per period
+CREATE TABLE IF NOT EXISTS symptom_rollups (
+    period TEXT NOT NULL,
+    period_start TEXT NOT NULL,
+    symptom TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    clients INTEGER NOT NULL,
+    PRIMARY KEY (period, period_start, symptom)
+);
+-- Which clients mentioned a symptom in a period, so symptom_rollups counts each client once
+CREATE TABLE IF NOT EXISTS client_period_symptoms (
+    period TEXT NOT NULL,
+    period_start TEXT NOT NULL,
+    symptom TEXT NOT NULL,
+    client_id TEXT NOT NULL REFERENCES clients(client_id) ON DELETE CASCADE,
+    PRIMARY KEY (period, period_start, symptom, client_id)
+);
+CREATE INDEX IF NOT EXISTS client_period_symptoms_client ON client_period_symptoms(client_id);
+-- Counters of changes to the whole store; 'scores' moves whenever any client's score series does
+CREATE TABLE IF NOT EXISTS revisions (
+    name TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS comparisons (
+    first_hash TEXT NOT NULL,
+    second_hash TEXT NOT NULL,
+    version TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (first_hash, second_hash, version)
+);
+CREATE INDEX IF NOT EXISTS comparisons_second ON comparisons(second_hash);
+-- A comparison is dropped as soon as either session is edited, deleted or rescored
+CREATE TRIGGER IF NOT EXISTS comparisons_session_updated
+AFTER UPDATE OF content_hash, rules_version ON sessions BEGIN
+    DELETE FROM comparisons WHERE first_hash = OLD.content_hash OR second_hash = OLD.content_hash;
+END;
+CREATE TRIGGER IF NOT EXISTS comparisons_session_deleted AFTER DELETE ON sessions BEGIN
+    DELETE FROM comparisons WHERE first_hash = OLD.content_hash OR second_hash = OLD.content_hash;
+END;
+"""
+
+
+# Columns added after the first release, created on databases that lack them
+ADDED_COLUMNS = {
+    'clients': {'series_revision': 'INTEGER NOT NULL DEFAULT 0'},
+    'sessions': {'rules_version': 'TEXT'},
+    'symptoms': {'intensity_level': 'INTEGER', 'frequency_level': 'INTEGER', 'duration_days': 'REAL'}
+}
+
+
+# Adds one session's total to a client's running statistics; SET expressions see the old row
+SERIES_UPSERT = """
+INSERT INTO client_series VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (client_id, instrument) DO UPDATE SET
+    sessions = sessions + 1,
+    total_sum = total_sum + excluded.total_sum,
+    total_sum_sq = total_sum_sq + excluded.total_sum_sq,
+    min_total = MIN(min_total, excluded.min_total),
+    max_total = MAX(max_total, excluded.max_total),
+    first_total = CASE WHEN excluded.first_date < first_date THEN excluded.first_total ELSE first_total END,
+    first_date = MIN(first_date, excluded.first_date),
+    last_total = CASE WHEN excluded.last_date >= last_date THEN excluded.last_total ELSE last_total END,
+    last_date = MAX(last_date, excluded.last_date)
+"""
+
+# Recomputes the running statistics of the clients matching a condition from their scores
+SERIES_REBUILD = """
+INSERT INTO client_series
+SELECT s.client_id, sc.instrument, COUNT(*), SUM(sc.total_score), SUM(sc.total_score * sc.total_score),
+       MIN(sc.total_score), MAX(sc.total_score), MIN(s.session_date),
+       (SELECT f.total_score FROM sessions fs JOIN scores f ON f.session_id = fs.session_id
+        WHERE fs.client_id = s.client_id AND f.instrument = sc.instrument
+        ORDER BY fs.session_date, fs.rowid LIMIT 1),
+       MAX(s.session_date),
+       (SELECT l.total_score FROM sessions ls JOIN scores l ON l.session_id = ls.session_id
+        WHERE ls.client_id = s.client_id AND l.instrument = sc.instrument
+        ORDER BY ls.session_date DESC, ls.rowid DESC LIMIT 1)
+FROM sessions s JOIN scores sc ON sc.session_id = s.session_id
+WHERE {condition}
+GROUP BY s.client_id, sc.instrument
+"""
+
+
+# SQL giving the first day of the period a session date falls in; NULL for dates SQLite cannot read
+ROLLUP_PERIODS = {
+    'week': "date({date}, '-6 days', 'weekday 1')",
+    'month': "strftime('%Y-%m-01', {date})"
+}
+
+# Adds one session's total to a client's rollup for a period; SET expressions see the old row
+PERIOD_SCORE_UPSERT = """
+INSERT INTO client_period_scores VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+ON CONFLICT (period, period_start, client_id, instrument) DO UPDATE SET
+    sessions = sessions + 1,
+    first_total = CASE WHEN excluded.first_date < first_date THEN excluded.first_total ELSE first_total END,
+    first_date = MIN(first_date, excluded.first_date),
+    last_total = CASE WHEN excluded.last_date >= last_date THEN excluded.last_total ELSE last_total END,
+    last_date = MAX(last_date, excluded.last_date)
+"""
+
+# Recomputes the period rollups of the clients matching a condition from their scores
+PERIOD_SCORE_REBUILD = """
+INSERT INTO client_period_scores
+SELECT ?, period_start, client_id, instrument, COUNT(*),
+       MIN(session_date), MAX(CASE WHEN first_rank = 1 THEN total_score END),
+       MAX(session_date), MAX(CASE WHEN last_rank = 1 THEN total_score END)
+FROM (
+    SELECT {period_start} AS period_start, s.client_id, sc.instrument, s.session_date, sc.total_score,
+           ROW_NUMBER() OVER (PARTITION BY s.client_id, sc.instrument, {period_start}
+                              ORDER BY s.session_date, s.rowid) AS first_rank,
+           ROW_NUMBER() OVER (PARTITION BY s.client_id, sc.instrument, {period_start}
+                              ORDER BY s.session_date DESC, s.rowid DESC) AS last_rank
+    FROM sessions s JOIN scores sc ON sc.session_id = s.session_id
+    WHERE {condition}
+)
+WHERE period_start IS NOT NULL
+GROUP BY period_start, client_id, instrument
+"""
+
+
+def session_id_for_hash(content_hash):
+    """Short content-addressed ID of a session"""
+    return content_hash[:12]
+
+
+class SessionStore:
+    """SQLite-backed store of uploaded sessions shared by every browser tab
+
+    The database runs in WAL mode so dashboard reads never wait on an
+    upload. Reads borrow a connection from a small pool; writes go through
+    a single connection guarded by a lock, since SQLite allows one writer
+    at a time anyway.
+    """
+
+    def __init__(self, path=None, pool_size=SESSION_DB_POOL_SIZE, cache=None):
+        self.path = path or os.path.join(STORAGE_DIR, 'sessions.db')
+        self._results = ResultCache(cache) if cache is not None else get_result_cache()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.executescript(SCHEMA)
+        for table, added_columns in ADDED_COLUMNS.items():
+            columns = [row['name'] for row in self._writer.execute(f'PRAGMA table_info({table})')]
+            for column, column_type in added_columns.items():
+                if column not in columns:
+                    # Sessions of older databases have no rules_version, so they are rescored when read
+                    self._writer.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+        with self._writer:
+            if not self._writer.execute('SELECT 1 FROM client_series LIMIT 1').fetchone():
+                # Databases from before the score series was kept get it computed once
+                self._writer.execute(SERIES_REBUILD.format(condition='1'))
+            if not self._writer.execute('SELECT 1 FROM client_period_scores LIMIT 1').fetchone():
+                # Likewise for the cohort rollups
+                self._rebuild_rollups(self._writer)
+        self._readers = queue.Queue()
+        for _ in range(pool_size):
+            self._readers.put(self._connect())
+        self._series_lock = threading.Lock()
+        self._series = {}
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA foreign_keys=ON')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    @contextmanager
+    def _read(self):
+        """Borrow a pooled read connection"""
+        connection = self._readers.get()
+        try:
+            yield connection
+        finally:
+            self._readers.put(connection)
+
+    @contextmanager
+    def _write(self):
+        """Run statements in one transaction on the writer connection"""
+        with self._write_lock:
+            with self._writer:
+                yield self._writer
+
+    def add_session(self, client_id, session_date, file_name, content_hash, features, note_ref):
+        """Store a session with its symptoms and scores
+
+        Returns (client_id, session_id, added); if the same note content is
+        already stored, the existing client and session are returned and
+        added is False.
+        """
+        session_id = session_id_for_hash(content_hash)
+        with self._write() as db:
+            row = db.execute('SELECT client_id, session_id FROM sessions WHERE content_hash = ?',
+                             (content_hash,)).fetchone()
+            if row:
+                return row['client_id'], row['session_id'], False
+            db.execute('INSERT OR IGNORE INTO clients (client_id) VALUES (?)', (client_id,))
+            db.execute('INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (session_id, client_id, session_date, file_name, content_hash, json.dumps(note_ref),
+                        self._results.version))
+            self._insert_features(db, session_id, features)
+            totals = {instrument: features[instrument]['total_score'] for instrument in features
+                      if instrument != 'symptoms'}
+            db.executemany(SERIES_UPSERT, [
+                (client_id, instrument, total, total * total, total, total, session_date, total, session_date, total)
+                for instrument, total in totals.items()
+            ])
+            revision = self._bump_series_revision(db, client_id)
+            stats = self._series_stats(db, client_id)
+            self._add_to_rollups(db, client_id, session_date, totals, features['symptoms'])
+        # The uploader's features are what the next viewer of this client will need
+        self._results.put('features', (content_hash,), features)
+        with self._series_lock:
+            series = self._series.get(client_id)
+            if series is not None and series.revision == revision - 1:
+                # Readers may hold the old series, so it is replaced rather than changed
+                self._series[client_id] = series.with_session(session_id, session_date, totals, revision, stats)
+            else:
+                self._series.pop(client_id, None)
+        return client_id, session_id, True
+
+    @staticmethod
+    def _bump_series_revision(db, client_id):
+        """Mark a client's score series as changed and return its new revision (inside a transaction)"""
+        db.execute('UPDATE clients SET series_revision = series_revision + 1 WHERE client_id = ?', (client_id,))
+        db.execute("INSERT INTO revisions VALUES ('scores', 1) "
+                   "ON CONFLICT (name) DO UPDATE SET revision = revision + 1")
+        return db.execute('SELECT series_revision FROM clients WHERE client_id = ?', (client_id,)).fetchone()[0]
+
+    @staticmethod
+    def _series_stats(db, client_id):
+        return {row['instrument']: series_stats(row)
+                for row in db.execute('SELECT * FROM client_series WHERE client_id = ?', (client_id,))}
+
+    def _rebuild_series(self, db, client_id):
+        """Recompute a client's running statistics from its scores (inside the caller's transaction)"""
+        db.execute('DELETE FROM client_series WHERE client_id = ?', (client_id,))
+        db.execute(SERIES_REBUILD.format(condition='s.client_id = ?'), (client_id,))
+        self._bump_series_revision(db, client_id)
+
+    @staticmethod
+    def _add_to_rollups(db, client_id, session_date, totals, symptoms):
+        """Count a new session in the weekly and monthly rollups (inside the caller's transaction)"""
+        symptom_keys = {description_key(symptom['description']) for symptom in symptoms} - {''}
+        for period, period_start_sql in ROLLUP_PERIODS.items():
+            period_start = db.execute(f'SELECT {period_start_sql.format(date="?")}', (session_date,)).fetchone()[0]
+            if period_start is None:
+                continue
+            db.executemany(PERIOD_SCORE_UPSERT, [
+                (period, period_start, client_id, instrument, session_date, total, session_date, total)
+                for instrument, total in totals.items()
+            ])
+            SessionStore._add_symptom_counts(db, period, period_start, client_id, symptom_keys)
+
+    @staticmethod
+    def _add_symptom_counts(db, period, period_start, client_id, symptom_keys):
+        """Count one session's symptoms in a period's symptom rollups (inside the caller's transaction)"""
+        for symptom in symptom_keys:
+            # A client counts once per symptom and period, however many sessions mention it
+            new_client = db.execute('INSERT OR IGNORE INTO client_period_symptoms VALUES (?, ?, ?, ?)',
+                                    (period, period_start, symptom, client_id)).rowcount
+            db.execute('INSERT INTO symptom_rollups VALUES (?, ?, ?, 1, ?) '
+                       'ON CONFLICT (period, period_start, symptom) DO UPDATE SET '
+                       'sessions = sessions + 1, clients = clients + excluded.clients',
+                       (period, period_start, symptom, new_client))
+
+    @staticmethod
+    def _client_symptom_periods(db, client_id):
+        """Yield (period, period_start, symptom keys) for each of a client's sessions and rollup periods"""
+        sessions = {}
+        for row in db.execute('SELECT s.session_id, s.session_date, y.description FROM sessions s '
+                              'LEFT JOIN symptoms y ON y.session_id = s.session_id WHERE s.client_id = ?',
+                              (client_id,)):
+            symptoms = sessions.setdefault(row['session_id'], (row['session_date'], set()))[1]
+            symptom = description_key(row['description']) if row['description'] is not None else ''
+            if symptom:
+                symptoms.add(symptom)
+        for session_date, symptoms in sessions.values():
+            if not symptoms:
+                continue
+            for period, period_start_sql in ROLLUP_PERIODS.items():
+                period_start = db.execute(f'SELECT {period_start_sql.format(date="?")}',
+                                          (session_date,)).fetchone()[0]
+                if period_start is not None:
+                    yield period, period_start, symptoms
+
+    def _remove_symptom_counts(self, db, client_id):
+        """Take every session of a client out of the symptom rollups (inside the caller's transaction)"""
+        counts = Counter()
+        for period, period_start, symptoms in self._client_symptom_periods(db, client_id):
+            counts.update((period, period_start, symptom) for symptom in symptoms)
+        db.executemany('UPDATE symptom_rollups SET sessions = sessions - ? '
+                       'WHERE period = ? AND period_start = ? AND symptom = ?',
+                       [(count, *key) for key, count in counts.items()])
+        db.execute('UPDATE symptom_rollups SET clients = clients - 1 WHERE (period, period_start, symptom) IN '
+                   '(SELECT period, period_start, symptom FROM client_period_symptoms WHERE client_id = ?)',
+                   (client_id,))
+        db.execute('DELETE FROM client_period_symptoms WHERE client_id = ?', (client_id,))
+        db.execute('DELETE FROM symptom_rollups WHERE sessions <= 0')
+
+    def _restore_symptom_counts(self, db, client_id):
+        """Count every session of a client in the symptom rollups again (inside the caller's transaction)"""
+        for period, period_start, symptoms in self._client_symptom_periods(db, client_id):
+            self._add_symptom_counts(db, period, period_start, client_id, symptoms)
+
+    @staticmethod
+    def _rebuild_period_scores(db, condition='1', parameters=()):
+        """Recompute the period score rollups of the clients matching a condition"""
+        for period, period_start_sql in ROLLUP_PERIODS.items():
+            db.execute(PERIOD_SCORE_REBUILD.format(period_start=period_start_sql.format(date='s.session_date'),
+                                                   condition=condition), (period, *parameters))
+
+    def _rebuild_rollups(self, db):
+        """Compute every rollup from the stored sessions; done once for databases that predate them"""
+        self._rebuild_period_scores(db)
+        sessions = {}
+        for row in db.execute('SELECT s.session_id, s.client_id, s.session_date, y.description '
+                              'FROM sessions s JOIN symptoms y ON y.session_id = s.session_id'):
+            symptom = description_key(row['description'])
+            if symptom:
+                sessions.setdefault(row['session_id'], (row['client_id'], row['session_date'], set()))[2].add(symptom)
+        for period, period_start_sql in ROLLUP_PERIODS.items():
+            counts = {}
+            for client_id, session_date, symptoms in sessions.values():
+                period_start = db.execute(f'SELECT {period_start_sql.format(date="?")}',
+                                          (session_date,)).fetchone()[0]
+                if period_start is None:
+                    continue
+                for symptom in symptoms:
+                    counts[(period_start, symptom)] = counts.get((period_start, symptom), 0) + 1
+                    db.execute('INSERT OR IGNORE INTO client_period_symptoms VALUES (?, ?, ?, ?)',
+                               (period, period_start, symptom, client_id))
+            db.executemany('INSERT INTO symptom_rollups VALUES (?, ?, ?, ?, 0)',
+                           [(period, period_start, symptom, count)
+                            for (period_start, symptom), count in counts.items()])
+        db.execute('UPDATE symptom_rollups SET clients = (SELECT COUNT(*) FROM client_period_symptoms c '
+                   'WHERE c.period = symptom_rollups.period AND c.period_start = symptom_rollups.period_start '
+                   'AND c.symptom = symptom_rollups.symptom)')
+
+    def rollup_periods(self, period):
+        """Return the first days of every period ('week' or 'month') with sessions, in order"""
+        with self._read() as db:
+            return [row[0] for row in db.execute('SELECT DISTINCT period_start FROM client_period_scores '
+                                                 'WHERE period = ? ORDER BY period_start', (period,))]
+
+    def period_scores(self, period, first_start, last_start, instruments):
+        """Return the client_period_scores rows of the given instruments for periods starting in a range"""
+        placeholders = ','.join('?' * len(instruments))
+        with self._read() as db:
+            return db.execute('SELECT period_start, client_id, instrument, sessions, first_date, first_total, '
+                              'last_date, last_total FROM client_period_scores '
+                              f'WHERE period = ? AND period_start BETWEEN ? AND ? AND instrument IN ({placeholders})',
+                              (period, first_start, last_start, *instruments)).fetchall()
+
+    def symptom_rollups(self, period, first_start, last_start):
+        """Return the symptom_rollups rows (period_start, symptom, sessions, clients) of periods in a range"""
+        with self._read() as db:
+            return db.execute('SELECT period_start, symptom, sessions, clients FROM symptom_rollups '
+                              'WHERE period = ? AND period_start BETWEEN ? AND ?',
+                              (period, first_start, last_start)).fetchall()
+
+    def score_series(self, client_id):
+        """Return the client's ScoreSeries: date-sorted instrument totals with running statistics
+
+        The series kept in memory is returned as long as the client's
+        revision is unchanged, so reading it costs one indexed lookup however
+        many sessions the client has. It must not be modified.
+        """
+        with self._read() as db:
+            # One read transaction, so the revision, points and statistics all come from the same snapshot
+            db.execute('BEGIN')
+            try:
+                row = db.execute('SELECT series_revision FROM clients WHERE client_id = ?', (client_id,)).fetchone()
+                revision = row['series_revision'] if row else 0
+                with self._series_lock:
+                    series = self._series.get(client_id)
+                    if series is not None and series.revision == revision:
+                        return series
+                # Changed by another process, or not read yet: load it in date order from the index
+                points = {}
+                for point in db.execute('SELECT s.session_id, s.session_date, sc.instrument, sc.total_score '
+                                        'FROM sessions s JOIN scores sc ON sc.session_id = s.session_id '
+                                        'WHERE s.client_id = ? ORDER BY s.session_date, s.rowid', (client_id,)):
+                    points.setdefault(point['session_id'], (point['session_date'], {}))[1][point['instrument']] = \
+                        point['total_score']
+                stats = self._series_stats(db, client_id)
+            finally:
+                db.rollback()
+        series = ScoreSeries(client_id, revision, [(session_id, session_date, totals)
+                                                   for session_id, (session_date, totals) in points.items()], stats)
+        with self._series_lock:
+            cached = self._series.get(client_id)
+            # A session stored while this one loaded may already have put a newer series in place
+            if cached is None or cached.revision < revision:
+                self._series[client_id] = series
+        return series
+
+    def score_revision(self):
+        """Return a number that changes whenever any session's scores are added, rescored or moved"""
+        with self._read() as db:
+            row = db.execute("SELECT revision FROM revisions WHERE name = 'scores'").fetchone()
+        return row['revision'] if row else 0
+
+    def score_table(self, instruments):
+        """Return (client_id, session_date, *totals) of every session, by client then date
+
+        totals holds each given instrument's total score (None if the
+        session has none), in the order the instruments are given.
+        """
+        totals = ', '.join('MAX(CASE WHEN sc.instrument = ? THEN sc.total_score END)' for _ in instruments)
+        with self._read() as db:
+            return [tuple(row) for row in db.execute(
+                f'SELECT s.client_id, s.session_date, {totals} '
+                'FROM sessions s LEFT JOIN scores sc ON sc.session_id = s.session_id '
+                'GROUP BY s.session_id ORDER BY s.client_id, s.session_date, s.rowid', list(instruments))]
+
+    @staticmethod
+    def _insert_features(db, session_id, features):
+        """Write a session's symptom and score rows (inside the caller's transaction)"""
+        db.executemany(
+            'INSERT INTO symptoms VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(session_id, position, symptom['description'], symptom['intensity'], symptom['frequency'],
+              symptom['duration'], symptom['quote'], symptom['intensity_level'], symptom['frequency_level'],
+              symptom['duration_days'])
+             for position, symptom in enumerate(features['symptoms'])]
+        )
+        db.executemany(
+            'INSERT INTO scores VALUES (?, ?, ?, ?, ?)',
+            [(session_id, instrument, features[instrument]['total_score'], features[instrument]['severity'],
+              json.dumps(features[instrument]['scores']))
+             for instrument in features if instrument != 'symptoms']
+        )
+
+    def record_upload_digest(self, digest, session_id):
+        """Remember that an uploaded file with this raw digest produced a session"""
+        with self._write() as db:
+            db.execute('INSERT OR IGNORE INTO upload_digests VALUES (?, ?)', (digest, session_id))
+
+    def find_session(self, content_hash=None, upload_digest=None, session_id=None):
+        """Return (client_id, session_id) of a stored note by content hash, raw upload digest or ID, or None"""
+        with self._read() as db:
+            if content_hash is not None:
+                row = db.execute('SELECT client_id, session_id FROM sessions WHERE content_hash = ?',
+                                 (content_hash,)).fetchone()
+            elif session_id is not None:
+                row = db.execute('SELECT client_id, session_id FROM sessions WHERE session_id = ?',
+                                 (session_id,)).fetchone()
+            else:
+                row = db.execute('SELECT s.client_id, s.session_id FROM upload_digests d '
+                                 'JOIN sessions s ON s.session_id = d.session_id WHERE d.digest = ?',
+                                 (upload_digest,)).fetchone()
+        return (row['client_id'], row['session_id']) if row else None
+
+    def client_ids(self):
+        """Return the IDs of clients with at least one session, in order of first upload"""
+        with self._read() as db:
+            rows = db.execute('SELECT client_id FROM clients c WHERE EXISTS '
+                              '(SELECT 1 FROM sessions s WHERE s.client_id = c.client_id) ORDER BY rowid').fetchall()
+        return [row['client_id'] for row in rows]
+
+    def session_listing(self):
+        """Return {client_id: [(session_id, date, file_name)]} for every client with sessions
+
+        Clients come in order of first upload and their sessions most recent
+        first. This is one indexed query: unlike client_sessions(), no
+        features are read or rescored.
+        """
+        listing = {}
+        with self._read() as db:
+            for row in db.execute('SELECT s.client_id, s.session_id, s.session_date, s.file_name '
+                                  'FROM clients c JOIN sessions s ON s.client_id = c.client_id '
+                                  'ORDER BY c.rowid, s.session_date DESC, s.rowid DESC'):
+                listing.setdefault(row['client_id'], []).append(
+                    (row['session_id'], row['session_date'], row['file_name']))
+        return listing
+
+    def session_count(self):
+        """Return the number of stored sessions"""
+        with self._read() as db:
+            return db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    def client_sessions(self, client_id):
+        """Return {session_id: session} for a client, most recent first
+
+        Each session has its date, file_name, content_hash, note_ref and the
+        extracted features (symptoms and assessment results). Features are
+        shared through the process-wide cache, keyed by content hash and rule
+        version, so only sessions no user has viewed yet are read from the
+        symptom and score tables. Sessions scored under other rules are
+        rescored from their stored note and updated in place. The returned
+        features must not be modified.
+        """
+        with self._read() as db:
+            session_rows = db.execute('SELECT * FROM sessions WHERE client_id = ? '
+                                      'ORDER BY session_date DESC, rowid DESC', (client_id,)).fetchall()
+
+        sessions = {}
+        missing = {}
+        stale = []
+        for row in session_rows:
+            features = self._results.get('features', row['content_hash'])
+            sessions[row['session_id']] = {
+                'date': row['session_date'],
+                'file_name': row['file_name'],
+                'content_hash': row['content_hash'],
+                'note_ref': json.loads(row['note_ref']),
+                'features': features
+            }
+            if features is None and row['rules_version'] == self._results.version:
+                missing[row['session_id']] = row['content_hash']
+            elif features is None:
+                stale.append(row['session_id'])
+
+        if missing:
+            for session_id, features in self._load_features(list(missing)).items():
+                self._results.put('features', (missing[session_id],), features)
+                sessions[session_id]['features'] = features
+        if stale:
+            for session_id, features in self._rescore({session_id: sessions[session_id] for session_id in stale}).items():
+                sessions[session_id]['features'] = features
+        return sessions
+
+    def _rescore(self, stale):
+        """Re-extract sessions' features with the current rules and store them
+
+        stale maps session IDs to their sessions. All of them are updated in
+        one transaction, and the score series and rollups of their clients
+        are rebuilt once for the whole batch. Returns {session_id: features}.
+        """
+        notes = get_raw_note_store()
+        rescored = {session_id: score_note(project_note(notes.load_note(session['note_ref'])))
+                    for session_id, session in stale.items()}
+        placeholders = ','.join('?' * len(rescored))
+        with self._write() as db:
+            client_ids = [row['client_id'] for row in db.execute(
+                f'SELECT DISTINCT client_id FROM sessions WHERE session_id IN ({placeholders})', list(rescored))]
+            for client_id in client_ids:
+                self._remove_symptom_counts(db, client_id)
+            for session_id, features in rescored.items():
+                db.execute('DELETE FROM symptoms WHERE session_id = ?', (session_id,))
+                db.execute('DELETE FROM scores WHERE session_id = ?', (session_id,))
+                self._insert_features(db, session_id, features)
+                db.execute('UPDATE sessions SET rules_version = ? WHERE session_id = ?',
+                           (self._results.version, session_id))
+            for client_id in client_ids:
+                self._rebuild_series(db, client_id)
+                db.execute('DELETE FROM client_period_scores WHERE client_id = ?', (client_id,))
+                self._rebuild_period_scores(db, 's.client_id = ?', (client_id,))
+                self._restore_symptom_counts(db, client_id)
+        for session_id, features in rescored.items():
+            self._results.put('features', (stale[session_id]['content_hash'],), features)
+        return rescored
+
+    def _load_features(self, session_ids):
+        """Read the symptoms and assessment results of sessions from their tables"""
+        placeholders = ','.join('?' * len(session_ids))
+        with self._read() as db:
+            symptom_rows = db.execute(f'SELECT * FROM symptoms WHERE session_id IN ({placeholders}) '
+                                      'ORDER BY session_id, position', session_ids).fetchall()
+            score_rows = db.execute(f'SELECT * FROM scores WHERE session_id IN ({placeholders})',
+                                    session_ids).fetchall()
+
+        features = {session_id: {'symptoms': []} for session_id in session_ids}
+        for row in symptom_rows:
+            features[row['session_id']]['symptoms'].append({
+                'description': row['description'],
+                'intensity': row['intensity'],
+                'frequency': row['frequency'],
+                'duration': row['duration'],
+                'quote': row['quote'],
+                'intensity_level': row['intensity_level'],
+                'frequency_level': row['frequency_level'],
+                'duration_days': row['duration_days']
+            })
+        for row in score_rows:
+            features[row['session_id']][row['instrument']] = {
+                'scores': {int(item): score for item, score in json.loads(row['item_scores']).items()},
+                'total_score': row['total_score'],
+                'severity': row['severity']
+            }
+        return features
+
+    def comparison(self, first_hash, second_hash, version):
+        """Return the stored comparison of two sessions' contents under a comparison version, or None"""
+        with self._read() as db:
+            row = db.execute('SELECT result FROM comparisons WHERE first_hash = ? AND second_hash = ? AND version = ?',
+                             (first_hash, second_hash, version)).fetchone()
+        return json.loads(row['result']) if row else None
+
+    def put_comparison(self, first_hash, second_hash, version, result):
+        """Store the comparison of two sessions, replacing any computed under other versions"""
+        with self._write() as db:
+            # Only sessions still stored get a comparison, so the triggers can always invalidate it
+            stored = db.execute('SELECT COUNT(*) FROM sessions WHERE content_hash IN (?, ?)',
+                                (first_hash, second_hash)).fetchone()[0]
+            if stored < len({first_hash, second_hash}):
+                return
+            db.execute('DELETE FROM comparisons WHERE first_hash = ? AND second_hash = ? AND version != ?',
+                       (first_hash, second_hash, version))
+            db.execute('INSERT OR REPLACE INTO comparisons (first_hash, second_hash, version, result) '
+                       'VALUES (?, ?, ?, ?)', (first_hash, second_hash, version, json.dumps(result)))
+
+    def iter_note_refs(self):
+        """Yield (session_id, client_id, note_ref) for every stored session"""
+        with self._read() as db:
+            rows = db.execute('SELECT session_id, client_id, note_ref FROM sessions ORDER BY rowid').fetchall()
+        for row in rows:
+            yield row['session_id'], row['client_id'], json.loads(row['note_ref'])
+
+    def merge_clients(self, source_client_id, target_client_id):
+        """Move every session of one client to another"""
+        with self._write() as db:
+            db.execute('INSERT OR IGNORE INTO clients (client_id) VALUES (?)', (target_client_id,))
+            db.execute('UPDATE sessions SET client_id = ? WHERE client_id = ?', (target_client_id, source_client_id))
+            db.execute('DELETE FROM client_series WHERE client_id = ?', (source_client_id,))
+            self._rebuild_series(db, target_client_id)
+            db.execute('DELETE FROM client_period_scores WHERE client_id IN (?, ?)',
+                       (source_client_id, target_client_id))
+            self._rebuild_period_scores(db, 's.client_id = ?', (target_client_id,))
+            # Symptoms both clients mentioned in a period now count one client fewer
+            shared = ('FROM client_period_symptoms t WHERE t.client_id = ? AND t.period = c.period '
+                      'AND t.period_start = c.period_start AND t.symptom = c.symptom')
+            db.execute('UPDATE symptom_rollups SET clients = clients - 1 WHERE (period, period_start, symptom) IN '
+                       f'(SELECT period, period_start, symptom FROM client_period_symptoms c '
+                       f'WHERE c.client_id = ? AND EXISTS (SELECT 1 {shared}))', (source_client_id, target_client_id))
+            db.execute(f'DELETE FROM client_period_symptoms AS c WHERE c.client_id = ? AND EXISTS (SELECT 1 {shared})',
+                       (source_client_id, target_client_id))
+            db.execute('UPDATE client_period_symptoms SET client_id = ? WHERE client_id = ?',
+                       (target_client_id, source_client_id))
+            db.execute('DELETE FROM clients WHERE client_id = ?', (source_client_id,))
+
+    def close(self):
+        """Close every pooled connection"""
+        self._writer.close()
+        while not self._readers.empty():
+            self._readers.get().close()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Return the process-wide session store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = SessionStore()
+    return _default_store
@@ -0,0 +1,146 @@
+"""Process-wide memory-limited LRU cache shared by every Streamlit session"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Default memory limit of the shared cache of session features
+SHARED_CACHE_BYTES = int(os.environ.get('THERAPY_TRACKER_CACHE_MB', '64')) * 1024 * 1024
+
+_MISSING = object()
+
+
+def estimate_size(value):
+    """Approximate the memory held by a value of nested dicts, lists and scalars"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class ReadWriteLock:
+    """Lock letting many readers in at once, or a single writer
+
+    Waiting writers block new readers, so a steady stream of reads cannot
+    starve an insert.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class SharedCache:
+    """Memory-limited LRU cache that concurrent script threads can share
+
+    Entries are kept in order of use, least recent first. Lookups only take
+    the read side of the lock and move the entry to the end, which is atomic
+    under the GIL, so readers never block each other. Inserts take the
+    write side and, when over the memory limit, evict from the front.
+    Cached values are shared between users and must not be modified.
+    """
+
+    def __init__(self, memory_limit=SHARED_CACHE_BYTES):
+        self.memory_limit = memory_limit
+        self._lock = ReadWriteLock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Approximate under concurrency; for monitoring only
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default"""
+        with self._lock.read():
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, size=None):
+        """Cache a value, evicting least recently used entries if over the memory limit"""
+        if size is None:
+            size = estimate_size(value)
+        if size > self.memory_limit:
+            return  # Would evict everything else and still not fit
+        with self._lock.write():
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.memory_limit:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+
+    def get_or_compute(self, key, compute, size=None):
+        """Return the cached value for key, computing and caching it on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value, size)
+        return value
+
+    def clear(self):
+        with self._lock.write():
+            self._entries.clear()
+            self._bytes = 0
+
+    def memory_used(self):
+        """Return the approximate number of bytes held"""
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Return the process-wide cache of parsed sessions and derived results"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = SharedCache()
+    return _default_cache
@@ -0,0 +1,139 @@
+"""Matching of symptoms between two sessions by their descriptions
+
+Descriptions are matched in two passes. Normalized descriptions are first
+looked up in a dict, which keeps the old exact (case-insensitive) matching
+linear. Only the symptoms left unmatched are then paired by token overlap,
+through an inverted index from tokens to candidates, so "Anxiety and
+stress" still matches "Anxiety" without comparing every pair. Callers may
+add a third pass pairing what is left by description vectors (see
+semantic_matching.py) to catch paraphrases sharing no words.
+"""
+import re
+from functools import lru_cache
+
+# Words carrying no meaning of their own in a symptom description
+STOP_WORDS = frozenset({'a', 'an', 'and', 'as', 'at', 'by', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'})
+
+# Smallest share of the shorter description's tokens the other must contain to match
+MIN_TOKEN_OVERLAP = 0.6
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+@lru_cache(maxsize=4096)
+def _description_key(text):
+    return ' '.join(text.lower().split())
+
+
+def description_key(description):
+    """Return the normalized form under which a description matches exactly"""
+    return _description_key(description) if isinstance(description, str) else ''
+
+
+def _stem(token):
+    # Plural and singular forms ("attacks", "attack") share a token; "stress" keeps its ending
+    return token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') else token
+
+
+@lru_cache(maxsize=4096)
+def _description_tokens(key):
+    return frozenset(_stem(token) for token in _TOKEN_PATTERN.findall(key) if token not in STOP_WORDS)
+
+
+def description_tokens(description):
+    """Return the set of content tokens of a description"""
+    return _description_tokens(description_key(description))
+
+
+def token_overlap(first_tokens, second_tokens):
+    """Return the share of the smaller token set found in the other (0 if either is empty)"""
+    if not first_tokens or not second_tokens:
+        return 0.0
+    return len(first_tokens & second_tokens) / min(len(first_tokens), len(second_tokens))
+
+
+def _pair_best_first(candidates, matched, unmatched_first):
+    """Pair (-score, ..., j, i) candidates one to one, best first; return the first symptoms left unpaired"""
+    paired_first = set()
+    paired_second = set()
+    for *_, j, i in sorted(candidates):
+        if i not in paired_first and j not in paired_second:
+            matched[j] = i
+            paired_first.add(i)
+            paired_second.add(j)
+    return [i for i in unmatched_first if i not in paired_first]
+
+
+def match_symptoms(first_symptoms, second_symptoms, min_overlap=MIN_TOKEN_OVERLAP, vectors=None,
+                   min_similarity=None):
+    """Pair the symptoms of a later session with those of an earlier one
+
+    Returns (matched, new, resolved): matched is a list of (first symptom,
+    second symptom) pairs, new the second-session symptoms matching nothing
+    and resolved the first-session symptoms left unmatched. Exact matches
+    behave as before: every second-session symptom with the description of
+    a first-session symptom matches the first such symptom. Remaining
+    symptoms are paired one to one, best token overlap first. If vectors is
+    given (a function returning unit vectors of descriptions), symptoms still
+    unmatched after that are paired by cosine similarity at or above
+    min_similarity. The input symptoms are returned as they are, never copied.
+    """
+    # Pass 1: exact matches on the normalized description
+    first_index = {}
+    for i, symptom in enumerate(first_symptoms):
+        first_index.setdefault(description_key(symptom['description']), []).append(i)
+
+    matched = [None] * len(second_symptoms)
+    match_counts = {}
+    unmatched_second = []
+    for j, symptom in enumerate(second_symptoms):
+        key = description_key(symptom['description'])
+        indices = first_index.get(key)
+        if indices:
+            matched[j] = indices[0]
+            match_counts[key] = match_counts.get(key, 0) + 1
+        else:
+            unmatched_second.append(j)
+
+    # A first-session symptom is consumed by each exact match on its description, in order
+    unmatched_first = []
+    for key, indices in first_index.items():
+        unmatched_first.extend(indices[match_counts.get(key, 0):])
+
+    # Pass 2: token overlap between the symptoms still unmatched on both sides
+    if unmatched_first and unmatched_second:
+        token_index = {}
+        for i in unmatched_first:
+            for token in description_tokens(first_symptoms[i]['description']):
+                token_index.setdefault(token, []).append(i)
+
+        candidates = []
+        for j in unmatched_second:
+            second_tokens = description_tokens(second_symptoms[j]['description'])
+            for i in {i for token in second_tokens for i in token_index.get(token, ())}:
+                first_tokens = description_tokens(first_symptoms[i]['description'])
+                overlap = token_overlap(first_tokens, second_tokens)
+                if overlap >= min_overlap:
+                    # Prefer the closest overall match, then the earliest symptoms
+                    jaccard = len(first_tokens & second_tokens) / len(first_tokens | second_tokens)
+                    candidates.append((-overlap, -jaccard, j, i))
+
+        unmatched_first = _pair_best_first(candidates, matched, unmatched_first)
+
+    # Pass 3: description vectors, for paraphrases sharing no words
+    unmatched_second = [j for j in unmatched_second if matched[j] is None]
+    if vectors is not None and unmatched_first and unmatched_second:
+        first_vectors = vectors([first_symptoms[i]['description'] for i in unmatched_first])
+        second_vectors = vectors([second_symptoms[j]['description'] for j in unmatched_second])
+        similarities = second_vectors @ first_vectors.T
+        candidates = [(-float(similarities[a, b]), j, i)
+                      for a, j in enumerate(unmatched_second) for b, i in enumerate(unmatched_first)
+                      if similarities[a, b] >= min_similarity]
+        unmatched_first = _pair_best_first(candidates, matched, unmatched_first)
+
+    unmatched_first.sort()
+    return (
+        [(first_symptoms[i], second_symptoms[j]) for j, i in enumerate(matched) if i is not None],
+        [second_symptoms[j] for j, i in enumerate(matched) if i is None],
+        [first_symptoms[i] for i in unmatched_first]
+    )
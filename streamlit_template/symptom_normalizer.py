@@ -0,0 +1,115 @@
+"""Normalization of free-text symptom intensity, frequency and duration into codes
+
+Notes describe symptoms in free text ("High", "Multiple times a day, with
+increasing intensity.", "Approximately six weeks"). Each description is
+parsed once, when symptoms are extracted, into small ordinal codes that the
+scorers and change calculators compare directly. Parsing is memoized by
+string, since the same few descriptions recur across thousands of notes.
+"""
+import re
+from functools import lru_cache
+
+# Ordinal intensity levels of the words a description may contain
+INTENSITY_LEVELS = {
+    'none': 0,
+    'minimal': 1,
+    'mild': 2,
+    'low': 2,
+    'moderate': 3,
+    'high': 4,
+    'severe': 5
+}
+
+# Ordinal frequency levels, from rarest to most frequent, with the phrases indicating each
+FREQUENCY_LEVELS = {
+    1: ('rare', 'seldom'),
+    2: ('occasional', 'sometimes', 'intermittent', 'episodic', 'now and then'),
+    3: ('weekly', 'times a week', 'times per week', 'once a week'),
+    4: ('daily', 'every day', 'each day', 'most days', 'nightly', 'every night'),
+    5: ('times a day', 'times per day', 'hourly'),
+    6: ('constant', 'continuous', 'all the time', 'always', 'throughout the day')
+}
+
+_QUANTITIES = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8,
+    'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'a couple of': 2, 'couple of': 2, 'a few': 3, 'few': 3,
+    'several': 4, 'many': 6
+}
+_UNIT_DAYS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+_DURATION_PATTERN = re.compile(
+    r'\b(\d+(?:\.\d+)?|' + '|'.join(sorted(map(re.escape, _QUANTITIES), key=len, reverse=True)) +
+    r')\s+(day|week|month|year)s?\b'
+)
+
+
+@lru_cache(maxsize=4096)
+def _intensity_levels(text):
+    return tuple(level for word, level in INTENSITY_LEVELS.items() if word in text)
+
+
+def intensity_level(intensity):
+    """Return the ordinal level (0-5) of an intensity description, or None if unrecognized
+
+    A description naming several levels ("mild to moderate") takes the
+    first in INTENSITY_LEVELS order, as the change calculations always have.
+    """
+    levels = _intensity_levels(intensity.lower()) if isinstance(intensity, str) else ()
+    return levels[0] if levels else None
+
+
+def highest_intensity_level(intensity):
+    """Return the highest level an intensity description names, or None if unrecognized
+
+    Instrument intensity rules match any level a description names, so
+    "mild to moderate" scores as moderate.
+    """
+    levels = _intensity_levels(intensity.lower()) if isinstance(intensity, str) else ()
+    return max(levels) if levels else None
+
+
+@lru_cache(maxsize=4096)
+def _frequency_level(text):
+    levels = [level for level, phrases in FREQUENCY_LEVELS.items() if any(phrase in text for phrase in phrases)]
+    return max(levels) if levels else None
+
+
+def frequency_level(frequency):
+    """Return the ordinal level (1 rare - 6 constant) of a frequency description, or None if unrecognized"""
+    return _frequency_level(frequency.lower()) if isinstance(frequency, str) else None
+
+
+@lru_cache(maxsize=4096)
+def _duration_days(text):
+    match = _DURATION_PATTERN.search(text)
+    if not match:
+        return None
+    quantity = match.group(1)
+    quantity = float(quantity) if quantity[0].isdigit() else float(_QUANTITIES[quantity])
+    return quantity * _UNIT_DAYS[match.group(2)]
+
+
+def duration_days(duration):
+    """Return the approximate number of days a duration description spans, or None if unrecognized"""
+    return _duration_days(duration.lower()) if isinstance(duration, str) else None
+
+
+def normalize_symptom(symptom):
+    """Add intensity_level, frequency_level and duration_days codes to an extracted symptom"""
+    symptom['intensity_level'] = intensity_level(symptom['intensity'])
+    symptom['frequency_level'] = frequency_level(symptom['frequency'])
+    symptom['duration_days'] = duration_days(symptom['duration'])
+    return symptom
+
+
+def symptom_intensity_level(symptom):
+    """Return a symptom's intensity level, parsing the description if it was not normalized"""
+    if 'intensity_level' in symptom:
+        return symptom['intensity_level']
+    return intensity_level(symptom.get('intensity'))
+
+
+def symptom_frequency_level(symptom):
+    """Return a symptom's frequency level, parsing the description if it was not normalized"""
+    if 'frequency_level' in symptom:
+        return symptom['frequency_level']
+    return frequency_level(symptom.get('frequency'))
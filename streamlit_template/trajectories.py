@@ -0,0 +1,174 @@
+"""Multi-session trajectories of assessment scores, computed for a whole caseload at once
+
+Scores are laid out as clients x sessions arrays (NaN past a client's last
+session), so every measure is a handful of NumPy operations over the
+caseload rather than a loop over clients:
+- slope: least-squares trend of the total over all sessions, in points per week
+- rci: reliable change index of the latest total against the baseline (first)
+  total, taking the instrument's reliable_change as the 95% threshold
+- reliable_improvement / reliable_deterioration: a change of at least
+  reliable_change points
+- clinically_significant: a reliable improvement from the clinical range
+  (at or above clinical_cutoff) to below it
+- response: the latest total at most half the baseline
+- remission: the latest total at or below remission_max
+- days_to_response: days from the baseline to the first session meeting
+  the response criterion
+Only instruments whose definition has change criteria (see rule_engine.py)
+get trajectories. Clients with a single session get no slope and no flags.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from rule_engine import get_assessment_engine
+
+# Two-sided 95% z value: an RCI beyond it is a reliable change
+RELIABLE_Z = 1.96
+
+# Largest share of the baseline total the latest total may be for a response
+RESPONSE_RATIO = 0.5
+
+# Session store path -> (score revision, caseload trajectory frame) of the last computation
+_caseload = {}
+_caseload_lock = threading.Lock()
+
+MEASURES = ('sessions', 'baseline', 'latest', 'change', 'slope', 'rci', 'reliable_improvement',
+            'reliable_deterioration', 'clinically_significant', 'response', 'remission', 'days_to_response')
+
+
+def trajectory_instruments():
+    """Return the instruments that define change criteria, in display order"""
+    return [instrument for instrument in get_assessment_engine().instruments.values() if instrument.change]
+
+
+def score_arrays(rows, instrument_ids):
+    """Lay out (client_id, session_date, *totals) rows sorted by client and date as arrays
+
+    Returns (client_ids, days, totals): days is a clients x sessions array
+    of days since the earliest session and totals maps each instrument ID to
+    an array of the same shape, both NaN past each client's sessions.
+    """
+    if not rows:
+        # One session column keeps the per-client reductions defined
+        empty = np.full((0, 1), np.nan)
+        return [], empty, {instrument_id: empty.copy() for instrument_id in instrument_ids}
+    frame = pd.DataFrame(rows, columns=['client_id', 'session_date', *instrument_ids])
+    codes, client_ids = pd.factorize(frame['client_id'])
+    # Rows are grouped by client, so a row's position is its distance from its client's first row
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    position = np.arange(len(codes)) - np.repeat(starts, np.diff(np.r_[starts, len(codes)]))
+    shape = (len(client_ids), position.max() + 1)
+
+    dates = pd.to_datetime(frame['session_date']).to_numpy()
+    days = np.full(shape, np.nan)
+    days[codes, position] = (dates - dates.min()) / np.timedelta64(1, 'D')
+    totals = {}
+    for instrument_id in instrument_ids:
+        totals[instrument_id] = np.full(shape, np.nan)
+        totals[instrument_id][codes, position] = frame[instrument_id].to_numpy(dtype=float, na_value=np.nan)
+    return list(client_ids), days, totals
+
+
+def change_flags(tracked, baseline, latest, change):
+    """Return the reliable and clinically significant change flags of arrays of baseline and latest totals
+
+    tracked marks the clients with more than one session; change is the
+    instrument's change criteria. Works on NumPy arrays and pandas Series.
+    """
+    reliable_change = change['reliable_change']
+    cutoff = change['clinical_cutoff']
+    reliable_improvement = tracked & (latest - baseline <= -reliable_change)
+    return {
+        'reliable_improvement': reliable_improvement,
+        'reliable_deterioration': tracked & (latest - baseline >= reliable_change),
+        'clinically_significant': reliable_improvement & (baseline >= cutoff) & (latest < cutoff)
+    }
+
+
+def compute_trajectories(days, totals, change):
+    """Return {measure: array over clients} for one instrument's clients x sessions totals"""
+    observed = ~np.isnan(totals)
+    clients = np.arange(len(totals))
+    sessions = observed.sum(axis=1)
+    tracked = sessions > 1
+    first = observed.argmax(axis=1)
+    last = totals.shape[1] - 1 - observed[:, ::-1].argmax(axis=1)
+    baseline = np.where(sessions > 0, totals[clients, first], np.nan)
+    latest = np.where(sessions > 0, totals[clients, last], np.nan)
+    first_day = days[clients, first]
+
+    # Least-squares slope over each client's observed sessions
+    x = np.where(observed, days, 0.0)
+    y = np.where(observed, totals, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = x.sum(axis=1) / sessions
+        y_mean = y.sum(axis=1) / sessions
+        dx = np.where(observed, x - x_mean[:, None], 0.0)
+        sxx = (dx * dx).sum(axis=1)
+        sxy = (dx * (y - y_mean[:, None])).sum(axis=1)
+        slope = np.where(tracked & (sxx > 0), sxy / sxx * 7, np.nan)
+
+    change_score = np.where(tracked, latest - baseline, np.nan)
+    rci = change_score / (change['reliable_change'] / RELIABLE_Z)
+    flags = change_flags(tracked, baseline, latest, change)
+
+    # First session after the baseline at or below the response threshold
+    responded = observed & (totals <= RESPONSE_RATIO * baseline[:, None]) & (baseline > 0)[:, None]
+    responded &= np.arange(totals.shape[1]) > first[:, None]
+    first_response = responded.argmax(axis=1)
+    days_to_response = np.where(responded.any(axis=1), days[clients, first_response] - first_day, np.nan)
+
+    return {
+        'sessions': sessions,
+        'baseline': baseline,
+        'latest': latest,
+        'change': change_score,
+        'slope': slope,
+        'rci': rci,
+        **flags,
+        'response': tracked & (baseline > 0) & (latest <= RESPONSE_RATIO * baseline),
+        'remission': tracked & (latest <= change['remission_max']),
+        'days_to_response': days_to_response
+    }
+
+
+def trajectory_frame(client_ids, days, totals, instruments=None):
+    """Return a DataFrame indexed by client with one <id>_<measure> column per instrument and measure"""
+    columns = {}
+    for instrument in instruments or trajectory_instruments():
+        measures = compute_trajectories(days, totals[instrument.id], instrument.change)
+        for measure in MEASURES:
+            columns[f'{instrument.id}_{measure}'] = measures[measure]
+    return pd.DataFrame(columns, index=pd.Index(client_ids, name='client_id'))
+
+
+def caseload_trajectories(store):
+    """Compute the trajectories of every client in a session store in one pass
+
+    The frame is kept until the store's score revision changes, so repeat
+    views cost one lookup. It is shared and must not be modified.
+    """
+    revision = store.score_revision()
+    with _caseload_lock:
+        cached = _caseload.get(store.path)
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+    instruments = trajectory_instruments()
+    instrument_ids = [instrument.id for instrument in instruments]
+    client_ids, days, totals = score_arrays(store.score_table(instrument_ids), instrument_ids)
+    frame = trajectory_frame(client_ids, days, totals, instruments)
+    with _caseload_lock:
+        _caseload[store.path] = (revision, frame)
+    return frame
+
+
+def client_trajectory(series):
+    """Compute one client's trajectories from its ScoreSeries (see longitudinal.py); returns a one-row frame"""
+    instruments = trajectory_instruments()
+    instrument_ids = [instrument.id for instrument in instruments]
+    columns = [series.totals.get(instrument_id, [None] * len(series)) for instrument_id in instrument_ids]
+    rows = [(series.client_id, session_date, *totals) for session_date, *totals in zip(series.dates, *columns)]
+    client_ids, days, totals = score_arrays(rows, instrument_ids)
+    return trajectory_frame(client_ids, days, totals, instruments)
@@ -0,0 +1,285 @@
+"""Utility functions for reading and parsing therapy session notes"""
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+from datetime import datetime
+
+# Session note exports prefix every line with its number, e.g. "001|{"
+LINE_NUMBER_PREFIX = re.compile(r'^\d+\|', flags=re.MULTILINE)
+
+# Directory for persistent application data (client index, stores, logs)
+STORAGE_DIR = os.environ.get(
+    'THERAPY_TRACKER_STORAGE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage')
+)
+
+# Notes larger than this (in UTF-8 bytes) are rejected before they are fully read
+MAX_NOTE_BYTES = 20 * 1024 * 1024
+
+# Uploads larger than this are spooled to a temporary file on disk while they are parsed
+NOTE_SPOOL_BYTES = 1024 * 1024
+
+# Bytes read at a time when spooling an upload
+SPOOL_CHUNK_BYTES = 64 * 1024
+
+
+class NoteTooLargeError(ValueError):
+    """Raised when a session note exceeds the configured size cap"""
+
+
+def clean_note_content(content):
+    """Remove line-number prefixes from raw session note content"""
+    return LINE_NUMBER_PREFIX.sub('', content)
+
+
+def strip_line_number(line):
+    """Remove the line-number prefix from a single line of a session note"""
+    match = LINE_NUMBER_PREFIX.match(line)
+    return line[match.end():] if match else line
+
+
+class IncrementalJSONDecoder:
+    """Build a JSON document from text fed in pieces
+
+    Values are added to their containers as soon as they are complete, so
+    only the unparsed tail of the input (at most the token being read and
+    the latest piece) is held besides the document itself. Accepts what
+    json.loads accepts and raises json.JSONDecodeError with positions in
+    the whole input.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        # Position of the buffer's start in the whole input, for error messages
+        self._offset = 0
+        self._lineno = 1
+        self._line_start = 0
+        # Open containers as [container, pending object key], innermost last
+        self._stack = []
+        self._state = 'value'
+        self._value = None
+
+    def feed(self, text):
+        """Parse another piece of the input"""
+        consumed = self._buffer[:self._pos]
+        newlines = consumed.count('\n')
+        if newlines:
+            self._lineno += newlines
+            self._line_start = self._offset + consumed.rfind('\n') + 1
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        self._parse(final=False)
+
+    def close(self):
+        """Finish parsing and return the document"""
+        self._parse(final=True)
+        if self._state != 'end':
+            raise self._error(_EXPECTING[self._state], len(self._buffer))
+        return self._value
+
+    def _error(self, message, pos):
+        """Return a JSONDecodeError for a position in the buffer, located in the whole input"""
+        error = json.JSONDecodeError(message, self._buffer, pos)
+        before = self._buffer[:pos]
+        newlines = before.count('\n')
+        error.pos = self._offset + pos
+        error.lineno = self._lineno + newlines
+        line_start = self._offset + before.rfind('\n') + 1 if newlines else self._line_start
+        error.colno = error.pos - line_start + 1
+        error.args = (f"{message}: line {error.lineno} column {error.colno} (char {error.pos})",)
+        return error
+
+    def _add(self, value):
+        """Put a complete value into the innermost open container, or finish the document"""
+        if not self._stack:
+            self._value = value
+            self._state = 'end'
+            return
+        container, key = self._stack[-1]
+        if isinstance(container, dict):
+            container[key] = value
+        else:
+            container.append(value)
+        self._state = 'comma'
+
+    def _string(self, pos, final):
+        """Scan the string starting at pos; returns (value, end), or None if it continues past the buffer"""
+        try:
+            return json.decoder.scanstring(self._buffer, pos + 1)
+        except json.JSONDecodeError as e:
+            # An unterminated string, or an escape cut off by the end of the piece, may complete later
+            if not final and (e.msg.startswith('Unterminated') or e.pos >= len(self._buffer) - 6):
+                return None
+            raise self._error(e.msg, e.pos)
+
+    def _parse(self, final):
+        buffer, pos = self._buffer, self._pos
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            state = self._state
+            if state == 'end':
+                raise self._error("Extra data", pos)
+            if state in ('value', 'value_or_close'):
+                if char == ']' and state == 'value_or_close':
+                    pos += 1
+                    self._add(self._stack.pop()[0])
+                elif char == '{':
+                    pos += 1
+                    self._stack.append([{}, None])
+                    self._state = 'key_or_close'
+                elif char == '[':
+                    pos += 1
+                    self._stack.append([[], None])
+                    self._state = 'value_or_close'
+                elif char == '"':
+                    scanned = self._string(pos, final)
+                    if scanned is None:
+                        break
+                    value, pos = scanned
+                    self._add(value)
+                else:
+                    match = _NUMBER.match(buffer, pos)
+                    constant = next((name for name in _CONSTANTS if buffer.startswith(name, pos)), None)
+                    if (constant is None and match is None
+                            or match is not None and not buffer[match.end():].strip('.eE+-')):
+                        # A number or constant cut off by the end of the piece
+                        if not final and (match is not None or any(name.startswith(buffer[pos:])
+                                                                   for name in _CONSTANTS)):
+                            break
+                        if match is None:
+                            raise self._error("Expecting value", pos)
+                    if constant is not None:
+                        pos += len(constant)
+                        self._add(_CONSTANTS[constant])
+                    else:
+                        integer, fraction, exponent = match.groups()
+                        pos = match.end()
+                        self._add(float(integer + (fraction or '') + (exponent or ''))
+                                  if fraction or exponent else int(integer))
+            elif state in ('key', 'key_or_close'):
+                if char == '}' and state == 'key_or_close':
+                    pos += 1
+                    self._add(self._stack.pop()[0])
+                elif char == '"':
+                    scanned = self._string(pos, final)
+                    if scanned is None:
+                        break
+                    self._stack[-1][1], pos = scanned
+                    self._state = 'colon'
+                else:
+                    raise self._error(_EXPECTING['key'], pos)
+            elif state == 'colon':
+                if char != ':':
+                    raise self._error(_EXPECTING['colon'], pos)
+                pos += 1
+                self._state = 'value'
+            else:
+                is_object = isinstance(self._stack[-1][0], dict)
+                if char == ',':
+                    pos += 1
+                    self._state = 'key' if is_object else 'value'
+                elif char == ('}' if is_object else ']'):
+                    pos += 1
+                    self._add(self._stack.pop()[0])
+                else:
+                    raise self._error(_EXPECTING['comma'], pos)
+        self._pos = pos
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+_CONSTANTS = {'true': True, 'false': False, 'null': None,
+              'NaN': float('nan'), 'Infinity': float('inf'), '-Infinity': float('-inf')}
+_EXPECTING = {
+    'value': "Expecting value",
+    'value_or_close': "Expecting value",
+    'key': "Expecting property name enclosed in double quotes",
+    'key_or_close': "Expecting property name enclosed in double quotes",
+    'colon': "Expecting ':' delimiter",
+    'comma': "Expecting ',' delimiter"
+}
+
+
+def read_session_note(stream, max_bytes=MAX_NOTE_BYTES):
+    """Stream a session note line by line, stripping line numbers, and parse the JSON
+
+    The stream may yield bytes or str lines. Each line is fed to an
+    IncrementalJSONDecoder as it is read, so besides the parsed note only
+    the current line is held in memory. The size cap counts the note's
+    UTF-8 bytes as they are read, so an oversized note is rejected without
+    being read in full.
+    """
+    size = 0
+    decoder = IncrementalJSONDecoder()
+    for line in stream:
+        if isinstance(line, bytes):
+            size += len(line)
+            line = line.decode('utf-8')
+        else:
+            size += len(line.encode('utf-8'))
+        if max_bytes and size > max_bytes:
+            raise NoteTooLargeError(f"Session note exceeds the size limit of {max_bytes} bytes")
+        decoder.feed(strip_line_number(line))
+    return decoder.close()
+
+
+def spool_upload(stream, max_bytes=MAX_NOTE_BYTES):
+    """Copy an uploaded note into a spooled temporary file, returning (spool, digest of the raw bytes)
+
+    The upload is read and hashed in chunks. The copy stays in memory up to
+    NOTE_SPOOL_BYTES and moves to a temporary file on disk beyond that;
+    uploads over max_bytes are rejected. Closing the spool removes the file.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=NOTE_SPOOL_BYTES)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in iter(lambda: stream.read(SPOOL_CHUNK_BYTES), b''):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise NoteTooLargeError(f"Session note exceeds the size limit of {max_bytes} bytes")
+            digest.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+
+def read_note_file(file_path, **kwargs):
+    """Read and parse a session note file from disk"""
+    with open(file_path, 'rb') as file:
+        return read_session_note(file, **kwargs)
+
+
+def parse_session_note(raw, **kwargs):
+    """Parse raw session note content (bytes or str) into JSON data"""
+    stream = io.BytesIO(raw) if isinstance(raw, bytes) else io.StringIO(raw)
+    return read_session_note(stream, **kwargs)
+
+
+def raw_content_digest(raw):
+    """Digest of the raw uploaded bytes, used to skip re-uploads before parsing"""
+    return hashlib.sha256(raw).hexdigest()
+
+
+def note_content_hash(json_data):
+    """Hash of the canonicalized note content, used as the session identity"""
+    canonical = json.dumps(json_data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def extract_session_date(json_data):
+    """Extract the session date from session notes, defaulting to today"""
+    if isinstance(json_data, dict) and 'Session Date' in json_data:
+        return json_data['Session Date']
+    return datetime.now().strftime("%Y-%m-%d")